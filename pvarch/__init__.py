@@ -15,6 +15,11 @@ from .util import isotime
 from .database import SimpleDB, create_pvarch_main, create_pvarch_data
 from .pvarch import pvarch_main
 
-from .cache import Cache
+def __getattr__(name):
+    # Cache needs pyepics, which is imported only when Cache is used
+    if name == 'Cache':
+        from .cache import Cache
+        return Cache
+    raise AttributeError(f"module 'pvarch' has no attribute '{name}'")
 # from .archiver import Archiver
 # from .schema import initial_sql
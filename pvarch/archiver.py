@@ -4,22 +4,50 @@ import sys
 import os
 import logging
 from decimal import Decimal
+from functools import partial
 
-from sqlalchemy import MetaData, create_engine, engine, text
+from sqlalchemy import MetaData, create_engine, engine, text, select, func, and_
 import numpy as np
+try:
+    from sqlalchemy.dialects.postgresql import distinct_on
+except ImportError:   # sqlalchemy < 2.1
+    distinct_on = None
 
 import epics
 
 from .util import (normalize_pvname, get_force_update_time, tformat,
                    clean_bytes, clean_string, SEC_DAY,
-                   SimpleDbn, None_or_one,
+                   None_or_one,
                    MAX_EPOCH, valid_pvname, motor_fields,
                    get_config)
 
+from .database import (SimpleDB, data_tablenames, is_numeric_table,
+                       archived_tablenames, choose_data_table, ARRAY_TABLE,
+                       CACHE_ARRAY_COLUMN, run_parallel, count_rows,
+                       fetch_columns)
 from .cache import Cache
+from .writer import ArchiveWriter
+from .spool import Spool
+from .blocks import (BlockBuffer, BLOCK_TABLE, read_blocks, iter_blocks,
+                     last_block_values)
+from .compress import SwingingDoor
+from .runcache import RunCache
+from .pvmeta import RunPVs
+from .frozen import FrozenRun, FrozenWriter, frozen_folder, is_frozen
+from .extent import ExtentTracker, has_extents, read_extents, overlaps
+from .rollup import (RollupAccumulator, has_rollups, choose_resolution,
+                     read_rollups, last_rollup_time, rollup_points)
+from .arrays import (decode_array, is_array_blob, stack_arrays, array_blob,
+                     is_array_placeholder)
+from .merge import (window_parts, finish_data, align_data, merge_two,
+                    merge_sorted, merge_chunks)
+from .downsample import (n_buckets, bucket_query, bucket_points,
+                         bucket_reduce, decimate, downsample)
 
 
 def clean_value(val):
+    if isinstance(val, float):
+        return val
     if isinstance(val, bytes):
         val = val.decode('utf-8')
 
@@ -31,6 +59,46 @@ def clean_value(val):
             val = float(val[2:-1])
     return val
 
+def float_value(val):
+    """value as float for typed data tables, or None if not numeric"""
+    try:
+        return float(clean_value(val))
+    except (ValueError, TypeError, AttributeError):
+        return None
+
+def numeric_values(values):
+    """convert values to a float64 ndarray, parsing strings and bytes
+    (including those stored like "b'1.0'").  If any value is not numeric,
+    an object ndarray of strings is returned."""
+    try:
+        return np.asarray(values, dtype='f8')
+    except (ValueError, TypeError):
+        pass
+    sval = np.asarray(values, dtype=str)
+    quoted = np.char.startswith(sval, "b'") & np.char.endswith(sval, "'")
+    if quoted.any():
+        sval[quoted] = np.char.strip(sval[quoted], "b'")
+    try:
+        return sval.astype('f8')
+    except ValueError:
+        return np.array([v.decode('utf-8') if isinstance(v, bytes) else v
+                         for v in values], dtype=object)
+
+def array_values(blobs):
+    "decode array blobs to an object ndarray of ndarrays"
+    out = np.empty(len(blobs), dtype=object)
+    for i, blob in enumerate(blobs):
+        out[i] = decode_array(blob)
+    return out
+
+def column_values(dtable, values):
+    "convert a column of values from a data table to an ndarray"
+    if dtable.name == ARRAY_TABLE:
+        return array_values(values)
+    elif is_numeric_table(dtable):
+        return np.asarray(values, dtype='f8')
+    return numeric_values(values)
+
 class Archiver:
     MIN_TIME = 100
     sql_insert  = "insert into %s (pv_id,time,value) values (%i,%f,%s)"
@@ -39,21 +107,147 @@ class Archiver:
         self.cache = Cache(envvar=envvar, pvconnect=False, **kws)
         self.log  = self.cache.log
         self.dbname = None
+        self.dbs = {}
         self.force_checktime = 0
         self.last_collect = 0
         self.dtime_limbo = {}
+        self.swingdoors = {}
+        self.writer = None
+        self.table_load = None
+        self.table_load_step = 1
+        self.table_load_time = 0
+        self.table_rows = {}
+        self.spool = None
+        self.spool_retry = 0
+        self.run_spans = {}
+        self.frozen = {}
+        self.run_extents = {}
+        self.run_pvs = {}
+        self.runcache = RunCache(max_bytes=int(float(self.config.runcache_size)*2**20),
+                                 cachedir=self.config.runcache_dir,
+                                 chunk_time=float(self.config.runcache_chunk))
+        spoolfile = getattr(self.config, 'archive_spool', '')
+        if spoolfile not in ('', None):
+            self.spool = Spool(spoolfile)
         self.use_archivedb()
 
     def use_archivedb(self, dbname=None):
         if dbname is None:
             dbname = self.cache.get_info(process='archive').db
         self.dbname = dbname
-        self.db = DatabaseConnection(self.dbname, self.config)
+        self.db = self.get_db(self.dbname)
         self.pvtable = self.db.tables['pv']
+        self.numeric_tables = set(name for name in data_tablenames(self.db.tables)
+                                  if is_numeric_table(self.db.tables[name]))
+        self.blocks = None
+        if (getattr(self.config, 'archive_storage', 'rows') == 'blocks' and
+            BLOCK_TABLE in self.db.tables):
+            self.blocks = BlockBuffer(max_samples=int(self.config.archive_block_samples),
+                                      max_time=float(self.config.archive_block_time))
+        self.rollups = None
+        self.rollup_flush_time = time.time()
+        if has_rollups(self.db):
+            self.rollups = RollupAccumulator()
+        self.extents = None
+        self.extent_flush_time = time.time()
+        if has_extents(self.db):
+            self.extents = ExtentTracker()
         # self.pvs    = {k: v for k,v in self.cache.pvs.items()}
         self.pvinfo = {}
         self.refresh_pvinfo()
 
+    def get_db(self, dbname):
+        """get SimpleDB for an archive database, kept for reuse.
+        All connections to a database share an engine and its reflected tables.
+        """
+        if dbname not in self.dbs:
+            self.dbs[dbname] = SimpleDB(dbname, **self.cache.db.connection_args)
+        return self.dbs[dbname]
+
+    def get_run(self, dbname):
+        """get the source of data for reading an archive run: a FrozenRun
+        if the run has been frozen (see freeze_run()), or its SimpleDB"""
+        if dbname in self.frozen:
+            return self.frozen[dbname]
+        frozen_dir = self.config.frozen_dir
+        if dbname != self.dbname and is_frozen(frozen_dir, dbname):
+            self.frozen[dbname] = FrozenRun(frozen_folder(frozen_dir, dbname))
+            return self.frozen[dbname]
+        return self.get_db(dbname)
+
+    def get_run_pvs(self, db):
+        """cache of the pv table of an archive database (see pvmeta.py),
+        shared by all reads, and checked for new PVs unless the run is closed"""
+        run_pvs = self.run_pvs.get(db.dbname, None)
+        if run_pvs is None or run_pvs.db is not db:
+            run_pvs = RunPVs(db, closed=self.is_closed_run(db.dbname),
+                             check_time=float(self.config.pvmeta_check))
+            self.run_pvs[db.dbname] = run_pvs
+        return run_pvs
+
+    def get_extents(self, db):
+        """extents of data for PVs in an archive run, as a dict of
+        {pvname: (first time, last time, count)}, or None if not known.
+        Extents are only used for closed runs, and are kept for reuse."""
+        if not isinstance(db, FrozenRun) and not self.is_closed_run(db.dbname):
+            return None
+        if db.dbname not in self.run_extents:
+            if isinstance(db, FrozenRun):
+                extents = db.extents()
+            else:
+                extents = read_extents(db)
+            self.run_extents[db.dbname] = extents
+        return self.run_extents[db.dbname]
+
+    def runs_with_data(self, pvnames, t0, t1):
+        """
+        sources of data (see get_run()) for archive runs overlapping the
+        time range t0 to t1, skipping closed runs that have no data for
+        any of the PVs in that time range, according to their extents.
+        """
+        out = []
+        for dbname in self.dbs_for_time(t0, t1):
+            db = self.get_run(dbname)
+            extents = self.get_extents(db)
+            if extents is None or any(overlaps(extents.get(pvname, None), t0, t1)
+                                      for pvname in pvnames):
+                out.append(db)
+        return out
+
+    def freeze_run(self, dbname, verbose=True):
+        """
+        freeze a closed archive run into memory-mapped files in the
+        'frozen_dir' folder, see frozen.py.  Reads of the run will then
+        use these files, and the run database is no longer needed.
+
+        returns number of samples written
+        """
+        frozen_dir = self.config.frozen_dir
+        if frozen_dir in ('', None):
+            raise ValueError("config 'frozen_dir' must be set to freeze runs")
+        runs = [run for run in self.cache.get_runs() if run.db == dbname]
+        if (len(runs) == 0 or dbname == self.dbname or
+            runs[0].stop_time > time.time()):
+            raise ValueError(f"'{dbname}' is not a closed archive run")
+        t0 = time.time()
+        db = self.get_db(dbname)
+        rows = sorted(self.get_run_pvs(db).load().values(), key=lambda row: row.id)
+        writer = FrozenWriter(frozen_dir, dbname, runs[0].start_time, runs[0].stop_time)
+        try:
+            for pvrow in rows:
+                times, values, is_array = self.get_run_data(db, pvrow, 0, MAX_EPOCH)
+                writer.add(pvrow.name, pvrow.id, pvrow.data_table, times, values,
+                           is_array=is_array)
+        except:
+            writer.abort()
+            raise
+        writer.close()
+        self.frozen.pop(dbname, None)
+        if verbose:
+            print(f"froze {dbname}: {len(rows)} PVs, {writer.nsamples} samples, "
+                  f"{time.time()-t0:.1f} sec")
+        return writer.nsamples
+
     def refresh_pvinfo(self):
         """
         refresh the 'self.pvinfo' dictionary by re-reading the
@@ -97,7 +291,56 @@ class Archiver:
             t0 = time.time() - SEC_DAY
         if t1 is None:
             t1 = time.time() + SEC_DAY
-        return [run.db for run in self.cache.get_runs(start_time=t0, stop_time=t1)]
+        runs = self.cache.get_runs(start_time=t0, stop_time=t1)
+        for run in runs:
+            self.run_spans[run.db] = (run.start_time, run.stop_time)
+        return [run.db for run in runs]
+
+    def is_closed_run(self, dbname):
+        """whether an archive run has stopped, so that its data will not change.
+        The running archive has a stop time of MAX_EPOCH."""
+        span = self.run_spans.get(dbname, None)
+        return span is not None and span[1] < time.time() and dbname != self.dbname
+
+    def get_run_data_cached(self, db, pvname, t0, t1):
+        """
+        data for a PV from one archive database, as for get_run_data(),
+        using the run cache for closed runs
+        """
+        if isinstance(db, FrozenRun):
+            return db.get_run_data(pvname, t0, t1)
+        if not self.is_closed_run(db.dbname):
+            return self.get_run_data(db, pvname, t0, t1)
+        # chunks are only needed for the time span of the run,
+        # or for the time span of the data for the PV, if known
+        start, stop = self.run_spans[db.dbname]
+        extents = self.get_extents(db)
+        if extents is not None and pvname in extents:
+            start = max(start, extents[pvname][0])
+            stop = min(stop, extents[pvname][1])
+        pvrow = None
+        parts = [(np.zeros(0), np.zeros(0))]
+        for chunk in self.runcache.chunks(max(t0, start-1), min(t1, stop+1)):
+            key = (db.dbname, pvname, chunk)
+            data = self.runcache.get(key)
+            if data is None:
+                if pvrow is None:
+                    pvrow = self.get_pvrow(db, pvname)
+                    if pvrow is None:
+                        return None
+                c0, c1 = self.runcache.chunk_range(chunk)
+                times, values, _ = self.get_run_data(db, pvrow, c0, c1)
+                keep = times < c1
+                data = times[keep], values[keep]
+                self.runcache.put(key, *data)
+            parts.append(data)
+        times = np.concatenate([p[0] for p in parts])
+        values = np.concatenate([p[1] for p in parts])
+        keep = (times >= t0) & (times <= t1)
+        times, values = times[keep], values[keep]
+        is_array = (values.dtype == object and len(values) > 0 and
+                    isinstance(values[0], np.ndarray))
+        return times, values, is_array
 
     def get_value_at_time(self, pvname, t):
         """
@@ -111,32 +354,97 @@ class Archiver:
             self.log("pv %s not found" % (pvname), level='warn')
 
         dbname = self.dbs_for_time(t, t+1)[0]
-        db = DatabaseConnection(dbname, self.config)
-        wclause = text("name='%s'" % pvname)
-        row = db.tables['pv'].select(whereclause=wclause).execute().fetchall()
-        if len(row) < 1:
+        db = self.get_run(dbname)
+        if isinstance(db, FrozenRun):
+            result = db.get_run_data(pvname, t-SEC_DAY, t)
+            if result is None:
+                self.log("no data table for  %s" % (pvname), level='warn')
+                return None, None
+            times, values, is_array = result
+            i = int(np.searchsorted(times, t, side='left')) - 1
+            if i < 0:
+                return None, None
+            value = values[i]
+            if isinstance(value, np.floating):
+                value = float(value)
+            return float(times[i]), value
+
+        row = self.get_pvrow(db, pvname)
+        if row is None:
             self.log("no data table for  %s" % (pvname), level='warn')
+            return None, None
 
-        row = row[0]
         dtable = db.tables[row.data_table]
         query  = dtable.select().where(dtable.c.pv_id==row.id)
         query  = query.where(dtable.c.time>=Decimal(t-SEC_DAY))
         query  = query.where(dtable.c.time<=Decimal(t+0.5))
         query  = query.order_by(dtable.c.time.desc()).limit(100)
-        rows = query.execute().fetchall()
+        rows = [(float(r.time), r.value) for r in db.execute(query).fetchall()]
+        blocks = read_blocks(db, row.id, t-SEC_DAY, t)
+        if len(blocks) > 0:
+            rows = sorted(rows + blocks, key=lambda r: -r[0])
         out = None, None
-        for row in rows:
-            rtime = float(row.time)
+        for rtime, value in rows:
             if rtime < t:
-                out = rtime, row.value
+                out = rtime, value
                 break
-        if isinstance(out[1], bytes):
+        if is_array_blob(out[1]):
+            out = (out[0], decode_array(out[1]))
+        elif isinstance(out[1], bytes):
             out = (out[0], clean_value(out[1]))
         return out
 
-    def get_data(self, pvname, tmin=None, tmax=None, with_current=None):
+    def run_queries(self, funcs, names=None, raise_errors=True):
+        """run independent queries concurrently, returning results in order.
+        A query that fails or times out raises a QueryError naming it (from
+        names), or with raise_errors=False is logged and gives None"""
+        return run_parallel(funcs, workers=self.config.query_workers,
+                            timeout=self.config.query_timeout, names=names,
+                            raise_errors=raise_errors)
+
+    def get_run_rows(self, db, pvname, t0, t1):
+        """
+        list of (time, value) for a PV from one archive database with
+        t0 <= time <= t1, including any data blocks, and whether the values
+        are arrays, or None if the PV is not in the database
+        """
+        if isinstance(db, FrozenRun) or self.is_closed_run(db.dbname):
+            result = self.get_run_data_cached(db, pvname, t0, t1)
+            if result is None:
+                return None
+            times, values, is_array = result
+            return list(zip(times.tolist(), list(values))), is_array
+        pvrow = self.get_pvrow(db, pvname)
+        if pvrow is None:
+            return None
+        dtable = db.tables[pvrow.data_table]
+        query  = dtable.select().where(dtable.c.pv_id==pvrow.id)
+        query  = query.where(dtable.c.time>=t0)
+        query  = query.where(dtable.c.time<=t1)
+        rows   = db.execute(query.order_by(dtable.c.time)).fetchall()
+        # typed tables already hold floats: no need to parse values
+        decode, is_array = clean_value, False
+        if is_numeric_table(dtable):
+            decode = lambda x: x
+        elif dtable.name == ARRAY_TABLE:
+            decode, is_array = decode_array, True
+        rows = [(float(row.time), decode(row.value)) for row in rows]
+        blocks = read_blocks(db, pvrow.id, t0, t1)
+        if len(blocks) > 0:
+            blocks = [(t, clean_value(v)) for t, v in blocks]
+            rows = sorted(rows + blocks, key=lambda r: r[0])
+        return rows, is_array
+
+    def get_data(self, pvname, tmin=None, tmax=None, with_current=None,
+                 as_numpy=False, max_points=None, method='minmax'):
         """
         get data for a PV over a time range, optionally including the current value
+
+        returns lists of times and values, or with as_numpy=True, ndarrays
+        of times and values (float64 for numeric PVs).
+
+        With max_points, data is downsampled to about that many points,
+        with method one of 'minmax', 'mean', or 'lttb' (see downsample.py)
         """
         pvname_raw = pvname
         pvname = normalize_pvname(pvname)
@@ -151,48 +459,470 @@ class Archiver:
                 with_current = True
         if with_current is None:
             with_current = False
+        if max_points is not None:
+            times, values = self.get_data_downsampled(pvname, tmin, tmax,
+                                                      max_points, method=method,
+                                                      with_current=with_current,
+                                                      pvname_raw=pvname_raw)
+            if as_numpy:
+                return times, values
+            return times.tolist(), values.tolist()
+        if as_numpy:
+            return self.get_data_numpy(pvname, tmin, tmax, with_current,
+                                       pvname_raw=pvname_raw)
         timevals, datavals = [], []
-        for dbname in self.dbs_for_time(tmin-SEC_DAY, tmax+5):
-            db = DatabaseConnection(dbname, self.config)
-            wclause = text("name='%s'" % pvname)
-            pvrow = db.tables['pv'].select(whereclause=wclause).execute().fetchall()
-            if len(pvrow) < 1:
+        is_array = False
+        dbs = self.runs_with_data([pvname], tmin-SEC_DAY, tmax+5)
+        for result in self.run_queries([partial(self.get_run_rows, db, pvname,
+                                                tmin-SEC_DAY, tmax+0.5) for db in dbs],
+                                       names=[db.dbname for db in dbs]):
+            if result is None:
                 self.log("no data table for %s" % (pvname), level='warn')
                 continue
-
-            dtable = db.tables[pvrow[0].data_table]
-            query  = dtable.select().where(dtable.c.pv_id==pvrow[0].id)
-            query  = query.where(dtable.c.time>=Decimal(tmin-SEC_DAY))
-            query  = query.where(dtable.c.time<=Decimal(tmax+0.5))
-            rows   = query.order_by(dtable.c.time).execute().fetchall()
+            rows, run_is_array = result
+            is_array = is_array or run_is_array
 
             if len(datavals) == 0:  # include 1 datapoint before tmin
-                for row in reversed(rows):
-                    rtime = float(row.time)
+                for rtime, value in reversed(rows):
                     if rtime <= tmin:
                         timevals = [rtime]
-                        datavals = [clean_value(row.value)]
+                        datavals = [value]
                         break
                 if len(timevals) == 0:
                     logging.warn("could not get 'early value' for %s" % pvname)
-            for row in rows:
-                rtime = float(row.time)
+            for rtime, value in rows:
                 if rtime >= tmin and rtime <= tmax:
-                    timevals.append(float(row.time))
-                    datavals.append(clean_value(row.value))
+                    timevals.append(rtime)
+                    datavals.append(value)
         if with_current:
             cur = self.cache.get_full(pvname)
             if cur is None:
                 cur = self.cache.get_full(pvname_raw)
             if cur is not None:
                 timevals.append(float(time.time()))
-                datavals.append(clean_value(cur.value))
+                blob = getattr(cur, CACHE_ARRAY_COLUMN, None)
+                if is_array and blob is not None:
+                    datavals.append(decode_array(blob))
+                else:
+                    datavals.append(clean_value(cur.value))
 
         # sort time/data by time values
         timevals = np.array(timevals)
         torder   = timevals.argsort()
+        if is_array:
+            # arrays as 2-D array of shape (n_samples, n_elements)
+            return (timevals[torder].tolist(),
+                    stack_arrays([datavals[i] for i in torder]))
         return (timevals[torder].tolist(), np.array(datavals)[torder].tolist())
 
+    def get_pvrow(self, db, pvname):
+        "row of the pv table of an archive database for a PV, or None"
+        return self.get_run_pvs(db).get(pvname)
+
+    def get_run_data(self, db, pvrow, t0, t1):
+        """
+        data for a PV from one archive database with t0 <= time <= t1,
+        including any data blocks, as (times, values, is_array).
+        pvrow can be a row of the pv table or a PV name, giving None
+        if the PV is not in the database.
+        """
+        if isinstance(db, FrozenRun):
+            return db.get_run_data(getattr(pvrow, 'name', pvrow), t0, t1)
+        if isinstance(pvrow, str):
+            pvrow = self.get_pvrow(db, pvrow)
+            if pvrow is None:
+                return None
+        dtable = db.tables[pvrow.data_table]
+        query = select(dtable.c.time, dtable.c.value)
+        query = query.where(dtable.c.pv_id==pvrow.id)
+        query = query.where(dtable.c.time>=t0).where(dtable.c.time<=t1)
+        rtimes, rvalues = fetch_columns(db, query.order_by(dtable.c.time))
+        times = np.asarray(rtimes, dtype='f8')
+        is_array = dtable.name == ARRAY_TABLE
+        values = column_values(dtable, rvalues)
+        btimes, bvalues = read_blocks(db, pvrow.id, t0, t1, as_numpy=True)
+        if len(btimes) > 0:
+            times, values = merge_two((times, values), (btimes, bvalues))
+        return times, values, is_array
+
+    def get_current_part(self, pvname, pvname_raw=None, is_array=False):
+        "current value of a PV from the cache as ([time], [value]) ndarrays, or None"
+        cur = self.cache.get_full(pvname)
+        if cur is None and pvname_raw is not None:
+            cur = self.cache.get_full(pvname_raw)
+        if cur is None:
+            return None
+        blob = getattr(cur, CACHE_ARRAY_COLUMN, None)
+        if is_array and blob is not None:
+            value = array_values([blob])
+        else:
+            value = numeric_values([clean_value(cur.value)])
+        return np.array([time.time()]), value
+
+    def get_data_numpy(self, pvname, tmin, tmax, with_current=False,
+                       pvname_raw=None):
+        """
+        get data for a PV over a time range as ndarrays of times and values,
+        see get_data().  Columns are fetched in bulk, values are converted
+        as arrays, and the sorted data from each run are merged.
+        """
+        parts = []
+        is_array = False
+        have_early = False
+        dbs = self.runs_with_data([pvname], tmin-SEC_DAY, tmax+5)
+        for result in self.run_queries([partial(self.get_run_data_cached, db, pvname,
+                                                tmin-SEC_DAY, tmax+0.5) for db in dbs],
+                                       names=[db.dbname for db in dbs]):
+            if result is None:
+                self.log("no data table for %s" % (pvname), level='warn')
+                continue
+            times, values, run_is_array = result
+            is_array = is_array or run_is_array
+            window = window_parts(times, values, tmin, tmax, early=not have_early)
+            if not have_early:
+                have_early = len(window) > 1
+                if not have_early:
+                    logging.warn("could not get 'early value' for %s" % pvname)
+            parts.extend(window)
+
+        if with_current:
+            current = self.get_current_part(pvname, pvname_raw, is_array=is_array)
+            if current is not None:
+                parts.append(current)
+        return finish_data(parts, is_array=is_array)
+
+    def get_run_data_many(self, db, pvnames, t0, t1):
+        """
+        data for several PVs from one archive database with t0 <= time <= t1,
+        as a dict of {pvname: (times, values, is_array)} for the PVs in the
+        database.  Each data table is read with one query for all its PVs.
+        """
+        if isinstance(db, FrozenRun):
+            out = {}
+            for pvname in pvnames:
+                result = db.get_run_data(pvname, t0, t1)
+                if result is not None:
+                    out[pvname] = result
+            return out
+        by_table = {}
+        for row in self.get_run_pvs(db).get_many(pvnames).values():
+            by_table.setdefault(row.data_table, {})[row.id] = row.name
+
+        out = {}
+        for tname, pvids in by_table.items():
+            dtable = db.tables[tname]
+            query = select(dtable.c.pv_id, dtable.c.time, dtable.c.value)
+            query = query.where(dtable.c.pv_id.in_(list(pvids)))
+            query = query.where(dtable.c.time>=t0).where(dtable.c.time<=t1)
+            query = query.order_by(dtable.c.pv_id, dtable.c.time)
+            rids, rtimes, rvalues = fetch_columns(db, query)
+            ids = np.asarray(rids, dtype='i8')
+            alltimes = np.asarray(rtimes, dtype='f8')
+            # rows are sorted by pv_id: find the rows for each pv_id
+            uids, starts = np.unique(ids, return_index=True)
+            stops = np.r_[starts[1:], len(ids)]
+            found = {int(pv_id): (i0, i1) for pv_id, i0, i1 in zip(uids, starts, stops)}
+            for pv_id, pvname in pvids.items():
+                i0, i1 = found.get(pv_id, (0, 0))
+                times = alltimes[i0:i1]
+                values = column_values(dtable, rvalues[i0:i1])
+                btimes, bvalues = read_blocks(db, pv_id, t0, t1, as_numpy=True)
+                if len(btimes) > 0:
+                    times, values = merge_two((times, values), (btimes, bvalues))
+                out[pvname] = (times, values, dtable.name == ARRAY_TABLE)
+        return out
+
+    def get_data_many(self, pvnames, tmin=None, tmax=None, with_current=None,
+                      align=False):
+        """
+        get data for several PVs over a time range, see get_data().
+
+        For each run, the PVs are looked up with one query of the pv table,
+        and the data for all PVs in a data table is read with one query.
+
+        returns a dict of pvname: (times, values) ndarrays, keyed by the
+        names in pvnames, or with
+        align=True, (times, {pvname: values}) with all values on the
+        same times, see align_data().
+        """
+        names = {}
+        for pvname in pvnames:
+            names[normalize_pvname(pvname)] = pvname
+        if tmin is None:
+            tmin = time.time() - 7*SEC_DAY
+        if tmax is None:
+            tmax = time.time()
+            if with_current is None:
+                with_current = True
+
+        parts = {name: [] for name in names}
+        have_early = {name: False for name in names}
+        is_array = {name: False for name in names}
+        dbs = self.runs_with_data(list(names), tmin-SEC_DAY, tmax+5)
+        for result in self.run_queries([partial(self.get_run_data_many, db, list(names),
+                                                tmin-SEC_DAY, tmax+0.5) for db in dbs],
+                                       names=[db.dbname for db in dbs]):
+            if result is None:
+                continue
+            for pvname, (times, values, run_is_array) in result.items():
+                window = window_parts(times, values, tmin, tmax,
+                                      early=not have_early[pvname])
+                have_early[pvname] = have_early[pvname] or len(window) > 1
+                is_array[pvname] = is_array[pvname] or run_is_array
+                parts[pvname].extend(window)
+
+        data = {}
+        for pvname, pvparts in parts.items():
+            if with_current:
+                current = self.get_current_part(pvname, names[pvname],
+                                                is_array=is_array[pvname])
+                if current is not None:
+                    pvparts.append(current)
+            data[names[pvname]] = finish_data(pvparts, is_array=is_array[pvname])
+        if align:
+            return align_data(data)
+        return data
+
+    def get_run_buckets(self, db, pvname, tmin, tmax, nbuckets, method='minmax',
+                        resolution=None):
+        """
+        bucketed data for a PV from one archive database, see downsample.py,
+        as (part, early, is_array) with part and early (the last point before
+        tmin, or None) each a (times, values) tuple, or None if the PV is not
+        in the database.  Array PVs are not bucketed, giving part=None.
+
+        With a rollup resolution, numeric data is read from the rollup table
+        where it has been written, and bucketed from the data table after that.
+        """
+        if isinstance(db, FrozenRun):
+            result = db.get_run_data(pvname, tmin-SEC_DAY, tmax)
+            if result is None:
+                return None
+            times, values, is_array = result
+            if is_array:
+                return None, None, True
+            i0 = int(np.searchsorted(times, tmin, side='left'))
+            early = (times[i0-1:i0], values[i0-1:i0]) if i0 > 0 else None
+            part = (times[i0:], values[i0:])
+            if values.dtype.kind == 'f':
+                part = bucket_reduce(*part, tmin, tmax, nbuckets, method)
+            return part, early, False
+        pvrow = self.get_pvrow(db, pvname)
+        if pvrow is None:
+            return None
+        dtable = db.tables[pvrow.data_table]
+        if dtable.name == ARRAY_TABLE:
+            return None, None, True
+        early = None
+        times, values, _ = self.get_run_data(db, pvrow, tmin-SEC_DAY, tmin)
+        if len(times) > 0:
+            early = (times[-1:], values[-1:])
+        if is_numeric_table(dtable):
+            tsplit, part = tmin, None
+            if resolution is not None and has_rollups(db):
+                tsplit = tmax
+                if not self.is_closed_run(db.dbname):
+                    tlast = last_rollup_time(db, pvrow.id, resolution)
+                    tsplit = tmin if tlast is None else max(tmin, min(tmax, tlast))
+                if tsplit > tmin:
+                    rollups = read_rollups(db, pvrow.id, tmin, tsplit, resolution)
+                    part = rollup_points(rollups, resolution, method)
+            if tsplit < tmax:
+                query = bucket_query(dtable, pvrow.id, tsplit, tmax, nbuckets)
+                rpart = bucket_points(fetch_columns(db, query), method)
+                btimes, bvalues = read_blocks(db, pvrow.id, tsplit, tmax, as_numpy=True)
+                if len(btimes) > 0:
+                    bpart = bucket_reduce(btimes, bvalues, tsplit, tmax, nbuckets, method)
+                    rpart = merge_two(rpart, bpart)
+                part = rpart if part is None else merge_two(part, rpart)
+        else:
+            times, values, _ = self.get_run_data(db, pvrow, tmin, tmax)
+            part = (times, values)
+            if values.dtype.kind == 'f':
+                part = bucket_reduce(times, values, tmin, tmax, nbuckets, method)
+        return part, early, False
+
+    def iter_run_data(self, db, pvname, tmin, tmax, chunk_size=50000):
+        """
+        iterate over data for a PV from one archive database with
+        tmin <= time <= tmax, yielding (times, values) ndarrays in time
+        order, read chunk_size rows at a time with a server-side cursor
+        """
+        if isinstance(db, FrozenRun):
+            result = db.get_run_data(pvname, tmin, tmax)
+            if result is not None:
+                times, values, _ = result
+                for i0 in range(0, len(times), chunk_size):
+                    yield times[i0:i0+chunk_size], values[i0:i0+chunk_size]
+            return
+        pvrow = self.get_pvrow(db, pvname)
+        if pvrow is None:
+            return
+        dtable = db.tables[pvrow.data_table]
+        query = select(dtable.c.time, dtable.c.value)
+        query = query.where(dtable.c.pv_id==pvrow.id)
+        query = query.where(dtable.c.time>=tmin).where(dtable.c.time<=tmax)
+
+        def table_chunks():
+            with db.engine.connect() as conn:
+                conn = conn.execution_options(stream_results=True,
+                                              yield_per=chunk_size)
+                result = conn.execute(query.order_by(dtable.c.time))
+                for rows in result.partitions():
+                    rtimes, rvalues = tuple(zip(*rows))
+                    yield (np.asarray(rtimes, dtype='f8'),
+                           column_values(dtable, rvalues))
+
+        streams = [table_chunks()]
+        if BLOCK_TABLE in db.tables:
+            streams.append(iter_blocks(db, pvrow.id, tmin, tmax))
+        yield from merge_chunks(streams, chunk_size=chunk_size)
+
+    def iter_data(self, pvname, tmin=None, tmax=None, chunk_size=50000):
+        """
+        iterate over data for a PV with tmin <= time <= tmax, yielding
+        (times, values) ndarrays of at most chunk_size points, in time order.
+
+        Runs are read with server-side cursors and merged as they are
+        read, so that memory use does not depend on the time range.
+        Unlike get_data(), no value before tmin or current value is given.
+        Array values are given as 2-D arrays, as from get_data().
+        """
+        pvname = normalize_pvname(pvname)
+        if tmin is None:
+            tmin = time.time() - 7*SEC_DAY
+        if tmax is None:
+            tmax = time.time()
+        streams = [self.iter_run_data(db, pvname, tmin, tmax, chunk_size=chunk_size)
+                   for db in self.runs_with_data([pvname], tmin, tmax+5)]
+        for times, values in merge_chunks(streams, chunk_size=chunk_size):
+            if (values.dtype == object and len(values) > 0 and
+                isinstance(values[0], np.ndarray)):
+                values = stack_arrays(list(values))
+            yield times, values
+
+    def get_snapshot_table(self, db, tname, pv_ids, t, tmin):
+        """
+        last value at or before t (and after tmin) for several PVs in one
+        data table, with one query, as a dict of {pv_id: (time, value)}
+        """
+        dtable = db.tables[tname]
+        where = (dtable.c.pv_id.in_(list(pv_ids)), dtable.c.time<=t,
+                 dtable.c.time>=tmin)
+        if db.engine.name.startswith('post'):
+            query = select(dtable.c.pv_id, dtable.c.time, dtable.c.value).where(*where)
+            if distinct_on is not None:
+                query = query.ext(distinct_on(dtable.c.pv_id))
+            else:
+                query = query.distinct(dtable.c.pv_id)
+            query = query.order_by(dtable.c.pv_id, dtable.c.time.desc())
+        else:
+            last = select(dtable.c.pv_id, func.max(dtable.c.time).label('tlast'))
+            last = last.where(*where).group_by(dtable.c.pv_id).subquery()
+            query = select(dtable.c.pv_id, dtable.c.time, dtable.c.value)
+            query = query.select_from(dtable.join(last, and_(dtable.c.pv_id==last.c.pv_id,
+                                                             dtable.c.time==last.c.tlast)))
+        out = {}
+        for pv_id, ts, value in db.execute(query).fetchall():
+            if dtable.name == ARRAY_TABLE:
+                value = decode_array(value)
+            elif isinstance(value, bytes):
+                value = value.decode('utf-8')
+            out[pv_id] = (float(ts), value)
+        return out
+
+    def get_snapshot(self, pvnames, t=None):
+        """
+        get the last archived value at or before a time for several PVs,
+        with one query per data table (per run)
+
+        returns dict of {pvname: (time, value)}, keyed by the names in
+        pvnames, for the PVs found
+        """
+        if t is None:
+            t = time.time()
+        names = {}
+        for pvname in pvnames:
+            names[normalize_pvname(pvname)] = pvname
+        tmin = t - SEC_DAY
+        funcs, pvids = [], {}
+        for db in self.runs_with_data(list(names), tmin, t+1):
+            dbname = db.dbname
+            if isinstance(db, FrozenRun):
+                for pvname in names:
+                    if db.has_pv(pvname):
+                        pvids[(dbname, db.pvs[pvname]['id'])] = pvname
+                funcs.append((dbname, partial(db.get_snapshot, list(names), t, tmin)))
+                continue
+            by_table = {}
+            for row in self.get_run_pvs(db).get_many(names).values():
+                by_table.setdefault(row.data_table, []).append(row.id)
+                pvids[(dbname, row.id)] = row.name
+            for tname, ids in by_table.items():
+                funcs.append((dbname, partial(self.get_snapshot_table, db,
+                                              tname, ids, t, tmin)))
+            if BLOCK_TABLE in db.tables:
+                ids = [i for ids in by_table.values() for i in ids]
+                funcs.append((dbname, partial(last_block_values, db, ids, t, tmin)))
+
+        out = {}
+        results = self.run_queries([query for dbname, query in funcs],
+                                   names=[f'{dbname} ({i})' for i, (dbname, query)
+                                          in enumerate(funcs)])
+        for (dbname, query), result in zip(funcs, results):
+            if result is None:
+                continue
+            for pv_id, (ts, value) in result.items():
+                pvname = names[pvids[(dbname, pv_id)]]
+                if pvname not in out or ts >= out[pvname][0]:
+                    out[pvname] = (ts, value)
+        return out
+
+    def get_data_downsampled(self, pvname, tmin, tmax, max_points,
+                             method='minmax', with_current=False,
+                             pvname_raw=None):
+        """
+        get data for a PV over a time range reduced to about max_points,
+        as ndarrays of times and values, see get_data() and downsample.py.
+
+        For the numeric data tables, data is bucketed by the database, or
+        read from the coarsest rollup table giving at least max_points
+        buckets.  Array PVs are reduced by taking evenly spaced samples.
+        """
+        nbuckets = n_buckets(max_points, method)
+        bucket_method = 'minmax' if method == 'lttb' else method
+        resolution = choose_resolution(tmin, tmax, max_points)
+        parts = []
+        early = None
+        dbs = self.runs_with_data([pvname], tmin-SEC_DAY, tmax+5)
+        for result in self.run_queries([partial(self.get_run_buckets, db, pvname,
+                                                tmin, tmax, nbuckets, bucket_method,
+                                                resolution=resolution)
+                                        for db in dbs],
+                                       names=[db.dbname for db in dbs]):
+            if result is None:
+                self.log("no data table for %s" % (pvname), level='warn')
+                continue
+            part, run_early, is_array = result
+            if is_array:
+                times, values = self.get_data_numpy(pvname, tmin, tmax,
+                                                    with_current=with_current,
+                                                    pvname_raw=pvname_raw)
+                return decimate(times, values, max_points)
+            if early is None:
+                early = run_early
+            parts.append(part)
+
+        times, values = merge_sorted(parts)
+        times, values = downsample(times, values, tmin, tmax, max_points, method)
+        parts = [(times, values)]
+        if early is not None:
+            parts.insert(0, early)
+        if with_current:
+            current = self.get_current_part(pvname, pvname_raw)
+            if current is not None:
+                parts.append(current)
+        return finish_data(parts)
 
     def add_pv(self, name, description=None, graph={}, deadtime=None, deadband=None):
         """add PV to the archive database: expected to take a while"""
@@ -236,9 +966,17 @@ class Archiver:
             dtype = 'enum'
         elif pvtype in ('double', 'float'):
             dtype = 'double'
+        if count is not None and count > 1 and pvtype != 'char':
+            dtype = 'array'
+        if dtype == 'array' and ARRAY_TABLE not in self.db.tables:
+            # runs made before array storage have no 'array' PV type
+            dtype = 'string'
 
-        # determine data table
-        table = "pvdat%3.3i" % ((hash(pvname) % 128) + 1)
+        # determine data table: string PVs go to text tables
+        table = choose_data_table(pvname, dtype, table_load=self.get_table_load(),
+                                  tables=self.db.tables)
+        if self.table_load is not None:
+            self.table_load[table] = self.table_load.get(table, 0) + self.table_load_step
 
         # determine descrption (don't try too hard!)
         if description is None:
@@ -312,27 +1050,206 @@ class Archiver:
         dat.update({'last_ts': 0,'last_value':None,
                     'force_time': get_force_update_time()})
         self.pvinfo[name] = dat
+        if self.dbname in self.run_pvs:
+            self.run_pvs[self.dbname].invalidate()
         self.update_value(pvname, time.time(), pv.value)
 
 
+    def get_swingdoor(self, name):
+        """get swinging-door compression state for a PV using
+        compress='swingdoor', with its tolerance (or its deadband if
+        tolerance is not set) from the pv table"""
+        info = self.pvinfo[name]
+        tol = info.get('tolerance', None)
+        if tol is None or float(tol) <= 0:
+            tol = info['deadband']
+        if name not in self.swingdoors:
+            self.swingdoors[name] = SwingingDoor(float(tol))
+        self.swingdoors[name].tolerance = abs(float(tol))
+        return self.swingdoors[name]
+
+    def get_table_load(self):
+        """recent inserts per data table, for choosing data tables for
+        new PVs when archive_table_policy = 'balanced'. This is None for
+        the default policy ('hash'), of placing PVs by a stable hash.
+
+        The load is the number of rows written to each table by this
+        archiver in the last 5 minutes (counted in write_batches(), so
+        without queries of the data tables), or, until values have been
+        written, the number of PVs in each table.
+        """
+        if getattr(self.config, 'archive_table_policy', 'hash') != 'balanced':
+            return None
+        if self.table_load is None or time.time() > self.table_load_time + 300:
+            npvs = {}
+            for info in self.pvinfo.values():
+                tname = info['data_table']
+                npvs[tname] = npvs.get(tname, 0) + 1
+            load, self.table_rows = self.table_rows, {}
+            if len(load) == 0:
+                load = npvs
+            self.table_load = load
+            # expected load of one more PV, to spread out newly added PVs
+            self.table_load_step = max(1, sum(load.values())/max(1, sum(npvs.values())))
+            self.table_load_time = time.time()
+        return self.table_load
+
     def update_value(self, name, ts, val):
         "insert value into appropriate table "
-        if val is None:
-            return
-        if ts is None or ts < self.MIN_TIME:
-            ts = time.time()
+        self.update_values({name: (ts, val)})
+
+    def update_values(self, newvals):
+        """insert many values, grouped by data table
+
+        newvals is a dict of {name: (ts, value)}.  All values go in
+        a single transaction, with one multi-row insert per data table.
+        The 'last_ts' and 'last_value' for each PV are updated only
+        after that transaction has been committed.
+
+        returns number of values inserted
+        """
+        batches, saved = self.make_batches(newvals)
+        self.write_batches(batches)
+        for name, ts, val in saved:
+            self.pvinfo[name]['last_ts'] = ts
+            self.pvinfo[name]['last_value'] = val
+        return len(saved)
+
+    def make_batches(self, newvals):
+        """group {name: (ts, value)} into a batch of rows per data table
 
-        if name not in self.pvinfo:
+        returns batch dict of {data_table: list of rows} and a
+        list of (name, ts, value) for the values included
+        """
+        if any(name not in self.pvinfo for name in newvals):
             self.refresh_pvinfo()
-        info = self.pvinfo[name]
-        self.pvinfo[name]['last_ts'] =  float(ts)
-        self.pvinfo[name]['last_value'] =  val
 
-        info = self.pvinfo[name]
-        dval = clean_bytes(val)
-        self.db.tables[info['data_table']].insert().execute(pv_id=info['id'],
-                                                            time=ts,
-                                                            value=dval)
+        tnow = time.time()
+        batches, saved = {}, []
+        for name, (ts, val) in newvals.items():
+            if val is None or name not in self.pvinfo:
+                continue
+            if ts is None or ts < self.MIN_TIME:
+                ts = tnow
+            info = self.pvinfo[name]
+            tname = info['data_table']
+            if tname in self.numeric_tables:
+                dval = float_value(val)
+                if self.rollups is not None and dval is not None:
+                    for rname, rows in self.rollups.add(info['id'], float(ts), dval).items():
+                        batches.setdefault(rname, []).extend(rows)
+            elif tname == ARRAY_TABLE:
+                dval = array_blob(val)
+                if dval is None:
+                    self.log("cannot store value of %s as an array" % name,
+                             level='warn')
+                    continue
+            else:
+                dval = clean_bytes(val)
+            saved.append((name, float(ts), val))
+            if self.extents is not None:
+                self.extents.add(info['id'], float(ts))
+            if self.blocks is not None and tname != ARRAY_TABLE:
+                block = self.blocks.add(info['id'], float(ts), dval)
+                if block is not None:
+                    if BLOCK_TABLE not in batches:
+                        batches[BLOCK_TABLE] = []
+                    batches[BLOCK_TABLE].append(block)
+                continue
+            if tname not in batches:
+                batches[tname] = []
+            batches[tname].append({'pv_id': info['id'], 'time': float(ts),
+                                   'value': dval})
+
+        if self.rollups is not None and tnow > self.rollup_flush_time + 60.0:
+            # write buckets of PVs that have not changed since the bucket ended
+            self.rollup_flush_time = tnow
+            for rname, rows in self.rollups.flush(before=tnow-60.0).items():
+                batches.setdefault(rname, []).extend(rows)
+        if self.extents is not None and tnow > self.extent_flush_time + 60.0:
+            self.extent_flush_time = tnow
+            for ename, rows in self.extents.flush().items():
+                batches.setdefault(ename, []).extend(rows)
+        if self.blocks is not None:
+            # write blocks that have been open for longer than the block
+            # flush time (or the block time, if shorter)
+            block_flush = min(self.blocks.max_time, float(self.config.archive_block_flush))
+            blocks = self.blocks.flush(older_than=tnow-block_flush)
+            if len(blocks) > 0:
+                if BLOCK_TABLE not in batches:
+                    batches[BLOCK_TABLE] = []
+                batches[BLOCK_TABLE].extend(blocks)
+        return batches, saved
+
+    def flush_blocks(self):
+        "write all samples held in open blocks"
+        if self.blocks is None or len(self.blocks) == 0:
+            return
+        self.write_batches({BLOCK_TABLE: self.blocks.flush()})
+
+    def flush_rollups(self):
+        "write all partly filled rollup buckets"
+        if self.rollups is None or len(self.rollups) == 0:
+            return
+        self.write_batches(self.rollups.flush())
+
+    def flush_extents(self):
+        "write extents of all values added since the last flush"
+        if self.extents is None or len(self.extents) == 0:
+            return
+        self.write_batches(self.extents.flush())
+
+    def write_batches(self, batches):
+        """write batch dict of {data_table: list of rows}, with the
+        archive writer, the spool, or directly"""
+        for tname, rows in batches.items():
+            self.table_rows[tname] = self.table_rows.get(tname, 0) + len(rows)
+        if self.writer is not None:
+            self.writer.put(batches)
+        elif self.spool is not None:
+            self.spool.append(batches, self.dbname)
+            self.replay_spool()
+        else:
+            self.db.insert_batches(batches)
+
+    def replay_spool(self):
+        """replay spooled values into the archive database
+        after a failure, this waits 5 seconds before trying again
+        """
+        if self.spool is None or time.time() < self.spool_retry:
+            return 0
+        try:
+            return self.spool.replay(self.db)
+        except Exception:
+            self.spool_retry = time.time() + 5.0
+            self.log('could not write spooled values to %s, %d bytes pending' %
+                     (self.dbname, self.spool.pending()), level='warn')
+        return 0
+
+    def start_writer(self):
+        """start background writer threads, if configured
+
+        With a writer, values chosen by collect() are queued and written
+        asynchronously, and 'last_ts'/'last_value' are updated when queued.
+        """
+        nthreads = int(getattr(self.config, 'archive_writer_threads', 0))
+        if nthreads < 1 or self.writer is not None:
+            return
+        conf = self.config
+        self.writer = ArchiveWriter(self.db, nthreads=nthreads,
+                                    maxsize=int(conf.archive_queue_size),
+                                    high_water=float(conf.archive_queue_highwater),
+                                    policy=conf.archive_queue_policy,
+                                    spool=self.spool)
+        self.writer.start()
+        self.log('started %d archive writer threads' % nthreads)
+
+    def stop_writer(self):
+        "stop background writer threads, writing all queued values"
+        if self.writer is not None:
+            self.writer.stop()
+            self.log('archive writer stopped: %s' % repr(self.writer.stats()))
+            self.writer = None
 
     def collect(self):
         """ one pass of collecting new values, deciding what to archive"""
@@ -359,6 +1276,22 @@ class Archiver:
                 print("PV not in pvinfo?  ", name)
                 continue
             info = self.pvinfo[name]
+            is_array = info['data_table'] == ARRAY_TABLE
+            if is_array:
+                # the cached blob, or the text of the values without one
+                blob = getattr(dat, CACHE_ARRAY_COLUMN, None)
+                val = dat.value if blob is None else blob
+            elif is_array_placeholder(val):
+                val = dat.value
+            if info.get('compress', 'none') == 'swingdoor':
+                try:
+                    points = self.get_swingdoor(name).add(ts, float(dat.value))
+                except (ValueError, TypeError):
+                    points = [(ts, val)]
+                for point in points:
+                    newvals[name] = point
+                continue
+
             do_save = ts > float(info['last_ts'])+float(info['deadtime'])
             if do_save:
                 if 'double' in dat.type or 'float' in dat.type:
@@ -368,6 +1301,8 @@ class Archiver:
                         do_save = abs(v-o) > abs(info['deadband'])
                     except:
                         do_save = True
+                if is_array:
+                    do_save = val != info['last_value']
 
             if do_save:
                 newvals[name] = (ts, val)
@@ -401,9 +1336,17 @@ class Archiver:
             for row in self.cache.tables['cache'].select().execute().fetchall():
                 fullcache[row.pvname] = row.ts, row.value
 
+            # archive pending swinging-door samples that have not changed
+            for name, door in self.swingdoors.items():
+                for point in door.flush(older_than=tnow-300):
+                    newvals[name] = point
+
             for name, info in self.pvinfo.items():
                 if info['active'] == 'no':
                     continue
+                if info.get('compress', 'none') == 'swingdoor':
+                    # pending samples are archived by the door flush above
+                    continue
                 try:
                     force = tnow > (float(info['last_ts']) +float(info['force_time']))
                 except:
@@ -412,8 +1355,7 @@ class Archiver:
                     newvals[name] = time.time(), fullcache[name][1]
                     n_forced = n_forced + 1
 
-        for name, data in newvals.items():
-            self.update_value(name, data[0], data[1])
+        self.update_values(newvals)
         return n_new, n_forced
 
 
@@ -423,12 +1365,12 @@ class Archiver:
         if limit is set, return as  soon as this limit is seen to be exceeded
         this is useful when checking if any values have been cached.
         """
-        n = 0
-        whereclause = text("time>%d" % (time.time()-minutes*60.0))
-        for i in range(1, 129):
-            q = self.db.tables['pvdat%3.3d' % i].select(whereclause=whereclause)
-            n += len(q.execute().fetchall())
-        return n
+        tmin = time.time() - minutes*60.0
+        tnames = archived_tablenames(self.db.tables)
+        counts = self.run_queries([partial(count_rows, self.db, tname, tmin=tmin)
+                                   for tname in tnames], names=tnames,
+                                  raise_errors=False)
+        return sum(n for n in counts if n is not None)
 
     def mainloop(self,verbose=False):
         t0 = time.time()
@@ -442,7 +1384,14 @@ class Archiver:
         n_changed = n_forced = n_loop = last_report = 0
         last_info = 0
         msg = "%d new values, %d forced entries since last notice. %d loops"
+        qmsg = ("write queue: depth=%(depth)d, max=%(max_depth)d, written=%(written)d, "
+                "dropped=%(dropped)d, errors=%(errors)d")
         self.log('start archiving to %s ' % self.dbname)
+        self.start_writer()
+        if (self.writer is None and self.spool is not None
+            and self.spool.pending() > 0):
+            self.log('replaying %d bytes of spooled values' % self.spool.pending())
+            self.replay_spool()
         while collecting:
             try:
                 epics.poll(evt=0.003, iot=1.0)
@@ -454,6 +1403,8 @@ class Archiver:
                 tnow = time.time()
                 if tnow > last_report + float(self.config.archive_report_period):
                     self.log(msg % (n_changed, n_forced, n_loop))
+                    if self.writer is not None:
+                        self.log(qmsg % self.writer.stats())
                     n_changed = n_forced = n_loop = 0
                     last_report = tnow
                 if tnow > last_info + 2.0:
@@ -471,6 +1422,10 @@ class Archiver:
                 logging.debug('no longer main archiving program, exiting.')
                 collecting = False
 
+        self.flush_blocks()
+        self.flush_rollups()
+        self.flush_extents()
+        self.stop_writer()
         self.cache.set_info(process='archive', status='offline')
         return None
 
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+binary storage of array (waveform) values
+
+Arrays are stored as a blob of a header giving the dtype and shape of
+the array, followed by the raw little-endian data, optionally zlib
+compressed:
+    magic  b'PVA1' (4 bytes), compressed (uint8), ndim (uint8),
+    dtype length (uint8), dtype (bytes), shape (uint32 * ndim), data
+"""
+import json
+import zlib
+import struct
+import numpy as np
+
+ARRAY_MAGIC = b'PVA1'
+HEADER = struct.Struct('<4sBBB')
+
+def is_array_blob(blob):
+    "whether a value is an encoded array"
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:4]) == ARRAY_MAGIC
+
+def encode_array(arr, compress=True):
+    """encode a numpy array (or list) as a binary blob"""
+    arr = np.asarray(arr)
+    if arr.dtype.kind in 'OUS':
+        arr = arr.astype('<f8')
+    arr = arr.astype(arr.dtype.newbyteorder('<'), copy=False)
+    dtype = arr.dtype.str.encode('ascii')
+    data = arr.tobytes()
+    if compress:
+        data = zlib.compress(data)
+    return b''.join((HEADER.pack(ARRAY_MAGIC, int(compress), arr.ndim, len(dtype)),
+                     dtype, struct.pack(f'<{arr.ndim}I', *arr.shape), data))
+
+def array_text(arr):
+    """text of the values of a numeric array, as a JSON list"""
+    return json.dumps(np.asarray(arr).tolist())
+
+def is_array_placeholder(char_value):
+    """whether a char value is the one pyepics gives numeric arrays,
+    as '<array size=10, type=time_double>'"""
+    return isinstance(char_value, str) and char_value.startswith('<array')
+
+def array_blob(value):
+    """an encoded array from a blob, an array or list, or the text of a
+    JSON list (as from array_text()), or None if value is none of these"""
+    if is_array_blob(value):
+        return bytes(value)
+    try:
+        if isinstance(value, str):
+            value = json.loads(value)
+        arr = np.asarray(value)
+        if arr.ndim == 0:
+            return None
+        return encode_array(arr)
+    except (ValueError, TypeError):
+        return None
+
+def decode_array(blob):
+    """decode an array from a binary blob made with encode_array()"""
+    blob = bytes(blob)
+    magic, compressed, ndim, dlen = HEADER.unpack_from(blob, 0)
+    if magic != ARRAY_MAGIC:
+        raise ValueError('not an encoded array')
+    offset = HEADER.size
+    dtype = blob[offset:offset+dlen].decode('ascii')
+    offset += dlen
+    shape = struct.unpack_from(f'<{ndim}I', blob, offset)
+    offset += 4*ndim
+    data = blob[offset:]
+    if compressed:
+        data = zlib.decompress(data)
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+def stack_arrays(arrays):
+    """stack a list of 1-D arrays into a 2-D float array of shape
+    (n_arrays, n_elements), padding shorter arrays with NaN"""
+    if len(arrays) == 0:
+        return np.zeros((0, 0))
+    arrays = [np.ravel(a) for a in arrays]
+    nelem = max(a.size for a in arrays)
+    out = np.full((len(arrays), nelem), np.nan)
+    for i, arr in enumerate(arrays):
+        out[i, :arr.size] = arr
+    return out
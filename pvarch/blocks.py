@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+block storage of archived values: samples for a PV are collected into
+time-bounded blocks, and each block is stored as a single row of the
+'pvblock' table, holding
+
+   pv_id, time (of first sample), t_end (time of last sample),
+   count, times (encoded timestamps), vals (encoded values)
+
+Timestamps are delta-encoded and float values are XOR-encoded against
+the previous value (as for Gorilla), both losslessly, and then zlib
+compressed. String values are stored as zlib-compressed JSON.
+"""
+import json
+import zlib
+import numpy as np
+
+BLOCK_TABLE = 'pvblock'
+KIND_FLOAT = b'd'
+KIND_STRING = b's'
+
+def encode_times(times):
+    """encode float timestamps: deltas of the integer
+    representation of the float64 values, compressed"""
+    ival = np.asarray(times, dtype='<f8').view('<i8')
+    return zlib.compress(np.diff(ival, prepend=0).tobytes())
+
+def decode_times(blob):
+    "decode timestamps from encode_times()"
+    delta = np.frombuffer(zlib.decompress(blob), dtype='<i8')
+    return np.cumsum(delta).view('<f8')
+
+def encode_values(values):
+    """encode values, as floats when all values are numeric,
+    or as strings otherwise"""
+    try:
+        fval = np.asarray(values, dtype='<f8')
+    except (ValueError, TypeError):
+        fval = None
+    if fval is None:
+        sval = [v.decode('utf-8') if isinstance(v, bytes) else str(v)
+                for v in values]
+        return KIND_STRING + zlib.compress(json.dumps(sval).encode('utf-8'))
+    ival = fval.view('<u8')
+    prev = np.zeros_like(ival)
+    prev[1:] = ival[:-1]
+    xval = np.bitwise_xor(ival, prev)
+    return KIND_FLOAT + zlib.compress(xval.tobytes())
+
+def decode_values(blob):
+    "decode values from encode_values(): floats as ndarray, strings as list"
+    kind, data = blob[:1], zlib.decompress(blob[1:])
+    if kind == KIND_STRING:
+        return json.loads(data.decode('utf-8'))
+    xval = np.frombuffer(data, dtype='<u8')
+    return np.bitwise_xor.accumulate(xval).view('<f8')
+
+def make_block(pv_id, samples):
+    """make a row for the block table from a list of (time, value)"""
+    samples = sorted(samples, key=lambda s: s[0])
+    times = [s[0] for s in samples]
+    return {'pv_id': pv_id, 'time': times[0], 't_end': times[-1],
+            'count': len(samples), 'times': encode_times(times),
+            'vals': encode_values([s[1] for s in samples])}
+
+def read_blocks(db, pv_id, tmin, tmax, as_numpy=False):
+    """read samples for a PV from the block table of an archive database
+
+    returns list of (time, value) with tmin <= time <= tmax, sorted by time,
+    or with as_numpy=True, a tuple of (times, values) ndarrays.
+    """
+    tab = db.tables.get(BLOCK_TABLE, None)
+    if tab is None:
+        return (np.zeros(0), np.zeros(0)) if as_numpy else []
+    query = tab.select().where(tab.c.pv_id==pv_id)
+    query = query.where(tab.c.time<=tmax).where(tab.c.t_end>=tmin)
+    rows = db.execute(query.order_by(tab.c.time)).fetchall()
+    if as_numpy:
+        tparts, vparts = [np.zeros(0)], [np.zeros(0)]
+        for row in rows:
+            times = decode_times(row.times)
+            values = np.asarray(decode_values(row.vals))
+            keep = (times >= tmin) & (times <= tmax)
+            tparts.append(times[keep])
+            vparts.append(values[keep])
+        if any(v.dtype.kind != 'f' for v in vparts):
+            vparts = [v.astype(object) for v in vparts]
+        return np.concatenate(tparts), np.concatenate(vparts)
+    out = []
+    for row in rows:
+        times = decode_times(row.times)
+        values = decode_values(row.vals)
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+        for t, val in zip(times.tolist(), values):
+            if t >= tmin and t <= tmax:
+                out.append((t, val))
+    return out
+
+
+def iter_blocks(db, pv_id, tmin, tmax, chunk_size=100):
+    """iterate over samples for a PV from the block table, yielding
+    (times, values) ndarrays for each block, sorted by time, reading
+    chunk_size blocks at a time with a server-side cursor"""
+    tab = db.tables.get(BLOCK_TABLE, None)
+    if tab is None:
+        return
+    query = tab.select().where(tab.c.pv_id==pv_id)
+    query = query.where(tab.c.time<=tmax).where(tab.c.t_end>=tmin)
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=chunk_size)
+        for row in conn.execute(query.order_by(tab.c.time)):
+            times = decode_times(row.times)
+            values = np.asarray(decode_values(row.vals))
+            if values.dtype.kind != 'f':
+                values = values.astype(object)
+            keep = (times >= tmin) & (times <= tmax)
+            yield times[keep], values[keep]
+
+def last_block_values(db, pv_ids, t, tmin):
+    """last value at or before t (and after tmin) for several PVs
+    from the block table of an archive database
+
+    returns dict of {pv_id: (time, value)} for the PVs found
+    """
+    tab = db.tables.get(BLOCK_TABLE, None)
+    out = {}
+    if tab is None or len(pv_ids) == 0:
+        return out
+    query = tab.select().where(tab.c.pv_id.in_(list(pv_ids)))
+    query = query.where(tab.c.time<=t).where(tab.c.t_end>=tmin)
+    for row in db.execute(query.order_by(tab.c.time)).fetchall():
+        times = decode_times(row.times)
+        i = np.searchsorted(times, t, side='right') - 1
+        if i < 0 or times[i] < tmin:
+            continue
+        if row.pv_id not in out or times[i] >= out[row.pv_id][0]:
+            value = decode_values(row.vals)[i]
+            if isinstance(value, np.floating):
+                value = float(value)
+            out[row.pv_id] = (float(times[i]), value)
+    return out
+
+
+class BlockBuffer:
+    """collects samples per PV into blocks
+
+    Arguments
+    ----------
+    max_samples   maximum number of samples in a block [1000]
+    max_time      maximum time span in seconds of a block [3600]
+    """
+    def __init__(self, max_samples=1000, max_time=3600.0):
+        self.max_samples = max_samples
+        self.max_time = max_time
+        self.samples = {}
+
+    def __len__(self):
+        return sum(len(s) for s in self.samples.values())
+
+    def add(self, pv_id, ts, value):
+        """add a sample, returning a block row if the PV's block is complete,
+        or None otherwise"""
+        if pv_id not in self.samples:
+            self.samples[pv_id] = []
+        samples = self.samples[pv_id]
+        samples.append((ts, value))
+        if (len(samples) >= self.max_samples or
+            (ts - samples[0][0]) >= self.max_time):
+            return make_block(pv_id, self.samples.pop(pv_id))
+        return None
+
+    def flush(self, older_than=None):
+        """return block rows for buffered samples, and remove them
+        if older_than is given, only blocks with first sample before
+        that time are returned.
+        """
+        out = []
+        for pv_id in list(self.samples.keys()):
+            samples = self.samples[pv_id]
+            if older_than is None or samples[0][0] < older_than:
+                out.append(make_block(pv_id, self.samples.pop(pv_id)))
+        return out
@@ -8,20 +8,27 @@ import time
 import psutil
 import logging
 import smtplib
+from functools import partial
 from email.mime.text import MIMEText
 
 from decimal import Decimal
 from datetime import datetime
 
 import numpy as np
-from sqlalchemy import text
+from sqlalchemy import text, select, func
 import epics
 
 from .util import (normalize_pvname, tformat, valid_pvname,
                    clean_mail_message, None_or_one, get_credentials,
-                   MAX_EPOCH, motor_fields)
+                   MAX_EPOCH, motor_fields, get_config)
 
-from .database import SimpleDB, CREDENTIALS_ENVVAR
+from .arrays import encode_array, array_text
+from .runindex import RunIndex
+from .database import (SimpleDB, CREDENTIALS_ENVVAR, N_DATA_TABLES,
+                       N_STRING_TABLES, archived_tablenames, run_parallel,
+                       count_rows, time_range, CACHE_ARRAY_COLUMN,
+                       add_cache_array_column, ROLLUP_RESOLUTIONS,
+                       next_data_table)
 
 logging.basicConfig(level=logging.INFO,
                     format='%(levelname)s [%(asctime)s]  %(message)s',
@@ -50,6 +57,7 @@ class Cache(object):
     def __init__(self, pvconnect=True, debug=False, **kws):
         t0 = time.monotonic()
         self.pvconnect = pvconnect
+        self.config = get_config(envvar=kws.get('envvar', 'PVARCH_CONFIG'))
         dbcred = get_credentials(CREDENTIALS_ENVVAR)
         
         self.logger = logging.getLogger()
@@ -63,6 +71,7 @@ class Cache(object):
                             'critical': self.logger.critical}
         main_dbname = dbcred.pop('pvarch_main', 'pvarch_main')
         self.db = SimpleDB(main_dbname, **dbcred)
+        self.has_array_column = add_cache_array_column(self.db)
         self.tables  = self.db.tables
         self.get_status()
 
@@ -71,6 +80,9 @@ class Cache(object):
         self.data  = {}
         self.alert_data = {}
         self.pvtypes = {}
+        self.runindex = None
+        self.runindex_stamp = None
+        self.runindex_checktime = 0
         if self.pvconnect:
             self.get_pvnames()
             self.read_alert_table()
@@ -81,6 +93,14 @@ class Cache(object):
         writer = self.log_writers.get(level, self.logger.info)
         writer(message)
 
+    def run_queries(self, funcs, names=None, raise_errors=True):
+        """run independent queries concurrently, returning results in order.
+        A query that fails or times out raises a QueryError naming it (from
+        names), or with raise_errors=False is logged and gives None"""
+        return run_parallel(funcs, workers=self.config.query_workers,
+                            timeout=self.config.query_timeout, names=names,
+                            raise_errors=raise_errors)
+
 
     def create_next_archive(self, copy_pvs=True):
         """Create a pvdata database for archiving
@@ -103,8 +123,15 @@ class Cache(object):
         dbname = conf.dat_format % (conf.dat_prefix, current_index+1)
         sql = ['create database {dbname:s}; use {dbname:s};'.format(dbname=dbname),
                schema.pvdat_init_pv]
-        for idat in range(1, 129):
+        for idat in range(1, N_DATA_TABLES+1):
             sql.append(schema.pvdat_init_dat.format(idat=idat))
+        for idat in range(1, N_STRING_TABLES+1):
+            sql.append(schema.pvdat_init_str.format(idat=idat))
+        sql.append(schema.pvdat_init_array)
+        sql.append(schema.pvdat_init_block)
+        for res in ROLLUP_RESOLUTIONS:
+            sql.append(schema.pvdat_init_rollup.format(res=res))
+        sql.append(schema.pvdat_init_extent)
 
         self.log("creating database %s" % dbname)
 
@@ -115,30 +142,37 @@ class Cache(object):
 
         runs.insert().execute(db=dbname, notes=notes,
                               start_time=tnow, stop_time=MAX_EPOCH)
+        self.db.set_modify_time()
+        self.runindex_checktime = 0
 
         self.db.engine.execute('\n'.join(sql))
         self.db.flush()
         time.sleep(0.5)
         if copy_pvs and current_dbname is not None:
             print("copy pvs from ", current_dbname)
-            archdb = DatabaseConnection(current_dbname, self.config)
-            nextdb = DatabaseConnection(dbname, self.config)
+            archdb = SimpleDB(current_dbname, **self.db.connection_args)
+            nextdb = SimpleDB(dbname, **self.db.connection_args)
 
             add2next = nextdb.tables['pv'].insert()
             for pvdata in archdb.tables['pv'].select().execute().fetchall():
+                data_table = next_data_table(pvdata.name, pvdata.type,
+                                             pvdata.data_table,
+                                             archdb.tables, nextdb.tables)
                 add2next.execute(name=pvdata.name,
                                  description=pvdata.description,
                                  type=pvdata.type,
-                                 data_table=pvdata.data_table,
+                                 data_table=data_table,
                                  deadtime=pvdata.deadtime,
                                  deadband=pvdata.deadband,
+                                 compress=getattr(pvdata, 'compress', 'none'),
+                                 tolerance=getattr(pvdata, 'tolerance', 0),
                                  graph_lo=pvdata.graph_lo,
                                  graph_hi=pvdata.graph_hi,
                                  graph_type=pvdata.graph_type,
                                  active=pvdata.active)
 
         # update run info
-        self.db = DatabaseConnection(self.config.cache_db, self.config)
+        self.db = SimpleDB(self.db.dbname, **self.db.connection_args)
         self.tables  = self.db.tables
         table = self.db.tables['info']
         table.update().where(table.c.process=='archive').execute(db=dbname)
@@ -158,9 +192,19 @@ class Cache(object):
         return out
    
 
-    def set_info(self, key, value):
-        " set value(s) in the info table"
-        self.db.set_info(key, value)
+    def get_pidstatus(self, process='cache'):
+        """get (pid, status) for a process"""
+        out = self.get_status(process=process)
+        return int(float(out['pid'])), out['status']
+
+    def set_info(self, key=None, value=None, process=None, **kws):
+        """ set value(s) in the info table: a key and value, or
+        values for a process, as keyword arguments"""
+        if key is not None:
+            self.db.set_info(key, value)
+        if process is not None:
+            for name, val in kws.items():
+                self.db.set_info(f'{process}_{name}', str(val))
 
     def get_pvnames(self):
         """ generate self.pvnames: a list of pvnames in the cache"""
@@ -189,15 +233,14 @@ class Cache(object):
         if limit is set, return as  soon as this limit is seen to be exceeded
         this is useful when checking if any values have been cached.
         """
-        n = 0
         archdbname = self.get_info('archive_database')
-        archdb = DatabaseConnection(archdbname, self.config)
-
-        whereclause = text("time>%d" % (time.time()-time_ago))
-        for i in range(1, 129):
-            q = archdb.tables['pvdat%3.3d' % i].select(whereclause=whereclause)
-            n += len(q.execute().fetchall())
-        return n
+        archdb = SimpleDB(archdbname, **self.db.connection_args)
+        tmin = time.time() - time_ago
+        tnames = archived_tablenames(archdb.tables)
+        counts = self.run_queries([partial(count_rows, archdb, tname, tmin=tmin)
+                                   for tname in tnames], names=tnames,
+                                  raise_errors=False)
+        return sum(n for n in counts if n is not None)
 
     def show_status(self, with_archive=True, cache_time=60, archive_time=60):
         pid, status = self.get_info(process='cache').items()
@@ -238,16 +281,14 @@ class Cache(object):
             dbname = current_dbname
         if dbname == current_dbname:
             tmax = MAX_EPOCH - 1.0
-        archdb = DatabaseConnection(dbname, self.config)
-        for i in range(1, 129):
-            tab = archdb.tables['pvdat%3.3d' % i]
-            oldest = tab.select().order_by(tab.c.time)
-            newest = tab.select().order_by(tab.c.time.desc())
-            try:
-                tmin = min(tmin, float(oldest.limit(1).execute().fetchone().time))
-                tmax = max(tmax, float(newest.limit(1).execute().fetchone().time))
-            except:
-                print( "failed to get times ")
+        archdb = SimpleDB(dbname, **self.db.connection_args)
+        tnames = archived_tablenames(archdb.tables)
+        ranges = self.run_queries([partial(time_range, archdb, tname)
+                                   for tname in tnames], names=tnames)
+        for trange in ranges:
+            if trange is not None:
+                tmin = min(tmin, trange[0])
+                tmax = max(tmax, trange[1])
 
         tmin = max(1, min(tmin, MAX_EPOCH-1))
         tmax = max(1, min(tmax, MAX_EPOCH-1))
@@ -262,6 +303,8 @@ class Cache(object):
         runs.update().where(runs.c.db==dbname).execute(notes=notes,
                                                        start_time=tmin,
                                                        stop_time=tmax)
+        self.db.set_modify_time()
+        self.runindex_checktime = 0
 
     def connect_pvs(self):
         """connect to unconnected PVs, make sure callback is defined"""
@@ -397,19 +440,25 @@ class Cache(object):
         newdata = {}
         for pvname in list(self.data.keys()):  # Yes!! data size might change during processing!
             val, cval, tstamp = self.data.pop(pvname)
+            blob = None
             if isinstance(val, np.ndarray):
-                val = val.tolist()
-            if self.pvtypes[pvname] == 'double':
+                # arrays are cached as binary and as text of their values
+                blob, val = encode_array(val), array_text(val)
+            elif self.pvtypes[pvname] == 'double':
                 cval = hformat(val)
-            newdata[pvname] = {'ts': tstamp, 'val': val, 'cval': cval}
+            newdata[pvname] = {'ts': tstamp, 'val': val, 'cval': cval,
+                               'blob': blob}
 
         table = self.tables['cache']
         with self.db.session.begin():
             for pvname, dat in newdata.items():
                 row = table.update().where(table.c.pvname==pvname)
-                row.values({table.c.ts: dat['ts'],
-                            table.c.value: dat['val'],
-                            table.c.cvalue: dat['cval']}).execute()
+                values = {table.c.ts: dat['ts'],
+                          table.c.value: dat['val'],
+                          table.c.cvalue: dat['cval']}
+                if self.has_array_column:
+                    values[table.c[CACHE_ARRAY_COLUMN]] = dat['blob']
+                row.values(values).execute()
         return len(newdata)
 
     def get_values(self, all=False, time_ago=60.0, time_order=False):
@@ -472,6 +521,10 @@ class Cache(object):
                     'timestamp': time.time()}
             if dtype == 'enum':
                 out['enum_strs']  = json.dumps(pv.enum_strs)
+            if isinstance(pv.value, np.ndarray):
+                if self.has_array_column:
+                    out[CACHE_ARRAY_COLUMN] = encode_array(pv.value)
+                out['value'] = array_text(pv.value)
             return out
             
         idicts = []
@@ -706,14 +759,15 @@ See %s%s/plot/1days/now/%s""" % ('\n'.join(mlines),
                             needs_connect_pvs = True
                             self.pvs[pv.pvname] = pv
                             cval = pv.get(as_string=True)
-                            val = pv.value
+                            val, blob = pv.value, None
                             if isinstance(val, np.ndarray):
-                                val = val.tolist()
-                            cache.insert().execute(pvname=pvname, type=pv.type,
-                                                   ts=time.time(),
-                                                   value=val,
-                                                   cvalue=cval,
-                                                   active='yes')
+                                blob, val = encode_array(val), array_text(val)
+                            row = dict(pvname=pvname, type=pv.type,
+                                       ts=time.time(), value=val,
+                                       cvalue=cval, active='yes')
+                            if self.has_array_column:
+                                row[CACHE_ARRAY_COLUMN] = blob
+                            cache.insert().execute(**row)
                             reqtable.delete().where(reqtable.c.id==row.id).execute()
                             msg = 'added'
                         else:
@@ -749,18 +803,30 @@ See %s%s/plot/1days/now/%s""" % ('\n'.join(mlines),
         self.read_alert_table()
         return self.alert_data
 
+    def get_runindex(self):
+        """get RunIndex of the runs table, re-read when the table changes.
+        Changes are checked for at most every 'runindex_check' seconds, with
+        a stamp of the row count, maximum id, and the info 'modify_time',
+        which is set whenever a run is added or its time range is set."""
+        tnow = time.monotonic()
+        if (self.runindex is not None and
+            tnow < self.runindex_checktime + float(self.config.runindex_check)):
+            return self.runindex
+        self.runindex_checktime = tnow
+        runs = self.tables['runs']
+        query = select(func.count(runs.c.id), func.max(runs.c.id))
+        stamp = tuple(self.db.execute(query).fetchone())
+        stamp += (self.db.get_info('modify_time').get('modify_time'),)
+        if self.runindex is None or stamp != self.runindex_stamp:
+            self.runindex = RunIndex(self.db.get_rows('runs'))
+            self.runindex_stamp = stamp
+        return self.runindex
+
     def get_runs(self, start_time=0, stop_time=None):
-        runs = self.db.get_rows('runs')
+        """runs overlapping a time range, sorted by start time"""
         if stop_time is None:
             stop_time = MAX_EPOCH
-        out = []
-        for run in runs:
-            start = run.start_time
-            stop = run.stop_time
-            if run.stop_time  > start_time and run.start_time < stop_time:
-                out.append(run)
-
-        return out
+        return self.get_runindex().overlapping(start_time, stop_time)
 
     def get_related(self, pvname, limit=None):
         """get related PVs for the supplied pvname, a dictionary ordered by score"""
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+swinging-door compression of archived values
+
+For PVs using this policy, a sample is archived only when a straight
+line from the last archived point to the newest sample would no longer
+pass within the PV's tolerance of every sample seen since then. Linear
+interpolation between the archived points then reproduces all samples
+to within the tolerance.
+"""
+INF = float('inf')
+
+class SwingingDoor:
+    """swinging-door trending compression for one PV
+
+    Arguments
+    ----------
+    tolerance   maximum allowed deviation from linear interpolation
+
+    Call add(t, value) for each new sample, which returns a list of
+    (t, value) points that should be archived.
+    """
+    def __init__(self, tolerance):
+        self.tolerance = abs(tolerance)
+        self.anchor = None    # last archived point
+        self.last = None      # most recent sample, not yet archived
+        self.slope_hi = INF
+        self.slope_lo = -INF
+
+    def _open_door(self, t, value):
+        "set door slopes from anchor to a new sample"
+        t0, v0 = self.anchor
+        dt = t - t0
+        self.slope_hi = (value + self.tolerance - v0)/dt
+        self.slope_lo = (value - self.tolerance - v0)/dt
+        self.last = (t, value)
+
+    def add(self, t, value):
+        """add a sample, returning list of points to archive"""
+        if self.anchor is None:
+            self.anchor = (t, value)
+            return [(t, value)]
+        if t <= self.anchor[0] or (self.last is not None and t <= self.last[0]):
+            return []
+        if self.last is None:
+            self._open_door(t, value)
+            return []
+
+        t0, v0 = self.anchor
+        dt = t - t0
+        slope = (value - v0)/dt
+        if slope < self.slope_lo or slope > self.slope_hi:
+            # a line to this sample would miss earlier samples by more
+            # than the tolerance: archive the previous sample as new anchor
+            out = [self.last]
+            self.anchor = self.last
+            self._open_door(t, value)
+            return out
+        self.slope_hi = min(self.slope_hi, (value + self.tolerance - v0)/dt)
+        self.slope_lo = max(self.slope_lo, (value - self.tolerance - v0)/dt)
+        self.last = (t, value)
+        return []
+
+    def flush(self, older_than=None):
+        """return pending sample as a point to archive, and make it the
+        anchor. If older_than is given, this is done only if the pending
+        sample is from before that time.
+        """
+        if self.last is None:
+            return []
+        if older_than is not None and self.last[0] >= older_than:
+            return []
+        out = [self.last]
+        self.anchor, self.last = self.last, None
+        self.slope_hi, self.slope_lo = INF, -INF
+        return out
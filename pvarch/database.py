@@ -1,27 +1,277 @@
 import os
+import io
+import csv
 import time
+import zlib
+import json
+import hashlib
+import logging
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 
-from sqlalchemy import (MetaData, create_engine, and_, text, Table,
-                        Column, ForeignKey, Integer, Float, String,
-                        Text, DateTime, Enum, Boolean)
+from sqlalchemy import (MetaData, create_engine, and_, text, func, select, Table,
+                        Column, ForeignKey, Integer, SmallInteger, BigInteger,
+                        Float, Double, Numeric, String, Text, DateTime, Date,
+                        Time, Enum, Boolean, LargeBinary, Index, inspect)
 
 from sqlalchemy.orm import Session
 from sqlalchemy_utils import database_exists, create_database
 
 from .util import get_credentials, isotime
+from .blocks import BLOCK_TABLE
 
 CREDENTIALS_ENVVAR = 'PVARCH_CREDENTIALS'
 
 CONN_DEFAULT = {'server':'postgres', 'dialect':None,
                 'host':'localhost', 'port':None, 'user':'',
-                'password':'', 'pvarch_main': None}
+                'password':'', 'pvarch_main': None,
+                'pool_size': 5, 'pool_pre_ping': True, 'idle_time': 900}
+
+# minimum number of rows for using COPY instead of INSERT with postgresql
+COPY_MIN_ROWS = 50
+COPY_NULL = '\\N'
+
+# data tables: numeric (int, double, enum) PVs are stored in the
+# float-valued 'pvdat' tables, string PVs in the text-valued 'pvstr' tables
+N_DATA_TABLES = 128
+N_STRING_TABLES = 16
+DATA_PREFIX = 'pvdat'
+STRING_PREFIX = 'pvstr'
+NUMERIC_TYPES = ('int', 'double', 'enum')
+# array (waveform) PVs are stored as binary blobs in a single table
+ARRAY_TABLE = 'pvarray'
+# rollup tables of per-PV aggregates, with resolutions in seconds
+ROLLUP_PREFIX = 'pvroll'
+ROLLUP_RESOLUTIONS = (60, 3600, 86400)
+# table of first and last sample time and number of samples per PV
+EXTENT_TABLE = 'pvextent'
+# column of the cache table holding the encoded value of array PVs
+CACHE_ARRAY_COLUMN = 'array_value'
+
+def data_tablename(index, data_type='double'):
+    """name of data table, with 1-based index, for a PV data_type"""
+    if data_type in NUMERIC_TYPES:
+        return f'{DATA_PREFIX}{index:03d}'
+    return f'{STRING_PREFIX}{index:03d}'
+
+def rollup_tablename(resolution):
+    """name of rollup table for a resolution in seconds"""
+    return f'{ROLLUP_PREFIX}{int(resolution)}'
+
+def data_tablenames(tables):
+    """sorted list of names of data tables in a dict of tables"""
+    return sorted([name for name in tables
+                   if name.startswith(DATA_PREFIX) or name.startswith(STRING_PREFIX)])
+
+def archived_tablenames(tables):
+    """names of all tables of archived values in a dict of tables:
+    the data tables, and the array and block tables if present"""
+    tnames = data_tablenames(tables)
+    for tname in (ARRAY_TABLE, BLOCK_TABLE):
+        if tname in tables:
+            tnames.append(tname)
+    return tnames
+
+def stable_hash(name):
+    """hash of a string that is the same for all processes and platforms,
+    unlike python's hash() of a string"""
+    return zlib.crc32(name.encode('utf-8'))
+
+def choose_data_table(pvname, data_type='double', table_load=None, tables=None):
+    """choose data table for a PV
+
+    Arguments
+    ---------
+    pvname      name of PV
+    data_type   data type of PV ['double']
+    table_load  dict of {tablename: load}, as from the 'nrecent' values
+                of table_report(). If given, the least loaded table of
+                the right kind is used, otherwise the table is chosen by
+                a stable hash of the PV name.
+    tables      tables of the archive database, if given.  Runs made
+                before typed storage have neither string tables nor an
+                array table (and their pvdat tables hold text), so PVs
+                that would use these are put in the pvdat tables.
+    """
+    if tables is not None:
+        if data_type == 'array' and ARRAY_TABLE not in tables:
+            data_type = 'string'
+        if (data_type not in NUMERIC_TYPES and data_type != 'array' and
+            data_tablename(1, data_type) not in tables):
+            data_type = 'double'
+    if data_type == 'array':
+        return ARRAY_TABLE
+    ntables = N_DATA_TABLES if data_type in NUMERIC_TYPES else N_STRING_TABLES
+    hashed = stable_hash(pvname) % ntables
+    if table_load is None:
+        return data_tablename(hashed+1, data_type)
+    # rotate table list by the hash so that ties are broken per PV
+    names = [data_tablename(((hashed + i) % ntables) + 1, data_type)
+             for i in range(ntables)]
+    return min(names, key=lambda name: table_load.get(name, 0))
+
+def is_numeric_table(table):
+    """whether a data table stores values as floats, rather than text
+    (all data tables for runs made before typed storage are text)
+    """
+    return isinstance(table.c.value.type, Float)
+
+def table_kind(tables, tablename):
+    """kind of values stored in a data table: 'array', 'numeric' or 'text'"""
+    if tablename == ARRAY_TABLE:
+        return 'array'
+    return 'numeric' if is_numeric_table(tables[tablename]) else 'text'
+
+def next_data_table(pvname, data_type, data_table, old_tables, new_tables):
+    """data table for a PV copied from one run to the next
+
+    The PV keeps its data table unless the new run does not have that
+    table, or has it holding a different kind of value (as when moving
+    from a run made before typed storage, whose pvdat tables hold text),
+    in which case the table is chosen again for the new run.
+    """
+    if (data_table in new_tables and data_table in old_tables and
+        table_kind(old_tables, data_table) == table_kind(new_tables, data_table)):
+        return data_table
+    return choose_data_table(pvname, data_type, tables=new_tables)
+
+def data_index(table, covering=False, server='postgresql'):
+    """composite (pv_id, time) index for a data table, named
+    '<tablename>_pvtime'. With covering=True, the index also covers
+    the values (as INCLUDE for postgresql, or as a third column for
+    float-valued tables with other servers).
+    """
+    cols, opts = [table.c.pv_id, table.c.time], {}
+    if covering and 'value' in table.c and table.name != ARRAY_TABLE:
+        if server.startswith('post'):
+            opts['postgresql_include'] = ['value']
+        elif is_numeric_table(table):
+            cols.append(table.c.value)
+    return Index(f'{table.name}_pvtime', *cols, **opts)
+
+def rollup_table(metadata, resolution):
+    """rollup table for a resolution in seconds: count, min, max, mean,
+    first, and last value per PV for buckets starting at 'time'"""
+    return Table(rollup_tablename(resolution), metadata,
+                 Column('pv_id', ForeignKey('pv.id')),
+                 Column('time', Float),
+                 Column('count', Integer),
+                 Column('vmin', Float(precision=53)),
+                 Column('vmax', Float(precision=53)),
+                 Column('vmean', Float(precision=53)),
+                 Column('vfirst', Float(precision=53)),
+                 Column('vlast', Float(precision=53)))
+
+def extent_table(metadata):
+    """extent table: time of first sample ('time'), time of last sample
+    ('t_end'), and number of samples ('count') for a PV. A PV can have
+    several rows, which are combined when read."""
+    return Table(EXTENT_TABLE, metadata,
+                 Column('pv_id', ForeignKey('pv.id')),
+                 Column('time', Float),
+                 Column('t_end', Float),
+                 Column('count', Integer))
 
 def flush(engine):
     "flush session"
     with Session(engine) as session, session.begin():
         session.flush()
 
+def copy_buffer(rows, binary):
+    """CSV text of rows for postgresql COPY FROM STDIN, as a StringIO
+
+    Arguments
+    ---------
+    rows     list of sequences of values
+    binary   list of whether each column is binary (bytea), written as hex
+    """
+    buff = io.StringIO()
+    writer = csv.writer(buff)
+    for row in rows:
+        out = []
+        for val, is_binary in zip(row, binary):
+            if val is None:
+                val = COPY_NULL
+            elif is_binary:
+                val = '\\x' + bytes(val).hex()
+            elif isinstance(val, bytes):
+                val = val.decode('utf-8')
+            out.append(val)
+        writer.writerow(out)
+    buff.seek(0)
+    return buff
+
+class QueryError(Exception):
+    """queries run with run_parallel() failed or timed out.
+    `errors` is a dict of {name: exception} for the failed queries"""
+    def __init__(self, errors):
+        self.errors = errors
+        msg = '; '.join(f'{name}: {exc!r}' for name, exc in errors.items())
+        super().__init__(f"{len(errors)} of the queries failed: {msg}")
+
+def run_parallel(funcs, workers=8, timeout=None, names=None,
+                 raise_errors=True, default=None):
+    """run independent callables (typically each doing one query)
+    in a pool of at most `workers` threads.
+
+    returns list of results, in the order of funcs.  A call that raises
+    an exception, or that runs longer than `timeout` seconds (a timed-out
+    call cannot be stopped, but is not waited for), is logged with its
+    name from `names` (default: its index).  Once all calls are done,
+    these raise a QueryError, or with raise_errors=False give `default`.
+    """
+    funcs = list(funcs)
+    if len(funcs) == 0:
+        return []
+    if names is None:
+        names = list(range(len(funcs)))
+    errors = {}
+    def failed(i, exc):
+        logging.warning(f"query for {names[i]} failed: {exc!r}")
+        errors[names[i]] = exc
+
+    if workers is None or int(workers) < 2 or len(funcs) == 1:
+        out = []
+        for i, func in enumerate(funcs):
+            try:
+                out.append(func())
+            except Exception as exc:
+                failed(i, exc)
+                out.append(default)
+        if raise_errors and len(errors) > 0:
+            raise QueryError(errors)
+        return out
+
+    started = {}
+    def timed(i, func):
+        started[i] = time.monotonic()
+        return func()
+
+    results = [default]*len(funcs)
+    pool = ThreadPoolExecutor(max_workers=min(int(workers), len(funcs)))
+    futures = {pool.submit(timed, i, func): i for i, func in enumerate(funcs)}
+    pending = set(futures)
+    while len(pending) > 0:
+        done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+        for fut in done:
+            try:
+                results[futures[fut]] = fut.result()
+            except Exception as exc:
+                failed(futures[fut], exc)
+        if timeout is not None:
+            now = time.monotonic()
+            expired = set(fut for fut in pending
+                          if now > started.get(futures[fut], now) + timeout)
+            for fut in expired:
+                failed(futures[fut], TimeoutError(f"no result after {timeout} sec"))
+            pending = pending - expired
+    pool.shutdown(wait=False, cancel_futures=True)
+    if raise_errors and len(errors) > 0:
+        raise QueryError(errors)
+    return results
+
 def get_all_dbs(engine):
     """get list of all DBs from engine"""
     if engine is None:
@@ -33,6 +283,233 @@ def get_all_dbs(engine):
     return [row[0] for row in engine.connect().execute(query).fetchall()]
 
 
+# process-wide registry of engines and of reflected tables, keyed by
+# connection string, so that all SimpleDB for a database share one
+# connection pool and one schema reflection.
+
+# directory for cached schema files, '' to not cache
+SCHEMA_CACHE_DIR = os.environ.get('PVARCH_SCHEMA_CACHE',
+                                  os.path.join(os.path.expanduser('~'),
+                                               '.cache', 'pvarch'))
+_ENGINES = {}
+_ENGINE_LOCK = threading.Lock()
+
+def get_engine(conn_str, pool_size=5, pool_pre_ping=True, idle_time=900):
+    """get shared engine for a connection string, creating it if needed
+
+    Arguments
+    ---------
+    conn_str       sqlalchemy connection string
+    pool_size      size of connection pool [5]
+    pool_pre_ping  whether to test connections from the pool before use [True]
+    idle_time      time in seconds after which unused engines are disposed [900]
+    """
+    tnow = time.time()
+    with _ENGINE_LOCK:
+        for key in list(_ENGINES.keys()):
+            entry = _ENGINES[key]
+            if key != conn_str and tnow > entry['last_used'] + entry['idle_time']:
+                _ENGINES.pop(key)['engine'].dispose()
+        if conn_str not in _ENGINES:
+            opts = {'pool_pre_ping': pool_pre_ping}
+            if not conn_str.startswith('sqlite'):
+                opts['pool_size'] = pool_size
+            _ENGINES[conn_str] = {'engine': create_engine(conn_str, **opts),
+                                  'tables': None, 'idle_time': idle_time}
+        entry = _ENGINES[conn_str]
+        entry['last_used'] = tnow
+        return entry['engine']
+
+# column types that can be saved in the schema cache, by name
+CACHE_TYPES = {cls.__name__: cls for cls in (Integer, SmallInteger, BigInteger,
+                                             Float, Double, Numeric, String, Text,
+                                             LargeBinary, DateTime, Date, Time,
+                                             Boolean, Enum)}
+
+def type_spec(coltype):
+    """[type name, keyword arguments] for a column type, for the schema
+    cache, or None if the type cannot be saved"""
+    try:
+        generic = coltype.as_generic()
+    except NotImplementedError:
+        return None
+    name = type(generic).__name__
+    if name not in CACHE_TYPES:
+        return None
+    if name == 'Enum':
+        return [name, {'enums': list(generic.enums)}]
+    kws = {}
+    for attr in ('precision', 'scale', 'length', 'timezone'):
+        val = getattr(generic, attr, None)
+        if val not in (None, False):
+            kws[attr] = val
+    return [name, kws]
+
+def spec_type(spec):
+    "column type from type_spec()"
+    name, kws = spec
+    if name == 'Enum':
+        return Enum(*kws['enums'])
+    return CACHE_TYPES[name](**kws)
+
+def column_specs(table):
+    """list of column definitions of a table for the schema cache,
+    or None if any column type cannot be saved"""
+    out = []
+    for col in table.columns:
+        spec = type_spec(col.type)
+        if spec is None:
+            return None
+        out.append({'name': col.name, 'type': spec, 'nullable': col.nullable,
+                    'primary_key': col.primary_key})
+    return out
+
+def schema_signature(engine):
+    """(table names, signature) of a database from a single catalog query,
+    with the signature made from all table and column definitions, or
+    (None, None) if the catalog cannot be read"""
+    name = engine.name
+    if name == 'sqlite':
+        query = text("select name, sql from sqlite_master where type='table' "
+                     "and name not like 'sqlite_%' order by name")
+    elif name.startswith('post') or name.startswith('m'):
+        schema = 'current_schema()' if name.startswith('post') else 'database()'
+        query = text("select table_name, column_name, data_type, "
+                     "numeric_precision, character_maximum_length, is_nullable "
+                     "from information_schema.columns "
+                     f"where table_schema = {schema} "
+                     "order by table_name, ordinal_position")
+    else:
+        return None, None
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(query).fetchall()
+    except Exception:
+        return None, None
+    names = set(row[0] for row in rows)
+    signature = '\n'.join('|'.join(str(x) for x in row) for row in rows)
+    return names, hashlib.sha1(signature.encode('utf-8')).hexdigest()
+
+class LazyTables(Mapping):
+    """read-only dict of the tables of a database, keyed by table name
+
+    Table names are read when created, but each table is made only when
+    it is first accessed, either from the column definitions in the
+    schema cache file, or by reflecting it.  The schema cache file (if
+    the schema cache directory is set) is keyed on a signature of all
+    column definitions of the database, so that any change in layout
+    uses a new file.  Column definitions of reflected tables are saved to
+    it, so that later processes can make tables without reflecting them.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.loaded = set()
+        self.metadata = MetaData()
+        names, signature = schema_signature(engine)
+        if names is None:
+            names = set(inspect(engine).get_table_names())
+        self.names = names
+        self.cachefile = schema_cachefile(engine, signature)
+        self.columns = {}
+        if self.cachefile is not None and os.path.exists(self.cachefile):
+            try:
+                with open(self.cachefile, 'r') as fh:
+                    self.columns = json.load(fh)
+            except Exception:
+                self.columns = {}
+
+    def __getitem__(self, name):
+        # a table is in metadata.tables while it is being reflected,
+        # so only use tables that have been completely loaded
+        if name in self.loaded:
+            return self.metadata.tables[name]
+        with self.lock:
+            if name not in self.metadata.tables:
+                if name not in self.names:
+                    raise KeyError(name)
+                specs = self.columns.get(name, None)
+                table = None
+                if specs is not None:
+                    try:
+                        table = Table(name, self.metadata,
+                                      *[Column(spec['name'], spec_type(spec['type']),
+                                               nullable=spec['nullable'],
+                                               primary_key=spec['primary_key'])
+                                        for spec in specs])
+                    except Exception:
+                        if name in self.metadata.tables:
+                            self.metadata.remove(self.metadata.tables[name])
+                        table = None
+                if table is None:
+                    table = Table(name, self.metadata, autoload_with=self.engine,
+                                  resolve_fks=False)
+                    specs = column_specs(table)
+                    if specs is not None:
+                        self.columns[name] = specs
+                        self.save()
+            self.loaded.add(name)
+        return self.metadata.tables[name]
+
+    def __contains__(self, name):
+        return name in self.names or name in self.metadata.tables
+
+    def __iter__(self):
+        return iter(sorted(self.names.union(self.metadata.tables.keys())))
+
+    def __len__(self):
+        return len(self.names.union(self.metadata.tables.keys()))
+
+    def save(self):
+        "save column definitions of tables to the schema cache file"
+        if self.cachefile is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cachefile), exist_ok=True)
+            tmpfile = f'{self.cachefile}.{os.getpid()}'
+            with open(tmpfile, 'w') as fh:
+                json.dump(self.columns, fh)
+            os.replace(tmpfile, self.cachefile)
+        except Exception:
+            pass
+
+def schema_cachefile(engine, signature):
+    """name of the schema cache file for a database, or None if not caching.
+
+    The name includes a fingerprint of the server, database name, and the
+    signature of all column definitions from schema_signature().
+    """
+    if SCHEMA_CACHE_DIR in ('', None) or signature is None:
+        return None
+    url = engine.url
+    fingerprint = '|'.join((url.drivername, str(url.host), str(url.port),
+                            str(url.database), signature))
+    fingerprint = hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()[:16]
+    dbname = os.path.basename(str(url.database)).replace('.', '_')
+    return os.path.join(SCHEMA_CACHE_DIR, f'schema_{dbname}_{fingerprint}.json')
+
+def get_tables(engine, refresh=False):
+    """get LazyTables for an engine, shared by all users of the engine.
+    Raises an exception if the database does not exist.
+    """
+    conn_str = engine.url.render_as_string(hide_password=False)
+    with _ENGINE_LOCK:
+        entry = _ENGINES.get(conn_str, None)
+        if entry is not None and entry['tables'] is not None and not refresh:
+            return entry['tables']
+    tables = LazyTables(engine)
+    with _ENGINE_LOCK:
+        if entry is not None:
+            entry['tables'] = tables
+    return tables
+
+def clear_engines():
+    """dispose of all shared engines and tables"""
+    with _ENGINE_LOCK:
+        for entry in _ENGINES.values():
+            entry['engine'].dispose()
+        _ENGINES.clear()
+
 class SimpleDB:
     """ simple, non-orm sqlalchemy interface"""
     def __init__(self, dbname=None, warn_missing=True, **kws):
@@ -58,16 +535,17 @@ class SimpleDB:
         self.tables = None
         self.conn = None
         try:
-            self.metadata.reflect(self.engine)
-            self.conn    = self.engine.connect()              
-            self.tables  = self.metadata.tables
+            self.tables  = get_tables(self.engine)
+            self.metadata = self.tables.metadata
+            self.conn    = self.engine.connect()
         except:
             if warn_missing:
                 print(f"Warning: database '{dbname}' appears to not exist")
 
     def connect(self, dbname, server='sqlite', host='localhost',
-                port=None, dialect=None, user='', password=''):
-        """create database engine"""
+                port=None, dialect=None, user='', password='',
+                pool_size=5, pool_pre_ping=True, idle_time=900):
+        """get (shared) database engine"""
         server = server.lower()
         if server.startswith('my'):
             if dialect is None:
@@ -95,7 +573,8 @@ class SimpleDB:
             else:
                 conn_str= f'{server}+{dialect}://{conn}'
 
-        return create_engine(conn_str)
+        return get_engine(conn_str, pool_size=pool_size,
+                          pool_pre_ping=pool_pre_ping, idle_time=idle_time)
         
 
     def close(self):
@@ -126,7 +605,94 @@ class SimpleDB:
                 session.execute(tab.insert().values(**kws))
             session.flush()
 
-        
+    def insert_batches(self, rows_by_table, use_copy=None):
+        """insert rows into several tables in a single transaction
+
+        Arguments
+        ----------
+        rows_by_table   dict of tablename: list of dicts, all dicts for
+                        a table having the same keys
+        use_copy        whether to use COPY FROM STDIN (postgresql only).
+                        [None] uses COPY for postgresql when there are at
+                        least COPY_MIN_ROWS rows.
+
+        Each table gets a single COPY or multi-row (executemany) insert.
+        Returns the total number of rows inserted.
+        """
+        nrows = 0
+        with self.engine.begin() as conn:
+            for tablename, rows in rows_by_table.items():
+                if len(rows) < 1:
+                    continue
+                tab = self.tables.get(tablename, None)
+                if tab is None:
+                    self.table_error("no table found", tablename, 'insert_batches')
+                copy = use_copy
+                if copy is None:
+                    copy = len(rows) >= COPY_MIN_ROWS
+                if copy and self.engine.name.startswith('post'):
+                    self.copy_rows(tablename, rows, conn=conn)
+                else:
+                    conn.execute(tab.insert(), rows)
+                nrows += len(rows)
+        return nrows
+
+    def copy_rows(self, tablename, rows, columns=None, conn=None):
+        """bulk load rows into a table with postgresql COPY FROM STDIN,
+        falling back to a multi-row insert for other servers.
+
+        Arguments
+        ----------
+        tablename   name of table
+        rows        list of dicts or of tuples of values
+        columns     list of column names [None: keys of first row for
+                    dicts, or all columns of the table, in order, for tuples]
+        conn        connection to use, for running within a transaction
+                    [None: run as its own transaction]
+
+        Returns the number of rows loaded.
+        """
+        if len(rows) < 1:
+            return 0
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.copy_rows(tablename, rows, columns=columns, conn=conn)
+
+        if columns is None:
+            if isinstance(rows[0], dict):
+                columns = list(rows[0].keys())
+            else:
+                columns = [col.name for col in self.tables[tablename].columns]
+                if len(rows[0]) != len(columns):
+                    msg = f"rows have {len(rows[0])} values for {len(columns)} columns"
+                    self.table_error(msg, tablename, 'copy_rows')
+        if isinstance(rows[0], dict):
+            rows = [[row[c] for c in columns] for row in rows]
+
+        if not self.engine.name.startswith('post'):
+            tab = self.tables[tablename]
+            conn.execute(tab.insert(), [dict(zip(columns, row)) for row in rows])
+            return len(rows)
+
+        tab = self.tables[tablename]
+        buff = copy_buffer(rows, [isinstance(tab.c[c].type, LargeBinary)
+                                  for c in columns])
+
+        quote = conn.dialect.identifier_preparer.quote
+        cols = ', '.join(quote(c) for c in columns)
+        sql = (f"COPY {quote(tablename)} ({cols}) FROM STDIN "
+               f"WITH (FORMAT csv, NULL '{COPY_NULL}')")
+        cursor = conn.connection.cursor()
+        try:
+            if hasattr(cursor, 'copy_expert'):   # psycopg2
+                cursor.copy_expert(sql, buff)
+            else:                                # psycopg 3
+                with cursor.copy(sql) as copy:
+                    copy.write(buff.getvalue())
+        finally:
+            cursor.close()
+        return len(rows)
+
     def set_info(self, key, value, set_modify_time=True, do_execute=True):
         """set key / alue in the info table
         do_execute=False to avoid executing, and only return query
@@ -375,6 +941,7 @@ def create_pvarch_main(dbname='pvarch_main', **kws):
           Column('enum_strs', Text, default=''),
           Column('timestamp', Float),
           Column('notes', Text),
+          Column(CACHE_ARRAY_COLUMN, LargeBinary),
           Column('active', Boolean,  default=True))
     
 
@@ -422,12 +989,14 @@ def create_pvarch_main(dbname='pvarch_main', **kws):
 
     return odb
 
-def create_pvarch_data(maindb='pvarch_main'):
+def create_pvarch_data(maindb='pvarch_main', covering_index=False):
     """Create the next pvdata table for archiver
 
     arguments:
     ---------
-    maindb    name of main EpicsArchiver databae
+    maindb          name of main EpicsArchiver databae
+    covering_index  whether (pv_id, time) indexes of data tables
+                    should also cover values [False]
     """
     pvarch = SimpleDB(maindb)
     if pvarch.tables is None or 'info' not in pvarch.tables:  # not connected!
@@ -472,8 +1041,12 @@ def create_pvarch_data(maindb='pvarch_main'):
           Column('active', Boolean,  default=True),
           Column('deadtime',  Float, default=10.0),
           Column('deadband',  Float, default=1.e-5),
+          Column('compress', Enum('none', 'swingdoor',
+                                  name='compresstype', create=True),
+                 default='none'),
+          Column('tolerance', Float, default=0.0),
           Column('data_type',
-                 Enum('int','double','string','enum',
+                 Enum('int','double','string','enum','array',
                       name='pvtype', create=True), default='double'),
           Column('graph_type', Enum('continuous','log','discrete',
                                     name='graphtype', create=True),
@@ -483,15 +1056,217 @@ def create_pvarch_data(maindb='pvarch_main'):
           )
 
     dtabs = []
-    for i in range(128):
-        t = Table(f'pvdat{(i+1):03d}', db.metadata, 
+    for i in range(N_DATA_TABLES):
+        t = Table(data_tablename(i+1, 'double'), db.metadata,
+                  Column('time', Float),
+                  Column('pv_id', ForeignKey('pv.id')),
+                  Column('value', Float(precision=53)))
+        dtabs.append(t)
+    for i in range(N_STRING_TABLES):
+        t = Table(data_tablename(i+1, 'string'), db.metadata,
                   Column('time', Float),
                   Column('pv_id', ForeignKey('pv.id')),
                   Column('value', Text))
         dtabs.append(t)
-    
+
+    t = Table(ARRAY_TABLE, db.metadata,
+              Column('time', Float),
+              Column('pv_id', ForeignKey('pv.id')),
+              Column('value', LargeBinary))
+    dtabs.append(t)
+
+    t = Table('pvblock', db.metadata,
+              Column('id', Integer, primary_key=True),
+              Column('pv_id', ForeignKey('pv.id')),
+              Column('time', Float),
+              Column('t_end', Float),
+              Column('count', Integer),
+              Column('times', LargeBinary),
+              Column('vals', LargeBinary))
+    dtabs.append(t)
+
+    for res in ROLLUP_RESOLUTIONS:
+        dtabs.append(rollup_table(db.metadata, res))
+    dtabs.append(extent_table(db.metadata))
+
+    for t in dtabs:
+        data_index(t, covering=covering_index, server=db.engine.name)
+
     db.metadata.create_all(bind=db.engine)
     flush(db.engine)
 
     time.sleep(0.25)
     return SimpleDB(dbname, **pvarch.connection_args)    
+
+def fetch_columns(db, query):
+    """run a query, such as for (time, value), returning the columns
+    as tuples, fetched in bulk from the DBAPI cursor"""
+    with db.engine.connect() as conn:
+        result = conn.execute(query)
+        ncols = len(result.keys())
+        rows = result.cursor.fetchall()
+        result.close()
+    if len(rows) == 0:
+        return tuple(() for i in range(ncols))
+    return tuple(zip(*rows))
+
+def end_time_column(tab):
+    "column for the time of the last sample in a row: 't_end' for blocks"
+    return tab.c.t_end if 't_end' in tab.c else tab.c.time
+
+def count_rows(db, tablename, tmin=None):
+    "number of rows in a table, or of rows with (end) time > tmin"
+    tab = db.tables[tablename]
+    query = select(func.count()).select_from(tab)
+    if tmin is not None:
+        query = query.where(end_time_column(tab) > tmin)
+    return db.execute(query).scalar()
+
+def time_range(db, tablename):
+    "(oldest, newest) time in a table, or None if the table is empty"
+    tab = db.tables[tablename]
+    tmin, tmax = db.execute(select(func.min(tab.c.time),
+                                   func.max(end_time_column(tab)))).fetchone()
+    if tmin is None:
+        return None
+    return float(tmin), float(tmax)
+
+def table_report(db, minutes=60):
+    """report row counts and recent insert rates for data tables
+
+    Arguments
+    ---------
+    db        SimpleDB for an archive database
+    minutes   time in minutes for recent inserts [60]
+
+    Returns
+    -------
+    dict of {tablename: {'nrows': total rows, 'nrecent': rows inserted
+    in the past `minutes`, 'rate': recent inserts per second,
+    'npvs': number of PVs assigned to the table}}
+    """
+    tmin = time.time() - minutes*60.0
+    pvtab = db.tables['pv']
+    npvs = {}
+    query = select(pvtab.c.data_table, func.count()).group_by(pvtab.c.data_table)
+    for tname, count in db.execute(query).fetchall():
+        npvs[tname] = count
+
+    out = {}
+    for tname in data_tablenames(db.tables):
+        nrows = count_rows(db, tname)
+        nrecent = count_rows(db, tname, tmin=tmin)
+        out[tname] = {'nrows': nrows, 'nrecent': nrecent,
+                      'rate': nrecent/(minutes*60.0),
+                      'npvs': npvs.get(tname, 0)}
+    return out
+
+def add_cache_array_column(db):
+    """add the array value column to the cache table of a main database
+    made without it, renaming a column named 'blob' (from earlier versions,
+    and a reserved word in MySQL) if there is one.
+
+    Returns whether the cache table has the column.
+    """
+    table = db.tables['cache']
+    if CACHE_ARRAY_COLUMN in table.c:
+        return True
+    server = db.engine.name
+    if 'blob' in table.c:
+        oldcol = db.engine.dialect.identifier_preparer.quote('blob')
+        sql = f"alter table cache rename column {oldcol} to {CACHE_ARRAY_COLUMN}"
+    else:
+        ctype = 'bytea' if server.startswith('post') else 'blob'
+        if server.startswith('m'):
+            ctype = 'longblob'
+        sql = f"alter table cache add column {CACHE_ARRAY_COLUMN} {ctype}"
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(sql))
+    except Exception as exc:
+        logging.warning(f"could not add column '{CACHE_ARRAY_COLUMN}' to cache table: {exc}")
+        return False
+    db.tables = get_tables(db.engine, refresh=True)
+    db.metadata = db.tables.metadata
+    return True
+
+def move_pv(db, pvname, tablename):
+    """move a PV, with all of its archived rows, to another data table
+
+    Arguments
+    ---------
+    db         SimpleDB for an archive database
+    pvname     name of PV
+    tablename  name of data table to move to
+
+    The rows are copied, deleted from the original table, and the PV's
+    data_table updated in a single transaction.
+    Returns the number of rows moved.
+    """
+    pvtab = db.tables['pv']
+    namecol = pvtab.c.pvname if 'pvname' in pvtab.c else pvtab.c.name
+    pvrow = db.execute(pvtab.select().where(namecol==pvname)).fetchone()
+    if pvrow is None:
+        raise ValueError(f"no PV named '{pvname}' in database '{db.dbname}'")
+    if pvrow.data_table == tablename:
+        return 0
+    old = db.tables.get(pvrow.data_table, None)
+    new = db.tables.get(tablename, None)
+    if old is None or new is None:
+        db.table_error("no table found", tablename, 'move_pv')
+    if is_numeric_table(old) != is_numeric_table(new):
+        raise ValueError(f"cannot move PV '{pvname}' from '{old.name}' to '{tablename}': "
+                         "tables store different value types")
+
+    with db.engine.begin() as conn:
+        rows = select(old.c.time, old.c.pv_id, old.c.value).where(old.c.pv_id==pvrow.id)
+        nrows = conn.execute(new.insert().from_select(['time', 'pv_id', 'value'],
+                                                      rows)).rowcount
+        conn.execute(old.delete().where(old.c.pv_id==pvrow.id))
+        conn.execute(pvtab.update().where(pvtab.c.id==pvrow.id).values(
+            data_table=tablename))
+    return nrows
+
+def create_data_indexes(db, covering=False, rebuild=False, verbose=True):
+    """add composite (pv_id, time) indexes to data tables of an archive database
+
+    Arguments
+    ---------
+    db        SimpleDB for an archive database
+    covering  whether indexes should also cover values [False]
+    rebuild   whether to drop and re-create existing indexes [False]
+    verbose   whether to print progress [True]
+
+    Returns the number of indexes created.
+
+    An existing index on (pv_id, time) is used whatever its name, as for
+    the 'pv_time_idx' index of tables made from the schema.py templates.
+    """
+    tnames = archived_tablenames(db.tables)
+    inspector = inspect(db.engine)
+    ncreated = 0
+    for i, tname in enumerate(tnames):
+        t0 = time.time()
+        tab = db.tables[tname]
+        index = data_index(tab, covering=covering, server=db.engine.name)
+        existing = [ix['name'] for ix in inspector.get_indexes(tname)
+                    if ix['column_names'][:2] == ['pv_id', 'time']]
+        action, name = 'exists', index.name
+        if len(existing) > 0 and rebuild:
+            for oldname in existing:
+                old = Index(oldname, tab.c.pv_id, tab.c.time)
+                old.drop(bind=db.engine)
+                tab.indexes.discard(old)
+            existing = []
+        if len(existing) > 0:
+            name = existing[0]
+        else:
+            index.create(bind=db.engine)
+            ncreated += 1
+            action = 'rebuilt' if rebuild else 'created'
+        # remove from table metadata, so the index can be made again
+        tab.indexes.discard(index)
+        if verbose:
+            print(f"[{i+1:3d}/{len(tnames):3d}] {db.dbname}.{tname}: index "
+                  f"{name} {action} ({time.time()-t0:.1f} sec)")
+    return ncreated
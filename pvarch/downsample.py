@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+downsampling of archived data for plotting
+
+Data is reduced to a fixed number of time buckets across a time range.
+For the typed (numeric) data tables the bucketing is done by the
+database, with a query grouped by floor((time-tmin)/bucket), so that
+only the reduced data is transferred.  The same reductions are done
+with numpy for data that cannot be reduced by the database.
+
+methods:
+   'minmax'  two points per bucket: the minimum and maximum value, both
+             at the mean time of the samples in the bucket.
+   'mean'    one point per bucket: the mean value at the mean time.
+   'lttb'    Largest-Triangle-Three-Buckets, applied to minmax buckets.
+"""
+import numpy as np
+from sqlalchemy import select, func
+
+METHODS = ('minmax', 'mean', 'lttb')
+
+def n_buckets(max_points, method='minmax'):
+    """number of time buckets to use for max_points and a method"""
+    if method not in METHODS:
+        raise ValueError(f"unknown downsample method '{method}'")
+    max_points = max(int(max_points), 2)
+    if method == 'mean':
+        return max_points
+    elif method == 'lttb':
+        return 2*max_points
+    return max(max_points//2, 1)
+
+def bucket_query(dtable, pv_id, tmin, tmax, nbuckets):
+    """select statement for bucketed data for a PV in a data table,
+    with columns (time, count, min, max, mean, bucket) per bucket.
+
+    Rows are grouped and ordered by the 'bucket' label, so that the
+    bucket expression and its parameters appear only once, as needed
+    for server-side parameter binding."""
+    width = max((tmax - tmin)/nbuckets, 1.e-6)
+    bucket = func.floor((dtable.c.time - tmin)/width).label('bucket')
+    query = select(func.avg(dtable.c.time), func.count(dtable.c.value),
+                   func.min(dtable.c.value), func.max(dtable.c.value),
+                   func.avg(dtable.c.value), bucket)
+    query = query.where(dtable.c.pv_id==pv_id)
+    query = query.where(dtable.c.time>=tmin).where(dtable.c.time<=tmax)
+    return query.group_by('bucket').order_by('bucket')
+
+def bucket_points(columns, method='minmax'):
+    """(times, values) from the columns of bucket_query() results"""
+    if len(columns) == 0 or len(columns[0]) == 0:
+        return np.zeros(0), np.zeros(0)
+    times, count, vmin, vmax, vmean = [np.asarray(c, dtype='f8') for c in columns[:5]]
+    keep = count > 0
+    times, vmin, vmax, vmean = times[keep], vmin[keep], vmax[keep], vmean[keep]
+    if method == 'mean':
+        return times, vmean
+    return np.repeat(times, 2), np.column_stack((vmin, vmax)).ravel()
+
+def bucket_reduce(times, values, tmin, tmax, nbuckets, method='minmax'):
+    """numpy version of bucket_query() and bucket_points() for
+    (times, values) ndarrays sorted by time.  NaN values are ignored."""
+    times = np.asarray(times, dtype='f8')
+    values = np.asarray(values, dtype='f8')
+    if len(times) == 0:
+        return times, values
+    width = max((tmax - tmin)/nbuckets, 1.e-6)
+    bucket = np.floor((times - tmin)/width)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    finite = np.isfinite(values)
+    count = np.add.reduceat(finite.astype('f8'), starts)
+    tmean = np.add.reduceat(times, starts)/np.diff(np.r_[starts, len(times)])
+    keep = count > 0
+    if method == 'mean':
+        vsum = np.add.reduceat(np.where(finite, values, 0.0), starts)
+        return tmean[keep], vsum[keep]/count[keep]
+    vmin = np.fmin.reduceat(values, starts)[keep]
+    vmax = np.fmax.reduceat(values, starts)[keep]
+    return np.repeat(tmean[keep], 2), np.column_stack((vmin, vmax)).ravel()
+
+def decimate(times, values, max_points):
+    """evenly spaced subset of points, for values that cannot be reduced"""
+    if len(times) <= max_points:
+        return times, values
+    index = np.unique(np.linspace(0, len(times)-1, max_points).astype(int))
+    return times[index], values[index]
+
+def lttb(times, values, max_points):
+    """Largest-Triangle-Three-Buckets reduction of (times, values) to
+    max_points, keeping the first and last points.  Non-finite values
+    are dropped."""
+    times = np.asarray(times, dtype='f8')
+    values = np.asarray(values, dtype='f8')
+    finite = np.isfinite(values)
+    if not finite.all():
+        times, values = times[finite], values[finite]
+    npts = len(times)
+    if max_points >= npts or max_points < 3:
+        return times, values
+    edges = np.linspace(1, npts-1, max_points-1).astype(int)
+    index = np.zeros(max_points, dtype=int)
+    index[-1] = npts - 1
+    ilast = 0
+    for i in range(max_points-2):
+        lo, hi = edges[i], edges[i+1]
+        nhi = edges[i+2] if i+2 < len(edges) else npts
+        tnext, vnext = times[hi:nhi].mean(), values[hi:nhi].mean()
+        ta, va = times[ilast], values[ilast]
+        area = np.abs((ta - tnext)*(values[lo:hi] - va) -
+                      (ta - times[lo:hi])*(vnext - va))
+        ilast = lo + int(area.argmax())
+        index[i+1] = ilast
+    return times[index], values[index]
+
+def downsample(times, values, tmin, tmax, max_points, method='minmax'):
+    """final reduction of (times, values) to at most about max_points"""
+    if len(times) <= max_points:
+        return times, values
+    if values.dtype.kind != 'f':
+        return decimate(times, values, max_points)
+    if method == 'lttb':
+        return lttb(times, values, max_points)
+    return bucket_reduce(times, values, tmin, tmax,
+                         n_buckets(max_points, method), method=method)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+"""
+export of archived data to columnar files
+
+Data can be exported as Parquet files (with pyarrow) or as HDF5 files
+(with h5py), which are optional dependencies, installed with
+    pip install pvarch[export]
+
+A run is exported with one file per data table, and for the block table
+one file of float values and one (with a '_string' suffix) of strings:
+   parquet:  columns 'pvname', 'pv_id', 'time', 'value', one row group per
+             chunk of rows read
+   hdf5:     one group per PV, holding 'time' and 'value' datasets
+
+PVs over a time range are exported with one file per PV, with columns
+(or datasets) 'time' and 'value' only.  Values are stored as floats, strings, or (for array PVs) as
+variable length lists of floats.
+
+Data is read in chunks with server-side cursors, and tables or PVs are
+exported in parallel.
+"""
+import os
+import time
+import numpy as np
+from sqlalchemy import select
+
+from .database import (archived_tablenames, is_numeric_table, run_parallel,
+                       ARRAY_TABLE)
+from .blocks import BLOCK_TABLE, KIND_STRING, decode_times, decode_values
+from .arrays import decode_array
+
+FORMATS = ('parquet', 'hdf5')
+EXTENSIONS = {'parquet': 'parquet', 'hdf5': 'h5'}
+
+def import_writer(format):
+    "import the module needed to write a format"
+    if format not in FORMATS:
+        raise ValueError(f"unknown export format '{format}': use one of {FORMATS}")
+    try:
+        if format == 'parquet':
+            import pyarrow.parquet
+            return pyarrow
+        import h5py
+        return h5py
+    except ImportError:
+        modname = 'pyarrow' if format == 'parquet' else 'h5py'
+        raise ImportError(f"export to {format} needs '{modname}': "
+                          "install with 'pip install pvarch[export]'")
+
+def safe_filename(name):
+    "PV name as a file or group name"
+    return name.replace('/', '_').replace(':', '_')
+
+def value_kind(values):
+    "kind of values in an ndarray: 'float', 'array', or 'string'"
+    if values.dtype.kind == 'f':
+        return 'float'
+    elif len(values) > 0 and isinstance(values[0], np.ndarray):
+        return 'array'
+    return 'string'
+
+def array_rows(values):
+    "1-D object ndarray of the rows of a 2-D ndarray"
+    out = np.empty(len(values), dtype=object)
+    for i, row in enumerate(values):
+        out[i] = np.asarray(row, dtype='f8')
+    return out
+
+def iter_table_chunks(db, tname, chunk_size=100000, kind='float'):
+    """iterate over all rows of a data table, or of the block table,
+    yielding (pv_ids, times, values) ndarrays sorted by pv_id and time,
+    read chunk_size rows at a time with a server-side cursor.
+    For the block table, only blocks of kind 'float' or 'string' are read."""
+    tab = db.tables[tname]
+    if tname == BLOCK_TABLE:
+        query = select(tab.c.pv_id, tab.c.times, tab.c.vals)
+        query = query.order_by(tab.c.pv_id, tab.c.time)
+    else:
+        query = select(tab.c.pv_id, tab.c.time, tab.c.value)
+        query = query.order_by(tab.c.pv_id, tab.c.time)
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=chunk_size)
+        for rows in conn.execute(query).partitions():
+            if tname == BLOCK_TABLE:
+                is_string = (kind == 'string')
+                rows = [row for row in rows
+                        if (bytes(row[2][:1]) == KIND_STRING) == is_string]
+                if len(rows) == 0:
+                    continue
+            rids, rtimes, rvalues = tuple(zip(*rows))
+            if tname == BLOCK_TABLE:
+                times = [decode_times(t) for t in rtimes]
+                if is_string:
+                    values = [np.array(decode_values(v), dtype=object) for v in rvalues]
+                else:
+                    values = [decode_values(v) for v in rvalues]
+                pv_ids = np.concatenate([np.full(len(t), i, dtype='i8')
+                                         for i, t in zip(rids, times)])
+                yield pv_ids, np.concatenate(times), np.concatenate(values)
+                continue
+            pv_ids = np.asarray(rids, dtype='i8')
+            times = np.asarray(rtimes, dtype='f8')
+            if tname == ARRAY_TABLE:
+                values = array_rows([np.ravel(decode_array(v)) for v in rvalues])
+            elif is_numeric_table(tab):
+                values = np.asarray(rvalues, dtype='f8')
+            else:
+                values = np.array([v.decode('utf-8') if isinstance(v, bytes) else v
+                                   for v in rvalues], dtype=object)
+            yield pv_ids, times, values
+
+class ParquetTableWriter:
+    "writes chunks of rows to a Parquet file"
+    def __init__(self, filename):
+        self.pa = import_writer('parquet')
+        self.filename = filename
+        self.writer = None
+
+    def write(self, pvnames, pv_ids, times, values):
+        "write a chunk of rows: pvnames and pv_ids are None for a one-PV file"
+        pa = self.pa
+        kind = value_kind(values)
+        if kind == 'float':
+            vals = pa.array(values, type=pa.float64())
+        elif kind == 'array':
+            vals = pa.array(list(values), type=pa.list_(pa.float64()))
+        else:
+            vals = pa.array([None if v is None else str(v) for v in values],
+                            type=pa.string())
+        columns = {}
+        if pv_ids is not None:
+            columns['pvname'] = pa.array(pvnames).dictionary_encode()
+            columns['pv_id'] = pa.array(pv_ids, type=pa.int32())
+        columns['time'] = pa.array(times, type=pa.float64())
+        columns['value'] = vals
+        table = pa.table(columns)
+        if self.writer is None:
+            self.writer = pa.parquet.ParquetWriter(self.filename, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+class HDF5TableWriter:
+    "writes chunks of rows to an HDF5 file, with a group per PV"
+    def __init__(self, filename):
+        self.h5py = import_writer('hdf5')
+        self.filename = filename
+        self.fh = self.h5py.File(filename, 'w')
+
+    def append(self, name, data, dtype):
+        if name not in self.fh:
+            self.fh.create_dataset(name, data=data, dtype=dtype, maxshape=(None,),
+                                   chunks=True, compression='gzip')
+            return
+        dset = self.fh[name]
+        n = dset.shape[0]
+        dset.resize((n + len(data),))
+        dset[n:] = data
+
+    def write(self, pvnames, pv_ids, times, values):
+        "write a chunk of rows: pvnames and pv_ids are None for a one-PV file"
+        kind = value_kind(values)
+        if kind == 'float':
+            vtype = 'f8'
+        elif kind == 'array':
+            vtype = self.h5py.vlen_dtype(np.float64)
+        else:
+            vtype = self.h5py.string_dtype()
+            values = np.array([str(v) for v in values], dtype=object)
+        if pv_ids is None:
+            self.append('time', times, 'f8')
+            self.append('value', values, vtype)
+            return
+        # rows are sorted by pv_id
+        starts = np.flatnonzero(np.r_[True, pv_ids[1:] != pv_ids[:-1]])
+        stops = np.r_[starts[1:], len(pv_ids)]
+        for i0, i1 in zip(starts, stops):
+            group = safe_filename(pvnames[i0])
+            self.append(f'{group}/time', times[i0:i1], 'f8')
+            self.append(f'{group}/value', values[i0:i1], vtype)
+
+    def close(self):
+        self.fh.close()
+
+def get_writer(filename, format):
+    if format == 'parquet':
+        return ParquetTableWriter(filename)
+    return HDF5TableWriter(filename)
+
+def export_table(db, tname, outdir, format='parquet', chunk_size=100000,
+                 kind='float'):
+    """export one data table of an archive database to a file. For the
+    block table, blocks of float or (with kind='string') string values.
+
+    returns (filename, number of rows)
+    """
+    pvtab = db.tables['pv']
+    names = dict(db.execute(select(pvtab.c.id, pvtab.c.name)).fetchall())
+    suffix = '_string' if (tname == BLOCK_TABLE and kind == 'string') else ''
+    fname = os.path.join(outdir, f'{db.dbname}_{tname}{suffix}.{EXTENSIONS[format]}')
+    writer = None
+    nrows = 0
+    try:
+        for pv_ids, times, values in iter_table_chunks(db, tname, chunk_size=chunk_size,
+                                                       kind=kind):
+            if writer is None:
+                writer = get_writer(fname, format)
+            pvnames = [names.get(int(i), str(i)) for i in pv_ids]
+            writer.write(pvnames, pv_ids, times, values)
+            nrows += len(times)
+    finally:
+        if writer is not None:
+            writer.close()
+    return (fname if nrows > 0 else None), nrows
+
+def export_run(db, outdir='.', format='parquet', chunk_size=100000,
+               workers=4, verbose=True):
+    """export all data tables (with data) of an archive database,
+    with one file per table, exporting tables in parallel.  Float and
+    string values of the block table are exported to separate files.
+
+    returns dict of {tablename: (filename, number of rows)}, with string
+    values of the block table as '<block table>_string'
+    """
+    import_writer(format)
+    os.makedirs(outdir, exist_ok=True)
+    t0 = time.time()
+    tasks = [(tname, 'float') for tname in archived_tablenames(db.tables)]
+    if BLOCK_TABLE in db.tables:
+        tasks.append((BLOCK_TABLE, 'string'))
+    tnames = [tname + ('_string' if kind == 'string' else '')
+              for tname, kind in tasks]
+    results = run_parallel([lambda tname=tname, kind=kind:
+                            export_table(db, tname, outdir, format=format,
+                                         chunk_size=chunk_size, kind=kind)
+                            for tname, kind in tasks], workers=workers, names=tnames)
+    out = {}
+    for tname, result in zip(tnames, results):
+        if result is not None and result[0] is not None:
+            out[tname] = result
+            if verbose:
+                print(f"  {tname}: {result[1]} rows to {result[0]}")
+    if verbose:
+        nrows = sum(r[1] for r in out.values())
+        print(f"exported {db.dbname}: {nrows} rows, {time.time()-t0:.1f} sec")
+    return out
+
+def export_pv(archiver, pvname, tmin, tmax, outdir='.', format='parquet',
+              chunk_size=100000):
+    """export data for a PV over a time range to a file, with Archiver.iter_data()
+
+    returns (filename, number of rows)
+    """
+    fname = os.path.join(outdir, f'{safe_filename(pvname)}.{EXTENSIONS[format]}')
+    writer = None
+    nrows = 0
+    try:
+        for times, values in archiver.iter_data(pvname, tmin, tmax, chunk_size=chunk_size):
+            if writer is None:
+                writer = get_writer(fname, format)
+            if values.ndim == 2:
+                values = array_rows(values)
+            writer.write(None, None, times, values)
+            nrows += len(times)
+    finally:
+        if writer is not None:
+            writer.close()
+    return (fname if nrows > 0 else None), nrows
+
+def export_pvs(archiver, pvnames, tmin, tmax, outdir='.', format='parquet',
+               chunk_size=100000, workers=4, verbose=True):
+    """export data for PVs over a time range, with one file per PV,
+    exporting PVs in parallel
+
+    returns dict of {pvname: (filename, number of rows)}
+    """
+    import_writer(format)
+    os.makedirs(outdir, exist_ok=True)
+    results = run_parallel([lambda pvname=pvname: export_pv(archiver, pvname, tmin, tmax,
+                                                            outdir=outdir, format=format,
+                                                            chunk_size=chunk_size)
+                            for pvname in pvnames], workers=workers, names=pvnames)
+    out = {}
+    for pvname, result in zip(pvnames, results):
+        if result is not None and result[0] is not None:
+            out[pvname] = result
+            if verbose:
+                print(f"  {pvname}: {result[1]} rows to {result[0]}")
+    return out
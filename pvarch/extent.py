@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+per-run extents of archived data for each PV
+
+The 'pvextent' table of an archive database holds, for each PV, the
+time of its first sample ('time'), the time of its last sample
+('t_end'), and its number of samples ('count').  Reads use these to
+skip runs, and parts of runs, with no data for a PV.
+
+For the running archive, the archiver adds rows about once a minute for
+the PVs that have changed, see ExtentTracker, so a PV can have several
+rows, which are combined when read.  When a run is closed, the table is
+recomputed from the data, with one row per PV, see compute_extents().
+"""
+import time
+from sqlalchemy import select, func, delete
+
+from .database import (EXTENT_TABLE, extent_table, data_tablenames,
+                       data_index, ARRAY_TABLE)
+from .blocks import BLOCK_TABLE
+
+def extent_row(pv_id, t_first, t_last, count):
+    "row for the extent table"
+    return {'pv_id': pv_id, 'time': t_first, 't_end': t_last, 'count': count}
+
+class ExtentTracker:
+    """tracks first and last sample time and number of samples for PVs,
+    for rows of the extent table"""
+    def __init__(self):
+        # pv_id: [first time, last time, count]
+        self.extents = {}
+
+    def __len__(self):
+        return len(self.extents)
+
+    def add(self, pv_id, ts):
+        "add a sample for a PV"
+        extent = self.extents.get(pv_id, None)
+        if extent is None:
+            self.extents[pv_id] = [ts, ts, 1]
+        else:
+            extent[0] = min(extent[0], ts)
+            extent[1] = max(extent[1], ts)
+            extent[2] += 1
+
+    def flush(self):
+        """rows for all PVs added since the last flush
+
+        returns batch dict of {extent table: list of rows}
+        """
+        if len(self.extents) == 0:
+            return {}
+        rows = [extent_row(pv_id, *extent) for pv_id, extent in self.extents.items()]
+        self.extents = {}
+        return {EXTENT_TABLE: rows}
+
+def has_extents(db):
+    "whether an archive database has an extent table"
+    return EXTENT_TABLE in db.tables
+
+def read_extents(db):
+    """read the extent table of an archive database
+
+    returns dict of {pvname: (first time, last time, count)}, or None
+    if the database has no extent table or it is empty
+    """
+    if not has_extents(db):
+        return None
+    tab, pvtab = db.tables[EXTENT_TABLE], db.tables['pv']
+    query = select(pvtab.c.name, func.min(tab.c.time), func.max(tab.c.t_end),
+                   func.sum(tab.c.count))
+    query = query.select_from(tab.join(pvtab, tab.c.pv_id==pvtab.c.id))
+    out = {}
+    for name, t_first, t_last, count in db.execute(query.group_by(pvtab.c.name)).fetchall():
+        out[name] = (float(t_first), float(t_last), int(count))
+    return out if len(out) > 0 else None
+
+def overlaps(extent, t0, t1):
+    "whether an extent has data between t0 and t1"
+    return extent is not None and extent[2] > 0 and extent[0] <= t1 and extent[1] >= t0
+
+def compute_extents(db, verbose=True):
+    """compute the extent table for an archive database from the data
+    tables (and block table), replacing all existing rows.  The extent
+    table is created if needed, as for runs made before extents.
+
+    returns number of PVs with data
+    """
+    t0 = time.time()
+    if not has_extents(db):
+        db.tables['pv']   # reflect the pv table for the pv_id foreign key
+        tab = extent_table(db.metadata)
+        data_index(tab, server=db.engine.name)
+        tab.create(bind=db.engine)
+    queries = []
+    tnames = data_tablenames(db.tables)
+    if ARRAY_TABLE in db.tables:
+        tnames.append(ARRAY_TABLE)
+    for tname in tnames:
+        dtable = db.tables[tname]
+        queries.append(select(dtable.c.pv_id, func.min(dtable.c.time),
+                              func.max(dtable.c.time), func.count(dtable.c.time))
+                       .group_by(dtable.c.pv_id))
+    if BLOCK_TABLE in db.tables:
+        btable = db.tables[BLOCK_TABLE]
+        queries.append(select(btable.c.pv_id, func.min(btable.c.time),
+                              func.max(btable.c.t_end), func.sum(btable.c.count))
+                       .group_by(btable.c.pv_id))
+    # a PV can have data in more than one table
+    extents = {}
+    for query in queries:
+        for pv_id, t_first, t_last, count in db.execute(query).fetchall():
+            extent = extents.setdefault(pv_id, [float(t_first), float(t_last), 0])
+            extent[0] = min(extent[0], float(t_first))
+            extent[1] = max(extent[1], float(t_last))
+            extent[2] += int(count)
+    tab = db.tables[EXTENT_TABLE]
+    with db.engine.begin() as conn:
+        conn.execute(delete(tab))
+        if len(extents) > 0:
+            conn.execute(tab.insert(), [extent_row(pv_id, *extent)
+                                        for pv_id, extent in extents.items()])
+    if verbose:
+        print(f"  {db.dbname}: extents for {len(extents)} PVs, {time.time()-t0:.1f} sec")
+    return len(extents)
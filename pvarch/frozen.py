@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+read-only, memory-mapped copies of closed archive runs
+
+Data in a run that has stopped is never written again, so a closed run
+can be 'frozen' into files, read without a database server.  Once
+frozen, the run can be dropped from the database.  A frozen run is a
+folder named for the run database, holding:
+
+   index.json    run name and times, and for each PV its id, data table,
+                 kind of values ('float', 'string', or 'array'), and the
+                 offset and count of its samples in times.f8 and values.f8
+   times.f8      float64 timestamps, contiguous and sorted for each PV
+   values.f8     float64 values, with NaN for PVs whose values are not floats
+   strings.json  {pvname: list of values} for PVs with string values
+   arrays/       <pv_id>.npy file of 2-D values for each array PV, with
+                 rows padded with NaN to the longest array
+
+times.f8, values.f8, and the array files are read with numpy.memmap, and
+time ranges are found by binary search.
+"""
+import os
+import json
+import shutil
+import numpy as np
+
+INDEX_FILE = 'index.json'
+TIMES_FILE = 'times.f8'
+VALUES_FILE = 'values.f8'
+STRINGS_FILE = 'strings.json'
+ARRAYS_FOLDER = 'arrays'
+
+def frozen_folder(frozen_dir, dbname):
+    "folder of a frozen run"
+    return os.path.join(frozen_dir, dbname)
+
+def is_frozen(frozen_dir, dbname):
+    "whether a run has been frozen into frozen_dir"
+    if frozen_dir in ('', None):
+        return False
+    return os.path.exists(os.path.join(frozen_folder(frozen_dir, dbname), INDEX_FILE))
+
+class FrozenWriter:
+    """writes a frozen run, one PV at a time.  Files are written to a
+    temporary folder, which is renamed when the run is complete.
+
+    Arguments
+    ---------
+    frozen_dir  folder for frozen runs
+    dbname      name of run database
+    start_time  start time of run
+    stop_time   stop time of run
+    """
+    def __init__(self, frozen_dir, dbname, start_time, stop_time):
+        self.folder = frozen_folder(frozen_dir, dbname)
+        self.tmpfolder = f'{self.folder}.tmp{os.getpid()}'
+        os.makedirs(os.path.join(self.tmpfolder, ARRAYS_FOLDER), exist_ok=True)
+        self.index = {'dbname': dbname, 'start_time': start_time,
+                      'stop_time': stop_time, 'pvs': {}}
+        self.strings = {}
+        self.nsamples = 0
+        self.tfile = open(os.path.join(self.tmpfolder, TIMES_FILE), 'wb')
+        self.vfile = open(os.path.join(self.tmpfolder, VALUES_FILE), 'wb')
+
+    def add(self, pvname, pv_id, data_table, times, values, is_array=False):
+        "add data for a PV, as (times, values) sorted by time"
+        times = np.asarray(times, dtype='<f8')
+        count = len(times)
+        if is_array:
+            kind = 'array'
+            fvalues = np.full(count, np.nan)
+            rows = list(values)
+            width = max([np.size(row) for row in rows], default=0)
+            arr = np.full((count, width), np.nan)
+            for i, row in enumerate(rows):
+                row = np.ravel(row)
+                arr[i, :len(row)] = row
+            np.save(os.path.join(self.tmpfolder, ARRAYS_FOLDER, f'{pv_id}.npy'), arr)
+        elif values.dtype.kind == 'f':
+            kind = 'float'
+            fvalues = values
+        else:
+            kind = 'string'
+            fvalues = np.full(count, np.nan)
+            self.strings[pvname] = [str(v) for v in values]
+        times.tofile(self.tfile)
+        np.asarray(fvalues, dtype='<f8').tofile(self.vfile)
+        self.index['pvs'][pvname] = {'id': int(pv_id), 'data_table': data_table,
+                                     'kind': kind, 'offset': self.nsamples,
+                                     'count': count}
+        self.nsamples += count
+
+    def close(self):
+        "write index and strings, and move the run into place"
+        self.tfile.close()
+        self.vfile.close()
+        self.index['nsamples'] = self.nsamples
+        with open(os.path.join(self.tmpfolder, STRINGS_FILE), 'w') as fh:
+            json.dump(self.strings, fh)
+        with open(os.path.join(self.tmpfolder, INDEX_FILE), 'w') as fh:
+            json.dump(self.index, fh)
+        if os.path.exists(self.folder):
+            shutil.rmtree(self.folder)
+        os.replace(self.tmpfolder, self.folder)
+
+    def abort(self):
+        "remove partly written files"
+        self.tfile.close()
+        self.vfile.close()
+        shutil.rmtree(self.tmpfolder, ignore_errors=True)
+
+class FrozenRun:
+    """read-only access to a frozen run
+
+    Arguments
+    ---------
+    folder   folder of the frozen run
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, INDEX_FILE), 'r') as fh:
+            index = json.load(fh)
+        self.dbname = index['dbname']
+        self.start_time = index['start_time']
+        self.stop_time = index['stop_time']
+        self.pvs = index['pvs']
+        self.pvnames = {info['id']: name for name, info in self.pvs.items()}
+        if index.get('nsamples', 0) > 0:
+            self.times = np.memmap(os.path.join(folder, TIMES_FILE), dtype='<f8', mode='r')
+            self.values = np.memmap(os.path.join(folder, VALUES_FILE), dtype='<f8', mode='r')
+        else:
+            self.times = self.values = np.zeros(0)
+        self._strings = None
+        self._arrays = {}
+
+    def __repr__(self):
+        return f"<FrozenRun {self.dbname}: {len(self.pvs)} PVs>"
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            with open(os.path.join(self.folder, STRINGS_FILE), 'r') as fh:
+                self._strings = json.load(fh)
+        return self._strings
+
+    def has_pv(self, pvname):
+        return pvname in self.pvs
+
+    def _values(self, pvname, info, i0, i1):
+        "values for samples i0 to i1 of a PV"
+        kind = info['kind']
+        if kind == 'float':
+            return np.asarray(self.values[info['offset']+i0:info['offset']+i1])
+        elif kind == 'string':
+            return np.array(self.strings[pvname][i0:i1], dtype=object)
+        arrays = self._arrays.get(info['id'], None)
+        if arrays is None:
+            fname = os.path.join(self.folder, ARRAYS_FOLDER, f"{info['id']}.npy")
+            arrays = self._arrays[info['id']] = np.load(fname, mmap_mode='r')
+        out = np.empty(i1-i0, dtype=object)
+        for i in range(i0, i1):
+            out[i-i0] = arrays[i]
+        return out
+
+    def pv_times(self, pvname):
+        "all times for a PV"
+        info = self.pvs[pvname]
+        return np.asarray(self.times[info['offset']:info['offset']+info['count']])
+
+    def extents(self):
+        "dict of {pvname: (first time, last time, count)} for PVs with data"
+        out = {}
+        for pvname, info in self.pvs.items():
+            i0, count = info['offset'], info['count']
+            if count > 0:
+                out[pvname] = (float(self.times[i0]), float(self.times[i0+count-1]), count)
+        return out
+
+    def get_run_data(self, pvname, t0, t1):
+        """data for a PV with t0 <= time <= t1 as (times, values, is_array),
+        or None if the PV is not in the run.  Float values are read-only
+        views of the memory-mapped files."""
+        info = self.pvs.get(pvname, None)
+        if info is None:
+            return None
+        times = self.pv_times(pvname)
+        i0 = int(np.searchsorted(times, t0, side='left'))
+        i1 = int(np.searchsorted(times, t1, side='right'))
+        return (times[i0:i1], self._values(pvname, info, i0, i1),
+                info['kind'] == 'array')
+
+    def get_snapshot(self, pvnames, t, tmin):
+        """last value at or before t (and after tmin) for several PVs,
+        as a dict of {pv_id: (time, value)}"""
+        out = {}
+        for pvname in pvnames:
+            info = self.pvs.get(pvname, None)
+            if info is None:
+                continue
+            times = self.pv_times(pvname)
+            i = int(np.searchsorted(times, t, side='right')) - 1
+            if i >= 0 and times[i] >= tmin:
+                value = self._values(pvname, info, i, i+1)[0]
+                if info['kind'] == 'float':
+                    value = float(value)
+                out[info['id']] = (float(times[i]), value)
+        return out
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+merging of (times, values) data read from archive runs, data tables
+and data blocks, each sorted by time, as pairs of ndarrays
+"""
+import numpy as np
+
+from .arrays import stack_arrays
+
+def window_parts(times, values, tmin, tmax, early=True):
+    """list of (times, values) for data sorted by time with
+    tmin <= time <= tmax, preceded by the last point before tmin if
+    early is True and there is one"""
+    parts = []
+    i0 = np.searchsorted(times, tmin, side='left')
+    i1 = np.searchsorted(times, tmax, side='right')
+    if early:
+        iearly = i0 - 1
+        if iearly >= 0:
+            parts.append((times[iearly:iearly+1], values[iearly:iearly+1]))
+    parts.append((times[i0:i1], values[i0:i1]))
+    return parts
+
+def finish_data(parts, is_array=False):
+    """merge (times, values) parts sorted by time into a single
+    (times, values), with values as float64 if possible, or for arrays
+    as a 2-D array of shape (n_samples, n_elements)"""
+    times, values = merge_sorted(parts)
+    if is_array:
+        return times, stack_arrays(list(values))
+    if values.dtype == object:
+        try:
+            values = values.astype('f8')
+        except (ValueError, TypeError):
+            pass
+    return times, values
+
+def align_data(data):
+    """align data for several PVs, a dict of pvname: (times, values),
+    onto the sorted union of their times, holding each value until the
+    next change.  Returns (times, {pvname: values}), with NaN (or None
+    for non-numeric values) before the first value of a PV."""
+    alltimes = [t for t, v in data.values()]
+    times = np.unique(np.concatenate(alltimes)) if len(alltimes) > 0 else np.zeros(0)
+    out = {}
+    for pvname, (ptimes, pvalues) in data.items():
+        index = np.searchsorted(ptimes, times, side='right') - 1
+        missing = index < 0
+        if pvalues.dtype.kind == 'f':
+            values = np.full((len(times),) + pvalues.shape[1:], np.nan)
+        else:
+            values = np.full(len(times), None, dtype=object)
+        if len(ptimes) > 0:
+            values[~missing] = pvalues[index[~missing]]
+        out[pvname] = values
+    return times, out
+
+def merge_two(a, b):
+    """merge two (times, values) pairs of ndarrays, each sorted by time.
+    For equal times, values from a come first."""
+    (ta, va), (tb, vb) = a, b
+    npts = len(ta) + len(tb)
+    pos_b = np.searchsorted(ta, tb, side='right') + np.arange(len(tb))
+    is_a = np.ones(npts, dtype=bool)
+    is_a[pos_b] = False
+    times = np.empty(npts, dtype='f8')
+    times[pos_b], times[is_a] = tb, ta
+    values = np.empty(npts, dtype=va.dtype if va.dtype == vb.dtype else object)
+    values[pos_b], values[is_a] = vb, va
+    return times, values
+
+def merge_sorted(parts):
+    """k-way merge of (times, values) pairs of ndarrays, each sorted by
+    time, by pairwise merges so that each point is copied log2(k) times"""
+    parts = [p for p in parts if len(p[0]) > 0]
+    if len(parts) == 0:
+        return np.zeros(0), np.zeros(0)
+    while len(parts) > 1:
+        merged = [merge_two(parts[i], parts[i+1])
+                  for i in range(0, len(parts)-1, 2)]
+        if len(parts) % 2 == 1:
+            merged.append(parts[-1])
+        parts = merged
+    return parts[0]
+
+def merge_chunks(streams, chunk_size=50000):
+    """lazily merge iterators of (times, values) chunks, each iterator
+    giving chunks in time order, yielding merged chunks in time order
+    of at most chunk_size points.  At most one chunk from each iterator
+    is held at a time."""
+    streams = [iter(s) for s in streams]
+    buffers = [None]*len(streams)
+    while True:
+        # refill empty buffers, dropping finished streams
+        for i, stream in enumerate(streams):
+            while stream is not None and (buffers[i] is None or len(buffers[i][0]) == 0):
+                buffers[i] = next(stream, None)
+                if buffers[i] is None:
+                    streams[i] = stream = None
+        active = [i for i, buff in enumerate(buffers) if buff is not None and len(buff[0]) > 0]
+        if len(active) == 0:
+            return
+        # later points of each stream are after the last point of its
+        # buffer, so all points up to the earliest of these are final
+        bound = min(buffers[i][0][-1] for i in active)
+        parts = []
+        for i in active:
+            times, values = buffers[i]
+            n = np.searchsorted(times, bound, side='right')
+            parts.append((times[:n], values[:n]))
+            buffers[i] = (times[n:], values[n:])
+        times, values = merge_sorted(parts)
+        for i0 in range(0, len(times), chunk_size):
+            yield times[i0:i0+chunk_size], values[i0:i0+chunk_size]
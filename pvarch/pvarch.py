@@ -6,10 +6,16 @@ import sys
 import os
 import time
 import toml
+import psutil
 from argparse import ArgumentParser
 
-from .util  import  tformat, get_config, get_credentials
+from .util  import  (tformat, get_config, get_credentials, normalize_pvname,
+                     time_str2sec, write_saverestore)
 from .schema import apache_config
+from .database import SimpleDB, table_report, move_pv, create_data_indexes
+from .rollup import rebuild_rollups
+from .extent import compute_extents
+from .export import export_run, export_pvs, FORMATS as EXPORT_FORMATS
 # from . import Cache, Archiver
 
 HELP_MESSAGE = """pvarch: control EpicsArchiver processes
@@ -32,6 +38,26 @@ HELP_MESSAGE = """pvarch: control EpicsArchiver processes
     pvarch set_runinfo [n] set the run information for the most recent run [10]
     pvarch save [folder]   save sql for cache and 2 most recent data archives [.]
 
+    pvarch table_report [minutes]  show rows and insert rates for data tables of current run [60]
+    pvarch move_pv pvname table    move PV and its data to another data table of current run
+                           (the archiver must be stopped)
+    pvarch index [rebuild] [covering] [dbnames]
+                           add (or rebuild) (pv_id, time) indexes on data tables [current run]
+    pvarch rollup [dbnames]  rebuild rollup (1 minute, 1 hour, 1 day) tables of closed runs
+                           [most recent closed run]
+    pvarch extents [dbnames] recompute extents of data for each PV [current run]
+    pvarch snapshot time [pvfile] [outfile]
+                           write save/restore file of archived values at a time
+                           ('YYYY-MM-DD_HH:MM:SS' or 'now'), for PVs listed in
+                           pvfile [all cached PVs], to outfile [stdout]
+    pvarch freeze dbnames  freeze closed runs to memory-mapped files in the 'frozen_dir' folder,
+                           after which the run databases can be dropped
+    pvarch export [parquet|hdf5] folder [dbnames]
+                           export runs to folder, one file per data table [parquet, current run]
+    pvarch export_pvs pvfile tstart tstop [parquet|hdf5] [folder]
+                           export PVs listed in pvfile between times tstart and tstop
+                           ('YYYY-MM-DD_HH:MM:SS' or 'now'), one file per PV [parquet, .]
+
     pvarch unconnected_pvs show unconnected PVs in cache
     pvarch add_pv          add a PV to the cache and archive
     pvarch add_pvfile      read a file of PVs to add to the Archiver
@@ -66,6 +92,24 @@ You will need to install these for your webserver by:
 
 DUMP_COMMAND = "{sql_dump:} -p{password:s} -u{user:s} {dbname:s} > {folder:s}/{dbname:s}.sql"
 
+def archive_running(cache, config):
+    "whether the archiver appears to be running, from recently archived values"
+    arch_tago = int(config.get('arch_activity_time', '60'))
+    arch_nmin = int(config.get('arch_activity_min_updates', '2'))
+    return cache.get_narchived(time_ago=arch_tago) > arch_nmin
+
+def wait_for_archive_stop(cache, poll_time=2, timeout=300):
+    """wait for a stopping archiver to write its last values, until its
+    status is 'offline' (set once its writer has stopped) or its process
+    no longer exists
+    returns whether the archiver stopped before timeout seconds"""
+    t0 = time.time()
+    while time.time() < t0 + timeout:
+        pid, status = cache.get_pidstatus(process='archive')
+        if status == 'offline' or pid <= 0 or not psutil.pid_exists(pid):
+            return True
+        time.sleep(poll_time)
+    return False
 
 def pvarch_main():
     parser = ArgumentParser(prog='pvarch', add_help=False,
@@ -169,9 +213,7 @@ def pvarch_main():
             if len(cache.get_values(time_ago=cache_tago)) < cache_nmin:
                 print("Warning: cache appears to not be running")
 
-            arch_tago = int(config.get('arch_activity_time', '60'))
-            arch_nmin = int(config.get('arch_activity_min_updates', '2'))
-            if cache.get_narchived(time_ago=arch_tago) > arch_nmin:
+            if archive_running(cache, config):
                 print("Archive appears to be running... try 'restart'?")
                 return
             archiver.mainloop()
@@ -186,8 +228,13 @@ def pvarch_main():
 
         elif action == 'next':
             cache.set_info(process='archive', status='stopping')
-            time.sleep(1)
             # cache.set_runinfo()
+            # extents are computed from the data, once it is all written
+            if wait_for_archive_stop(cache):
+                compute_extents(archiver.db)
+            else:
+                print("Archive did not stop: compute extents later with "
+                      "'pvarch extents %s'" % archiver.dbname)
             new_dbname = cache.create_next_archive()
             cache.set_info(process='archive', db=new_dbname)
             time.sleep(1)
@@ -274,6 +321,144 @@ def pvarch_main():
         for run in recent.execute().fetchall():
             cache.set_runinfo(run.db)
 
+    elif 'table_report' == cmd:
+        minutes = 60
+        if len(args.options) > 0:
+            minutes = float(args.options.pop(0))
+        report = table_report(archiver.db, minutes=minutes)
+        hline = '+------------+-------+--------------+--------------+------------+'
+        title = '|   table    |  PVs  |     rows     |  recent rows | rate (Hz)  |'
+        out = [hline, title, hline]
+        for tname, dat in report.items():
+            out.append('| %10s | %5d | %12d | %12d | %10.3f |' % (tname, dat['npvs'],
+                       dat['nrows'], dat['nrecent'], dat['rate']))
+        out.append(hline)
+        print('\n'.join(out))
+
+    elif 'move_pv' == cmd:
+        if len(args.options) < 2:
+            print("'pvarch move_pv' needs a PV name and a data table name")
+            return
+        pvname, tname = args.options[:2]
+        # the archiver keeps the data table of each PV, and would
+        # write to the old table after the move
+        if archive_running(cache, config):
+            print("Archive appears to be running: stop it with 'pvarch arch stop' "
+                  "before 'pvarch move_pv'")
+            return
+        nrows = move_pv(archiver.db, normalize_pvname(pvname), tname)
+        print("moved %d rows for %s to %s" % (nrows, pvname, tname))
+
+    elif 'index' == cmd:
+        rebuild = 'rebuild' in args.options
+        covering = 'covering' in args.options
+        dbnames = [a for a in args.options if a not in ('rebuild', 'covering')]
+        if len(dbnames) == 0:
+            dbnames = [archiver.dbname]
+        for dbname in dbnames:
+            db = SimpleDB(dbname, **cache.db.connection_args)
+            nidx = create_data_indexes(db, covering=covering, rebuild=rebuild)
+            print("%s: %d indexes created" % (dbname, nidx))
+
+    elif 'rollup' == cmd:
+        # the archiver writes rollup rows for the current run as values
+        # arrive, so rebuilding its rollups would double-count buckets
+        dbnames = args.options
+        if len(dbnames) == 0:
+            closed = [run.db for run in cache.get_runs() if run.db != archiver.dbname]
+            dbnames = closed[-1:]
+        for dbname in dbnames:
+            if dbname == archiver.dbname:
+                print("%s: cannot rebuild rollups of the current run" % dbname)
+                continue
+            db = SimpleDB(dbname, **cache.db.connection_args)
+            nrows = rebuild_rollups(db)
+            print("%s: %d rollup rows written" % (dbname, nrows))
+
+    elif 'extents' == cmd:
+        dbnames = args.options
+        if len(dbnames) == 0:
+            dbnames = [archiver.dbname]
+        for dbname in dbnames:
+            db = SimpleDB(dbname, **cache.db.connection_args)
+            compute_extents(db)
+
+    elif 'snapshot' == cmd:
+        if len(args.options) < 1:
+            print("'pvarch snapshot' needs a time, as 'YYYY-MM-DD_HH:MM:SS' or 'now'")
+            return
+        tstr = args.options.pop(0)
+        tsnap = time.time() if tstr == 'now' else time_str2sec(tstr)
+        if len(args.options) > 0:
+            with open(args.options.pop(0), 'r') as fh:
+                pvnames = [line.split('#')[0].strip() for line in fh.readlines()]
+            pvnames = [name for name in pvnames if len(name) > 0]
+        else:
+            pvnames = cache.get_pvnames()
+        snap = archiver.get_snapshot(pvnames, tsnap)
+        pvvals = []
+        for pvname in pvnames:
+            if pvname in snap:
+                value = snap[pvname][1]
+                if hasattr(value, 'tolist'):
+                    value = value.tolist()
+                pvvals.append((pvname, value))
+        missing = len(pvnames) - len(pvvals)
+        header = [f"archived values at {tformat(tsnap)}",
+                  f"{len(pvvals)} PVs, {missing} PVs not found"]
+        out = write_saverestore(pvvals, header=header)
+        if len(args.options) > 0:
+            with open(args.options.pop(0), 'w') as fh:
+                fh.write(out)
+        else:
+            print(out)
+
+    elif 'freeze' == cmd:
+        if len(args.options) < 1:
+            print("'pvarch freeze' needs one or more database names")
+            return
+        for dbname in args.options:
+            try:
+                archiver.freeze_run(dbname)
+            except ValueError as err:
+                print("cannot freeze %s: %s" % (dbname, err))
+
+    elif 'export' == cmd:
+        fmt = 'parquet'
+        if len(args.options) > 0 and args.options[0] in EXPORT_FORMATS:
+            fmt = args.options.pop(0)
+        if len(args.options) < 1:
+            print("'pvarch export' needs an output folder")
+            return
+        folder = args.options.pop(0)
+        dbnames = args.options
+        if len(dbnames) == 0:
+            dbnames = [archiver.dbname]
+        workers = int(archiver.config.query_workers)
+        for dbname in dbnames:
+            db = SimpleDB(dbname, **cache.db.connection_args)
+            export_run(db, outdir=folder, format=fmt, workers=workers)
+
+    elif 'export_pvs' == cmd:
+        if len(args.options) < 3:
+            print("'pvarch export_pvs' needs a PV file, start time, and stop time")
+            return
+        pvfile, tstart, tstop = args.options[:3]
+        args.options = args.options[3:]
+        fmt = 'parquet'
+        if len(args.options) > 0 and args.options[0] in EXPORT_FORMATS:
+            fmt = args.options.pop(0)
+        folder = args.options.pop(0) if len(args.options) > 0 else '.'
+        with open(pvfile, 'r') as fh:
+            pvnames = [line.split('#')[0].strip() for line in fh.readlines()]
+        pvnames = [name for name in pvnames if len(name) > 0]
+        tmin = time.time() if tstart == 'now' else time_str2sec(tstart)
+        tmax = time.time() if tstop == 'now' else time_str2sec(tstop)
+        workers = int(archiver.config.query_workers)
+        out = export_pvs(archiver, pvnames, tmin, tmax, outdir=folder,
+                         format=fmt, workers=workers)
+        print("exported %d of %d PVs to %s" % (len(out), len(pvnames), folder))
+
     elif cmd in ('add_pv', 'add_pvfile', 'drop_pv', 'unconnected_pvs'):
         # these commands need a Cache that has connected to Epics PVs
         cache = Cache(pvconnect=True, debug=args.debug)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+cache of the pv table of archive runs
+
+Reads of archived data need the id and data table (and other settings)
+of each PV in each run.  The pv table of a run is read in bulk once and
+kept, keyed by PV name.  The pv table of a closed run does not change,
+and is never re-read.  For the running archive, a stamp of the row
+count and sum of ids for each data table is checked, at most every
+'check_time' seconds, and the table is re-read when PVs are added, or
+moved to another data table (see database.move_pv()).
+"""
+import time
+import threading
+from sqlalchemy import select, func
+
+class RunPVs:
+    """rows of the pv table of an archive database, by PV name
+
+    Arguments
+    ---------
+    db          SimpleDB for the archive database
+    closed      whether the run is closed, so that the table will not change [False]
+    check_time  minimum time in seconds between checks for new PVs [10]
+    """
+    def __init__(self, db, closed=False, check_time=10.0):
+        self.db = db
+        self.closed = closed
+        self.check_time = check_time
+        self.rows = None
+        self.stamp = None
+        self.checktime = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.load())
+
+    def get_stamp(self):
+        """version stamp of the pv table: (data table, row count, sum of ids)
+        for each data table, which changes when a PV is added or moved"""
+        pvtab = self.db.tables['pv']
+        query = select(pvtab.c.data_table, func.count(pvtab.c.id), func.sum(pvtab.c.id))
+        query = query.group_by(pvtab.c.data_table).order_by(pvtab.c.data_table)
+        return tuple(tuple(row) for row in self.db.execute(query).fetchall())
+
+    def invalidate(self):
+        "force a check for changes on the next lookup"
+        self.checktime = 0
+
+    def load(self):
+        "get dict of {pvname: row}, re-reading the pv table if needed"
+        rows = self.rows
+        if rows is not None and (self.closed or
+                                 time.monotonic() < self.checktime + self.check_time):
+            return rows
+        with self.lock:
+            tnow = time.monotonic()
+            if self.rows is not None and (self.closed or
+                                          tnow < self.checktime + self.check_time):
+                return self.rows
+            stamp = None if self.closed else self.get_stamp()
+            if self.rows is None or stamp != self.stamp:
+                pvtab = self.db.tables['pv']
+                self.rows = {row.name: row for row in
+                             self.db.execute(select(pvtab)).fetchall()}
+                self.stamp = stamp
+            self.checktime = tnow
+            return self.rows
+
+    def get(self, pvname):
+        "row of the pv table for a PV, or None"
+        return self.load().get(pvname, None)
+
+    def get_many(self, pvnames):
+        "dict of {pvname: row} for the PVs in the table"
+        rows = self.load()
+        return {name: rows[name] for name in pvnames if name in rows}
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""
+rollup tables of per-PV aggregates of numeric data
+
+For each resolution (60, 3600, and 86400 seconds), the 'pvroll<res>'
+table holds one row per PV and time bucket, with the count, min, max,
+mean, first, and last value in that bucket.  The 'time' of a row is
+the start of the bucket.
+
+The archiver adds rows as buckets are completed, see RollupAccumulator.
+A bucket can have more than one row (as when the archiver is restarted
+part way through a bucket): these are combined when read.
+"""
+import time
+import numpy as np
+from sqlalchemy import select, func, delete
+
+from .database import (ROLLUP_RESOLUTIONS, rollup_tablename, rollup_table,
+                       data_tablenames, data_index, is_numeric_table,
+                       fetch_columns)
+from .blocks import read_blocks
+
+COLUMNS = ('time', 'count', 'vmin', 'vmax', 'vmean', 'vfirst', 'vlast')
+
+def rollup_row(pv_id, btime, count, vmin, vmax, vmean, vfirst, vlast):
+    "row for a rollup table"
+    return {'pv_id': pv_id, 'time': btime, 'count': count, 'vmin': vmin,
+            'vmax': vmax, 'vmean': vmean, 'vfirst': vfirst, 'vlast': vlast}
+
+def rollup_rows(pv_id, times, values, resolution):
+    """rows for a rollup table from (times, values) ndarrays, sorted by time.
+    NaN values are ignored."""
+    times = np.asarray(times, dtype='f8')
+    values = np.asarray(values, dtype='f8')
+    finite = np.isfinite(values)
+    times, values = times[finite], values[finite]
+    if len(times) == 0:
+        return []
+    btimes = np.floor(times/resolution)*resolution
+    starts = np.flatnonzero(np.r_[True, btimes[1:] != btimes[:-1]])
+    stops = np.r_[starts[1:], len(times)]
+    count = stops - starts
+    vmin = np.minimum.reduceat(values, starts)
+    vmax = np.maximum.reduceat(values, starts)
+    vmean = np.add.reduceat(values, starts)/count
+    return [rollup_row(pv_id, *vals) for vals in
+            zip(btimes[starts].tolist(), count.tolist(), vmin.tolist(),
+                vmax.tolist(), vmean.tolist(), values[starts].tolist(),
+                values[stops-1].tolist())]
+
+def choose_resolution(tmin, tmax, max_points, resolutions=ROLLUP_RESOLUTIONS):
+    """coarsest rollup resolution giving at least max_points buckets
+    between tmin and tmax, or None if no resolution is fine enough"""
+    for res in sorted(resolutions, reverse=True):
+        if (tmax - tmin)/res >= max_points:
+            return res
+    return None
+
+class RollupAccumulator:
+    """accumulates values for rollup tables
+
+    Arguments
+    ---------
+    resolutions  resolutions in seconds [ROLLUP_RESOLUTIONS]
+    """
+    def __init__(self, resolutions=ROLLUP_RESOLUTIONS):
+        self.resolutions = resolutions
+        # (resolution, pv_id): [bucket time, count, min, max, sum, first, last]
+        self.buckets = {}
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def _row(self, res, pv_id, bucket):
+        btime, count, vmin, vmax, vsum, vfirst, vlast = bucket
+        return rollup_tablename(res), rollup_row(pv_id, btime, count, vmin,
+                                                 vmax, vsum/count, vfirst, vlast)
+
+    def add(self, pv_id, ts, value):
+        """add a value for a PV
+
+        returns batch dict of {rollup table: list of rows} for
+        buckets that are completed by this value
+        """
+        out = {}
+        if value is None or not np.isfinite(value):
+            return out
+        for res in self.resolutions:
+            btime = (ts//res)*res
+            bucket = self.buckets.get((res, pv_id), None)
+            if bucket is not None and bucket[0] != btime:
+                tname, row = self._row(res, pv_id, bucket)
+                out.setdefault(tname, []).append(row)
+                bucket = None
+            if bucket is None:
+                self.buckets[(res, pv_id)] = [btime, 1, value, value, value, value, value]
+            else:
+                bucket[1] += 1
+                bucket[2] = min(bucket[2], value)
+                bucket[3] = max(bucket[3], value)
+                bucket[4] += value
+                bucket[6] = value
+        return out
+
+    def flush(self, before=None):
+        """rows for buckets that end before a time, or all buckets
+
+        returns batch dict of {rollup table: list of rows}
+        """
+        out = {}
+        for key, bucket in list(self.buckets.items()):
+            res, pv_id = key
+            if before is None or bucket[0] + res <= before:
+                tname, row = self._row(res, pv_id, bucket)
+                out.setdefault(tname, []).append(row)
+                self.buckets.pop(key)
+        return out
+
+def read_rollups(db, pv_id, tmin, tmax, resolution):
+    """read rollup data for a PV for buckets overlapping tmin to tmax
+
+    returns dict of ndarrays for 'time', 'count', 'vmin', 'vmax',
+    'vmean', 'vfirst', and 'vlast', with one entry per bucket
+    """
+    tab = db.tables[rollup_tablename(resolution)]
+    query = select(*[tab.c[col] for col in COLUMNS]).where(tab.c.pv_id==pv_id)
+    query = query.where(tab.c.time > tmin-resolution).where(tab.c.time <= tmax)
+    columns = fetch_columns(db, query.order_by(tab.c.time))
+    data = {col: np.asarray(vals, dtype='f8') for col, vals in zip(COLUMNS, columns)}
+    times = data['time']
+    if len(times) < 2 or (np.diff(times) > 0).all():
+        return data
+    # combine rows for the same bucket
+    starts = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+    stops = np.r_[starts[1:], len(times)]
+    count = np.add.reduceat(data['count'], starts)
+    return {'time': times[starts], 'count': count,
+            'vmin': np.minimum.reduceat(data['vmin'], starts),
+            'vmax': np.maximum.reduceat(data['vmax'], starts),
+            'vmean': np.add.reduceat(data['vmean']*data['count'], starts)/count,
+            'vfirst': data['vfirst'][starts], 'vlast': data['vlast'][stops-1]}
+
+def last_rollup_time(db, pv_id, resolution):
+    "end time of the last rollup bucket for a PV, or None"
+    tab = db.tables[rollup_tablename(resolution)]
+    tlast = db.execute(select(func.max(tab.c.time)).where(tab.c.pv_id==pv_id)).scalar()
+    return None if tlast is None else float(tlast) + resolution
+
+def rollup_points(data, resolution, method='minmax'):
+    """(times, values) for plotting from read_rollups() data, at bucket
+    centers: one point per bucket of the mean for method='mean', or
+    two points per bucket of the min and max otherwise"""
+    times = data['time'] + resolution/2.0
+    if method == 'mean':
+        return times, data['vmean']
+    return (np.repeat(times, 2),
+            np.column_stack((data['vmin'], data['vmax'])).ravel())
+
+def has_rollups(db):
+    "whether an archive database has all rollup tables"
+    return all(rollup_tablename(res) in db.tables for res in ROLLUP_RESOLUTIONS)
+
+def rebuild_rollups(db, resolutions=ROLLUP_RESOLUTIONS, verbose=True):
+    """rebuild the rollup tables for an archive database from the data
+    tables (and block table), replacing all existing rollup rows.
+    Rollup tables are created if needed, as for runs made before rollups.
+
+    returns number of rows written
+    """
+    t0 = time.time()
+    pvtab = db.tables['pv']
+    for res in resolutions:
+        if rollup_tablename(res) not in db.tables:
+            tab = rollup_table(db.metadata, res)
+            data_index(tab, server=db.engine.name)
+            tab.create(bind=db.engine)
+    with db.engine.begin() as conn:
+        for res in resolutions:
+            conn.execute(delete(db.tables[rollup_tablename(res)]))
+    nrows = 0
+    for tname in data_tablenames(db.tables):
+        dtable = db.tables[tname]
+        if not is_numeric_table(dtable):
+            continue
+        query = select(pvtab.c.id).where(pvtab.c.data_table==tname)
+        for pv_id in [row[0] for row in db.execute(query).fetchall()]:
+            query = select(dtable.c.time, dtable.c.value).where(dtable.c.pv_id==pv_id)
+            times, values = fetch_columns(db, query.order_by(dtable.c.time))
+            times = np.asarray(times, dtype='f8')
+            values = np.asarray(values, dtype='f8')
+            btimes, bvalues = read_blocks(db, pv_id, 0, 1.e12, as_numpy=True)
+            if len(btimes) > 0 and bvalues.dtype.kind == 'f':
+                times = np.concatenate((times, btimes))
+                values = np.concatenate((values, bvalues))
+                order = times.argsort(kind='stable')
+                times, values = times[order], values[order]
+            batches = {}
+            for res in resolutions:
+                rows = rollup_rows(pv_id, times, values, res)
+                if len(rows) > 0:
+                    batches[rollup_tablename(res)] = rows
+                    nrows += len(rows)
+            if len(batches) > 0:
+                db.insert_batches(batches)
+        if verbose:
+            print(f"  {tname}: {nrows} rollup rows, {time.time()-t0:.1f} sec")
+    return nrows
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+cache of data read from closed archive runs
+
+Data in a run that has stopped does not change, so (times, values)
+arrays read for a PV from a closed run can be kept and reused.  Data
+is cached in chunks of a fixed time span, keyed by (dbname, pvname,
+chunk index), in an LRU cache limited by size in bytes, and optionally
+also saved to .npy files in a cache directory.  Only float data is
+saved to disk.
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+def data_nbytes(times, values):
+    "approximate size in bytes of (times, values) arrays"
+    nbytes = times.nbytes + values.nbytes
+    if values.dtype == object:
+        nbytes += sum(getattr(v, 'nbytes', len(str(v))) for v in values)
+    return nbytes
+
+class RunCache:
+    """LRU cache of (times, values) arrays for closed runs
+
+    Arguments
+    ---------
+    max_bytes   maximum size of cached data in memory [256 MB]
+    cachedir    directory for .npy files, None for memory only [None]
+    chunk_time  time span in seconds of each chunk [86400]
+    """
+    def __init__(self, max_bytes=256*1024*1024, cachedir=None, chunk_time=86400.0):
+        self.max_bytes = max_bytes
+        self.cachedir = cachedir if cachedir not in ('', None) else None
+        self.chunk_time = float(chunk_time)
+        self.data = OrderedDict()
+        self.nbytes = 0
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def chunks(self, t0, t1):
+        "indices of the chunks covering the time range t0 to t1"
+        return range(int(t0//self.chunk_time), int(t1//self.chunk_time)+1)
+
+    def chunk_range(self, chunk):
+        "(start, stop) times of a chunk, with start <= time < stop"
+        return chunk*self.chunk_time, (chunk+1)*self.chunk_time
+
+    def filename(self, key):
+        dbname, pvname, chunk = key
+        pvname = pvname.replace(os.sep, '_')
+        return os.path.join(self.cachedir, dbname, f'{pvname}_{chunk}.npy')
+
+    def get(self, key):
+        "get (times, values) for a key, or None if not cached"
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+        if self.cachedir is not None:
+            fname = self.filename(key)
+            if os.path.exists(fname):
+                try:
+                    times, values = np.load(fname)
+                except (OSError, ValueError):
+                    times = None
+                if times is not None:
+                    self.put(key, times, values, save=False)
+                    self.hits += 1
+                    return times, values
+        self.misses += 1
+        return None
+
+    def put(self, key, times, values, save=True):
+        "add (times, values) for a key"
+        nbytes = data_nbytes(times, values)
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.data:
+                self.nbytes -= data_nbytes(*self.data.pop(key))
+            self.data[key] = (times, values)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, old = self.data.popitem(last=False)
+                self.nbytes -= data_nbytes(*old)
+        if save and self.cachedir is not None and values.dtype.kind == 'f':
+            fname = self.filename(key)
+            try:
+                os.makedirs(os.path.dirname(fname), exist_ok=True)
+                tmpname = f'{fname}.{os.getpid()}.npy'
+                np.save(tmpname, np.vstack((times, values)))
+                os.replace(tmpname, fname)
+            except OSError:
+                pass
+
+    def clear(self):
+        "clear the in-memory cache"
+        with self.lock:
+            self.data.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        "dict of cache statistics"
+        return {'entries': len(self.data), 'nbytes': self.nbytes,
+                'hits': self.hits, 'misses': self.misses}
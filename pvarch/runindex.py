@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+"""
+index of archive runs by time interval
+"""
+from bisect import bisect_left, bisect_right
+
+class RunIndex:
+    """sorted interval index of archive runs, for finding the runs that
+    overlap a time range with binary searches
+
+    Arguments
+    ---------
+    runs    rows of the runs table, with start_time and stop_time
+    """
+    def __init__(self, runs):
+        self.runs = sorted(runs, key=lambda run: (run.start_time, run.stop_time))
+        self.starts = [run.start_time for run in self.runs]
+        # running maximum of stop times, which does not decrease
+        self.maxstops = []
+        maxstop = float('-inf')
+        for run in self.runs:
+            maxstop = max(maxstop, run.stop_time)
+            self.maxstops.append(maxstop)
+
+    def __len__(self):
+        return len(self.runs)
+
+    def overlapping(self, start_time, stop_time):
+        """runs with stop_time > start_time and start_time < stop_time,
+        sorted by start time"""
+        # runs before i0 all stop at or before start_time,
+        # runs from i1 on all start at or after stop_time
+        i0 = bisect_right(self.maxstops, start_time)
+        i1 = bisect_left(self.starts, stop_time)
+        return [run for run in self.runs[i0:i1] if run.stop_time > start_time]
@@ -11,10 +11,12 @@ pvdat_init_pv = """create table pv(
   data_table   varchar(16) default null,
   deadtime     double default '10',
   deadband     double default '0.00000001',
+  compress     enum('none','swingdoor') default 'none',
+  tolerance    double default '0',
   graph_hi     tinyblob,
   graph_lo     tinyblob,
   graph_type   enum('normal','log','discrete') default null,
-  type         enum('int','double','string','enum') not null,
+  type         enum('int','double','string','enum','array') not null,
   active       enum('yes','no') default 'yes',
   primary key (id),
   unique key name (name),
@@ -23,10 +25,58 @@ pvdat_init_pv = """create table pv(
 """
 
 pvdat_init_dat = """create table pvdat{idat:03d} (
+  time double not null,
+  pv_id int(10) unsigned not null,
+  value double,
+  key pv_time_idx (pv_id, time)
+) default charset=latin1;
+"""
+
+pvdat_init_str = """create table pvstr{idat:03d} (
   time double not null,
   pv_id int(10) unsigned not null,
   value varchar(4096),
-  key pv_idx (pv_id)
+  key pv_time_idx (pv_id, time)
+) default charset=latin1;
+"""
+
+pvdat_init_array = """create table pvarray (
+  time double not null,
+  pv_id int(10) unsigned not null,
+  value longblob,
+  key pv_time_idx (pv_id, time)
+) default charset=latin1;
+"""
+
+pvdat_init_block = """create table pvblock (
+  id int(10) unsigned not null auto_increment,
+  pv_id int(10) unsigned not null,
+  time double not null,
+  t_end double not null,
+  count int(10) unsigned not null,
+  times longblob,
+  vals longblob,
+  primary key (id),
+  key pv_time_idx (pv_id, time)
+) default charset=latin1;
+"""
+
+pvdat_init_rollup = """create table pvroll{res:d} (
+  pv_id int(10) unsigned not null,
+  time double not null,
+  count int(10) unsigned not null,
+  vmin double, vmax double, vmean double,
+  vfirst double, vlast double,
+  key pv_time_idx (pv_id, time)
+) default charset=latin1;
+"""
+
+pvdat_init_extent = """create table pvextent (
+  pv_id int(10) unsigned not null,
+  time double not null,
+  t_end double not null,
+  count int(10) unsigned not null,
+  key pv_time_idx (pv_id, time)
 ) default charset=latin1;
 """
 
@@ -54,6 +104,7 @@ create table cache (
   type      varchar(64) not null default 'int',
   value     varchar(4096) default null,
   cvalue    varchar(4096) default null,
+  array_value longblob,
   ts        double default null,
   active    enum('yes','no') not null default 'yes',
   primary key (id),
@@ -139,5 +190,12 @@ def initial_sql(config):
 
     for idat in range(1, 129):
         sql.append(pvdat_init_dat.format(idat=idat))
+    for idat in range(1, 17):
+        sql.append(pvdat_init_str.format(idat=idat))
+    sql.append(pvdat_init_array)
+    sql.append(pvdat_init_block)
+    for res in (60, 3600, 86400):
+        sql.append(pvdat_init_rollup.format(res=res))
+    sql.append(pvdat_init_extent)
     sql.append('; ')
     return '\n'.join(sql)
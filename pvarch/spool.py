@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+"""
+local, append-only spool file for archive values.
+
+Values are appended to a memory-mapped file before being written to the
+archive database, and replayed into the data tables in bulk.  Replayed
+records are dropped from the spool only once their insert has been
+committed, so values survive database restarts and outages.
+
+File layout:  a 32 byte header of
+     magic (8 bytes), head offset (uint64), tail offset (uint64), reserved
+followed by records of
+     pv_id (uint32), time (float64), value type (uint8),
+     table name length (uint8), run name length (uint8), value length (uint32),
+     table name (bytes), run name (bytes), value (bytes)
+
+The run name is the archive database the record is for, so that records
+spooled before a new run is started are replayed into their own run.
+Records in spool files made before run names were stored (with magic
+'PVSPOOL1') are rewritten when the file is opened, with an empty run
+name, and are replayed into the database given to replay().
+
+Rows for the block table are stored with value type VTYPE_BLOCK, and
+a value of t_end (float64), count (uint32), length of times (uint32),
+times (bytes), vals (bytes).  Rows for the rollup tables are stored with
+value type VTYPE_ROLLUP, and a value of count (uint32), and vmin, vmax,
+vmean, vfirst, vlast (float64).  Rows for the extent table are stored with
+value type VTYPE_EXTENT, and a value of t_end (float64), count (uint32).
+
+Records between 'head' and 'tail' are waiting to be replayed.
+"""
+import os
+import mmap
+import struct
+import threading
+
+from .database import SimpleDB
+
+SPOOL_MAGIC = b'PVSPOOL2'
+SPOOL_MAGIC_V1 = b'PVSPOOL1'
+HEADER = struct.Struct('<8sQQ8x')
+RECORD = struct.Struct('<IdBBBI')
+RECORD_V1 = struct.Struct('<IdBBI')
+FLOAT = struct.Struct('<d')
+BLOCK = struct.Struct('<dII')
+ROLLUP = struct.Struct('<I5d')
+EXTENT = struct.Struct('<dI')
+MIN_SIZE = 1024*1024
+
+VTYPE_NONE, VTYPE_BYTES, VTYPE_FLOAT, VTYPE_BLOCK, VTYPE_ROLLUP = 0, 1, 2, 3, 4
+VTYPE_EXTENT = 5
+ROLLUP_COLUMNS = ('vmin', 'vmax', 'vmean', 'vfirst', 'vlast')
+
+def encode_record(dbname, tablename, row):
+    "encode one data table row for an archive database as spool record"
+    value = row.get('value', None)
+    if 'times' in row:
+        vtype = VTYPE_BLOCK
+        vbytes = b''.join((BLOCK.pack(row['t_end'], row['count'], len(row['times'])),
+                           row['times'], row['vals']))
+    elif 'vmean' in row:
+        vtype = VTYPE_ROLLUP
+        vbytes = ROLLUP.pack(row['count'], *[row[col] for col in ROLLUP_COLUMNS])
+    elif 't_end' in row:
+        vtype = VTYPE_EXTENT
+        vbytes = EXTENT.pack(row['t_end'], row['count'])
+    elif value is None:
+        vtype, vbytes = VTYPE_NONE, b''
+    elif isinstance(value, float):
+        vtype, vbytes = VTYPE_FLOAT, FLOAT.pack(value)
+    else:
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        vtype, vbytes = VTYPE_BYTES, bytes(value)
+    tname = tablename.encode('utf-8')
+    dbname = dbname.encode('utf-8')
+    return b''.join((RECORD.pack(row['pv_id'], row['time'], vtype,
+                                 len(tname), len(dbname), len(vbytes)),
+                     tname, dbname, vbytes))
+
+def decode_records(buff, offset, end, max_rows=None):
+    """decode records in buff[offset:end] for one archive database,
+    stopping at the first record for another database
+
+    returns name of archive database (None for an empty run name),
+    batch dict of {tablename: list of rows}, number of rows, and the
+    offset after the last record decoded
+    """
+    batch, nrows, batch_dbname = {}, 0, None
+    while offset < end:
+        if max_rows is not None and nrows >= max_rows:
+            break
+        pv_id, ts, vtype, tlen, dlen, vlen = RECORD.unpack_from(buff, offset)
+        start = offset + RECORD.size
+        tname = bytes(buff[start:start+tlen]).decode('utf-8')
+        start += tlen
+        dbname = bytes(buff[start:start+dlen]).decode('utf-8') if dlen > 0 else None
+        start += dlen
+        if nrows > 0 and dbname != batch_dbname:
+            break
+        batch_dbname = dbname
+        vbytes = bytes(buff[start:start+vlen])
+        offset = start + vlen
+        row = {'pv_id': pv_id, 'time': ts}
+        if vtype == VTYPE_BLOCK:
+            t_end, count, ntimes = BLOCK.unpack_from(vbytes, 0)
+            row.update({'t_end': t_end, 'count': count,
+                        'times': vbytes[BLOCK.size:BLOCK.size+ntimes],
+                        'vals': vbytes[BLOCK.size+ntimes:]})
+        elif vtype == VTYPE_ROLLUP:
+            vals = ROLLUP.unpack(vbytes)
+            row['count'] = vals[0]
+            row.update(zip(ROLLUP_COLUMNS, vals[1:]))
+        elif vtype == VTYPE_EXTENT:
+            row['t_end'], row['count'] = EXTENT.unpack(vbytes)
+        elif vtype == VTYPE_FLOAT:
+            row['value'] = FLOAT.unpack(vbytes)[0]
+        elif vtype == VTYPE_NONE:
+            row['value'] = None
+        else:
+            row['value'] = vbytes
+        if tname not in batch:
+            batch[tname] = []
+        batch[tname].append(row)
+        nrows += 1
+    return batch_dbname, batch, nrows, offset
+
+
+class Spool:
+    """memory-mapped, append-only spool of archive values
+
+    Arguments
+    ----------
+    filename    name of spool file, created if needed
+    size        initial size of file in bytes [16 MB], grown as needed
+    """
+    def __init__(self, filename, size=16*MIN_SIZE):
+        self.filename = os.path.abspath(filename)
+        self.lock = threading.Lock()
+        self.replay_lock = threading.Lock()
+        exists = os.path.exists(self.filename)
+        self.fh = open(self.filename, 'r+b' if exists else 'w+b')
+        fsize = os.fstat(self.fh.fileno()).st_size
+        if fsize < max(size, MIN_SIZE):
+            self.fh.truncate(max(size, MIN_SIZE))
+        self.mmap = mmap.mmap(self.fh.fileno(), 0)
+        magic, head, tail = HEADER.unpack_from(self.mmap, 0)
+        if magic not in (SPOOL_MAGIC, SPOOL_MAGIC_V1):
+            if exists and fsize > 0:
+                raise ValueError(f"'{filename}' is not a pvarch spool file")
+            head = tail = HEADER.size
+            self._set_offsets(head, tail)
+        self.head, self.tail = head, tail
+        if magic == SPOOL_MAGIC_V1:
+            self._upgrade()
+
+    def _set_offsets(self, head, tail):
+        HEADER.pack_into(self.mmap, 0, SPOOL_MAGIC, head, tail)
+        self.head, self.tail = head, tail
+
+    def _upgrade(self):
+        """rewrite records from a 'PVSPOOL1' file with an empty run name.
+        The new records are written after the old ones, so that the old
+        records are kept until the header is updated"""
+        records = []
+        offset = self.head
+        while offset < self.tail:
+            pv_id, ts, vtype, tlen, vlen = RECORD_V1.unpack_from(self.mmap, offset)
+            offset += RECORD_V1.size
+            tname = bytes(self.mmap[offset:offset+tlen])
+            vbytes = bytes(self.mmap[offset+tlen:offset+tlen+vlen])
+            offset += tlen + vlen
+            records.append(b''.join((RECORD.pack(pv_id, ts, vtype, tlen, 0, vlen),
+                                     tname, vbytes)))
+        data = b''.join(records)
+        if self.tail + len(data) > len(self.mmap):
+            self._grow(len(data))
+        self.mmap[self.tail:self.tail+len(data)] = data
+        self.mmap.flush()
+        if len(data) == 0:
+            self._set_offsets(HEADER.size, HEADER.size)
+        else:
+            self._set_offsets(self.tail, self.tail + len(data))
+        self.mmap.flush()
+
+    def _grow(self, nbytes):
+        "grow file and re-map, to hold at least nbytes more"
+        size = len(self.mmap)
+        while size < self.tail + nbytes:
+            size *= 2
+        self.mmap.flush()
+        self.mmap.close()
+        self.fh.truncate(size)
+        self.mmap = mmap.mmap(self.fh.fileno(), 0)
+
+    def pending(self):
+        "number of bytes of records waiting to be replayed"
+        return self.tail - self.head
+
+    def append(self, batch, dbname):
+        """append a batch of {tablename: list of rows} for an archive
+        database to the spool
+        returns number of rows appended
+        """
+        records = [encode_record(dbname, tname, row) for tname, rows in batch.items()
+                   for row in rows]
+        if len(records) < 1:
+            return 0
+        data = b''.join(records)
+        with self.lock:
+            if self.tail + len(data) > len(self.mmap):
+                self._grow(len(data))
+            self.mmap[self.tail:self.tail+len(data)] = data
+            self._set_offsets(self.head, self.tail + len(data))
+            self.mmap.flush()
+        return len(records)
+
+    def replay(self, db, max_rows=50000):
+        """insert spooled records into their archive databases, max_rows
+        at a time, dropping each chunk from the spool once it has been
+        committed.  Records for db.dbname (and records without a run name)
+        are inserted with db, and records for other runs with a SimpleDB
+        using the connection arguments of db.
+
+        returns number of rows inserted. Database errors are raised,
+        leaving the uncommitted records in the spool.
+        """
+        total = 0
+        dbs = {}
+        with self.replay_lock:
+            while True:
+                with self.lock:
+                    dbname, batch, nrows, offset = decode_records(self.mmap, self.head,
+                                                                  self.tail,
+                                                                  max_rows=max_rows)
+                if nrows < 1:
+                    break
+                if dbname is None or dbname == db.dbname:
+                    rundb = db
+                else:
+                    if dbname not in dbs:
+                        dbs[dbname] = SimpleDB(dbname, **db.connection_args)
+                    rundb = dbs[dbname]
+                rundb.insert_batches(batch)
+                total += nrows
+                with self.lock:
+                    if offset == self.tail:   # all replayed: truncate
+                        self._set_offsets(HEADER.size, HEADER.size)
+                    else:
+                        self._set_offsets(offset, self.tail)
+                    self.mmap.flush()
+        return total
+
+    def close(self):
+        "close spool file"
+        with self.lock:
+            self.mmap.flush()
+            self.mmap.close()
+            self.fh.close()
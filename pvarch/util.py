@@ -42,6 +42,37 @@ class Config:
         self.cache_db = 'pvarch_main'
         self.dat_prefix = 'pvdata'
 
+        # archive writer: 0 threads means synchronous writes
+        self.archive_writer_threads = 0
+        self.archive_queue_size = 1024
+        self.archive_queue_highwater = 0.75
+        self.archive_queue_policy = 'block'
+        # local spool file for archive values: '' for none
+        self.archive_spool = ''
+        # storage of values: 'rows' (one row per value) or 'blocks'
+        self.archive_storage = 'rows'
+        self.archive_block_samples = 1000
+        self.archive_block_time = 3600.0
+        # seconds that samples are held in an open block before it is
+        # written, so that they can be read and are not lost on a crash
+        self.archive_block_flush = 60.0
+        # placement of new PVs in data tables: 'hash' or 'balanced'
+        self.archive_table_policy = 'hash'
+        # concurrent queries across runs and data tables
+        self.query_workers = 8
+        self.query_timeout = 60.0
+        # cache of data read from closed runs: size in MB, directory
+        # for .npy files ('' for memory only), and chunk time in seconds
+        self.runcache_size = 256
+        self.runcache_dir = ''
+        self.runcache_chunk = 86400.0
+        # folder for frozen (memory-mapped) copies of closed runs: '' for none
+        self.frozen_dir = ''
+        # seconds between checks for changes to the runs table
+        self.runindex_check = 10.0
+        # seconds between checks for new PVs in the pv table of the running archive
+        self.pvmeta_check = 10.0
+
         for key, val in kws.items():
             setattr(self, key, val)
 
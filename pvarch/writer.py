@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+background writer for the archiver: batches of values to be
+archived are put on a bounded queue and written to the data
+tables by one or more writer threads.
+"""
+import time
+import queue
+import logging
+import threading
+
+QUEUE_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+class ArchiveWriter:
+    """write-behind queue for archive values
+
+    Arguments
+    ----------
+    db          SimpleDB for the archive database
+    nthreads    number of writer threads, each using its own connection [1]
+    maxsize     maximum number of batches held in the queue [1024]
+    high_water  fraction of maxsize at which the queue is reported as congested [0.75]
+    policy      what to do when the queue is full, one of
+                  'block'        wait for space (backpressure on collect) [default]
+                  'drop_newest'  discard the batch being added
+                  'drop_oldest'  discard the oldest queued batch
+    max_rows    maximum number of rows combined into one write [20000]
+    spool       Spool to replay into the database [None]
+
+    A batch is a dict of {data_table: list of row dicts}, as used by
+    SimpleDB.insert_batches().
+
+    With a spool, batches are appended to the spool file instead of
+    the queue, and a single writer thread replays the spool into the
+    database. Batches that fail to be written from the queue are also
+    appended to the spool, if there is one.
+    """
+    def __init__(self, db, nthreads=1, maxsize=1024, high_water=0.75,
+                 policy='block', max_rows=20000, spool=None):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"unknown queue policy '{policy}'")
+        self.db = db
+        self.policy = policy
+        self.maxsize = max(1, int(maxsize))
+        self.high_water = max(1, int(high_water*self.maxsize))
+        self.max_rows = max_rows
+        self.spool = spool
+        self.queue = queue.Queue(maxsize=self.maxsize)
+        self.lock = threading.Lock()
+        self.counters = {'queued': 0, 'written': 0, 'dropped': 0,
+                         'errors': 0, 'high_water': 0, 'max_depth': 0}
+        self.running = False
+        target = self._run
+        if spool is not None:
+            target, nthreads = self._run_spool, 1
+        self.threads = [threading.Thread(target=target, daemon=True,
+                                         name=f'pvarch_writer{i}')
+                        for i in range(max(1, int(nthreads)))]
+
+    def start(self):
+        "start writer threads"
+        self.running = True
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout=30.0):
+        "stop writer threads, after writing everything queued"
+        self.running = False
+        for thread in self.threads:
+            thread.join(timeout=timeout)
+
+    def _count(self, key, n=1):
+        with self.lock:
+            self.counters[key] += n
+
+    def depth(self):
+        "number of batches currently queued"
+        return self.queue.qsize()
+
+    def congested(self):
+        "whether the queue depth is above the high-water mark"
+        return self.queue.qsize() >= self.high_water
+
+    def stats(self):
+        "dict of queue counters, including current depth"
+        with self.lock:
+            out = dict(self.counters)
+        out['depth'] = self.queue.qsize()
+        if self.spool is not None:
+            out['spooled_bytes'] = self.spool.pending()
+        return out
+
+    def put(self, batch):
+        """add a batch to the queue, following the queue policy when full
+        returns whether the batch was queued
+        """
+        nrows = sum(len(rows) for rows in batch.values())
+        if nrows < 1:
+            return True
+        if self.spool is not None:
+            self._count('queued', self.spool.append(batch, self.db.dbname))
+            return True
+        if self.policy == 'block':
+            self.queue.put(batch)
+        else:
+            try:
+                self.queue.put_nowait(batch)
+            except queue.Full:
+                if self.policy == 'drop_newest':
+                    self._count('dropped', nrows)
+                    return False
+                try:
+                    old = self.queue.get_nowait()
+                    self._count('dropped', sum(len(r) for r in old.values()))
+                except queue.Empty:
+                    pass
+                self.queue.put(batch)
+        self._count('queued', nrows)
+        depth = self.queue.qsize()
+        with self.lock:
+            self.counters['max_depth'] = max(depth, self.counters['max_depth'])
+            if depth >= self.high_water:
+                self.counters['high_water'] += 1
+        return True
+
+    def _take(self):
+        """take queued batches, up to max_rows, merged into one batch"""
+        try:
+            batch = self.queue.get(timeout=0.25)
+        except queue.Empty:
+            return None
+        out = {tab: list(rows) for tab, rows in batch.items()}
+        nrows = sum(len(rows) for rows in out.values())
+        while nrows < self.max_rows:
+            try:
+                batch = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            for tab, rows in batch.items():
+                if tab not in out:
+                    out[tab] = []
+                out[tab].extend(rows)
+                nrows += len(rows)
+        return out
+
+    def _run(self):
+        while self.running or not self.queue.empty():
+            batch = self._take()
+            if batch is None:
+                continue
+            try:
+                self._count('written', self.db.insert_batches(batch))
+            except Exception:
+                self._count('errors')
+                logging.exception('archive writer could not write batch')
+                if self.spool is not None:
+                    self.spool.append(batch, self.db.dbname)
+
+    def _run_spool(self):
+        while True:
+            running = self.running
+            try:
+                nrows = self.spool.replay(self.db, max_rows=self.max_rows)
+                self._count('written', nrows)
+            except Exception:
+                nrows = 0
+                self._count('errors')
+                logging.exception('archive writer could not replay spool')
+                time.sleep(5.0)
+            if not running:
+                break
+            if nrows == 0:
+                time.sleep(0.25)
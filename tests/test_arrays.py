@@ -0,0 +1,35 @@
+import numpy as np
+
+from pvarch.arrays import (encode_array, decode_array, array_text, array_blob,
+                           is_array_blob, is_array_placeholder, stack_arrays)
+
+def test_encode_decode():
+    for arr in (np.arange(10.0), np.arange(12, dtype='i4').reshape(3, 4),
+                np.zeros(0)):
+        for compress in (True, False):
+            out = decode_array(encode_array(arr, compress=compress))
+            assert out.dtype == arr.dtype and out.shape == arr.shape
+            assert np.all(out == arr)
+
+def test_array_blob():
+    arr = np.linspace(0, 1, 5)
+    blob = encode_array(arr)
+    assert array_blob(blob) == blob
+    assert np.all(decode_array(array_blob(arr)) == arr)
+    assert np.all(decode_array(array_blob(array_text(arr))) == arr)
+    # placeholders and scalars are not arrays
+    assert array_blob('<array size=5, type=time_double>') is None
+    assert array_blob('1.5') is None
+    assert array_blob(None) is None
+
+def test_placeholder():
+    assert is_array_placeholder('<array size=5, type=time_double>')
+    assert not is_array_placeholder('Idle')
+    assert not is_array_placeholder(encode_array(np.arange(3)))
+    assert not is_array_blob('Idle')
+
+def test_stack_arrays():
+    out = stack_arrays([np.arange(3.0), np.arange(2.0)])
+    assert out.shape == (2, 3)
+    assert np.isnan(out[1, 2])
+    assert stack_arrays([]).shape == (0, 0)
@@ -0,0 +1,49 @@
+import numpy as np
+
+from pvarch.blocks import (encode_times, decode_times, encode_values,
+                           decode_values, make_block, BlockBuffer,
+                           KIND_FLOAT, KIND_STRING)
+
+def test_times_roundtrip():
+    times = 1.7e9 + np.cumsum(np.random.default_rng(1).random(500))
+    assert np.array_equal(decode_times(encode_times(times)), times)
+    assert len(decode_times(encode_times([]))) == 0
+
+def test_values_roundtrip():
+    values = np.array([1.0, -0.0, np.inf, 1e-300, 3.25, 3.25])
+    blob = encode_values(values)
+    assert blob[:1] == KIND_FLOAT
+    out = decode_values(blob)
+    assert out.tobytes() == values.tobytes()
+    nan = decode_values(encode_values([np.nan, 2.0]))
+    assert np.isnan(nan[0]) and nan[1] == 2.0
+
+def test_string_values():
+    blob = encode_values(['Idle', b'Moving', 3])
+    assert blob[:1] == KIND_STRING
+    assert decode_values(blob) == ['Idle', 'Moving', '3']
+
+def test_make_block():
+    row = make_block(4, [(3.0, 1.0), (1.0, 2.0), (2.0, 3.0)])
+    assert (row['pv_id'], row['time'], row['t_end'], row['count']) == (4, 1.0, 3.0, 3)
+    assert list(decode_times(row['times'])) == [1.0, 2.0, 3.0]
+    assert list(decode_values(row['vals'])) == [2.0, 3.0, 1.0]
+
+def test_block_buffer():
+    buff = BlockBuffer(max_samples=3, max_time=100.0)
+    assert buff.add(1, 0.0, 1.0) is None
+    assert buff.add(1, 1.0, 2.0) is None
+    assert buff.add(2, 5.0, 'Idle') is None
+    block = buff.add(1, 2.0, 3.0)
+    assert block['count'] == 3 and block['pv_id'] == 1
+    # a block is written once it spans max_time
+    assert buff.add(2, 104.0, 'Moving') is None
+    block = buff.add(2, 105.0, 'Idle')
+    assert block['count'] == 3 and decode_values(block['vals'])[0] == 'Idle'
+
+    buff.add(1, 200.0, 1.0)
+    buff.add(2, 300.0, 2.0)
+    assert len(buff) == 2
+    assert [b['pv_id'] for b in buff.flush(older_than=250.0)] == [1]
+    assert [b['pv_id'] for b in buff.flush()] == [2]
+    assert len(buff) == 0
@@ -0,0 +1,36 @@
+import numpy as np
+
+from pvarch.compress import SwingingDoor
+
+def compress(times, values, tolerance):
+    door = SwingingDoor(tolerance)
+    points = []
+    for t, v in zip(times, values):
+        points.extend(door.add(t, v))
+    points.extend(door.flush())
+    return points
+
+def test_line_is_two_points():
+    times = np.arange(100.0)
+    points = compress(times, 3.0*times + 1.0, 0.01)
+    assert points == [(0.0, 1.0), (99.0, 298.0)]
+
+def test_interpolation_within_tolerance():
+    times = np.linspace(0, 20, 2001)
+    values = np.sin(times)
+    for tol in (0.001, 0.01, 0.1):
+        points = compress(times, values, tol)
+        assert len(points) < len(times)/5
+        ptimes, pvalues = map(np.array, zip(*points))
+        assert ptimes[0] == times[0] and ptimes[-1] == times[-1]
+        assert np.all(np.abs(np.interp(times, ptimes, pvalues) - values) <= tol*(1+1e-9))
+
+def test_old_and_repeated_times():
+    door = SwingingDoor(0.1)
+    assert door.add(10.0, 1.0) == [(10.0, 1.0)]
+    assert door.add(5.0, 2.0) == []
+    assert door.add(11.0, 1.0) == []
+    assert door.add(11.0, 5.0) == []
+    assert door.flush(older_than=11.0) == []
+    assert door.flush(older_than=12.0) == [(11.0, 1.0)]
+    assert door.flush() == []
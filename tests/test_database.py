@@ -0,0 +1,109 @@
+import time
+import pytest
+
+from sqlalchemy import (create_engine, MetaData, Table, Column, Integer, Float,
+                        Text, LargeBinary, Index, inspect)
+
+from pvarch import database
+from pvarch.database import (SimpleDB, archived_tablenames, count_rows,
+                             time_range, create_data_indexes, copy_buffer,
+                             run_parallel, QueryError)
+
+def make_run(fname):
+    engine = create_engine(f'sqlite:///{fname}')
+    metadata = MetaData()
+    dat = Table('pvdat001', metadata, Column('time', Float),
+                Column('pv_id', Integer), Column('value', Float))
+    # as named by the schema.py templates
+    Index('pv_time_idx', dat.c.pv_id, dat.c.time)
+    Table('pvstr001', metadata, Column('time', Float),
+          Column('pv_id', Integer), Column('value', Text))
+    block = Table('pvblock', metadata, Column('id', Integer, primary_key=True),
+                  Column('pv_id', Integer), Column('time', Float),
+                  Column('t_end', Float), Column('count', Integer),
+                  Column('times', LargeBinary), Column('vals', LargeBinary))
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(dat.insert(), [{'time': 10.0, 'pv_id': 1, 'value': 1.0},
+                                    {'time': 20.0, 'pv_id': 1, 'value': 2.0}])
+        conn.execute(block.insert(), [{'pv_id': 2, 'time': 5.0, 't_end': 50.0,
+                                       'count': 10}])
+    engine.dispose()
+
+@pytest.fixture
+def run_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SCHEMA_CACHE_DIR', str(tmp_path/'cache'))
+    fname = str(tmp_path/'run.db')
+    make_run(fname)
+    database.clear_engines()
+    yield SimpleDB(server='sqlite', dbname=fname, user='pvarch',
+                   pvarch_main='pvarch_main')
+    database.clear_engines()
+
+def test_archived_tablenames(run_db):
+    assert archived_tablenames(run_db.tables) == ['pvdat001', 'pvstr001', 'pvblock']
+
+def test_block_counts_and_ranges(run_db):
+    assert count_rows(run_db, 'pvdat001', tmin=15.0) == 1
+    # blocks count by the time of their last sample
+    assert count_rows(run_db, 'pvblock', tmin=40.0) == 1
+    assert count_rows(run_db, 'pvblock', tmin=60.0) == 0
+    assert time_range(run_db, 'pvdat001') == (10.0, 20.0)
+    assert time_range(run_db, 'pvblock') == (5.0, 50.0)
+    assert time_range(run_db, 'pvstr001') is None
+
+def test_data_indexes(run_db):
+    assert create_data_indexes(run_db, verbose=False) == 2
+    assert create_data_indexes(run_db, verbose=False) == 0
+    names = [ix['name'] for ix in inspect(run_db.engine).get_indexes('pvdat001')]
+    assert names == ['pv_time_idx']
+
+    assert create_data_indexes(run_db, rebuild=True, verbose=False) == 3
+    names = [ix['name'] for ix in inspect(run_db.engine).get_indexes('pvdat001')]
+    assert names == ['pvdat001_pvtime']
+
+def test_insert_batches(run_db):
+    batches = {'pvdat001': [{'pv_id': 2, 'time': 30.0, 'value': 3.0}],
+               'pvstr001': [{'pv_id': 3, 'time': 30.0, 'value': 'Idle'},
+                            {'pv_id': 3, 'time': 31.0, 'value': None}]}
+    # COPY is for postgresql only: other servers use a multi-row insert
+    assert run_db.insert_batches(batches, use_copy=True) == 3
+    assert count_rows(run_db, 'pvdat001') == 3
+    assert count_rows(run_db, 'pvstr001') == 2
+    with pytest.raises(ValueError):
+        run_db.insert_batches({'pvdat999': batches['pvdat001']})
+
+def test_copy_rows(run_db):
+    # tuple rows are in the column order of the table
+    assert run_db.copy_rows('pvdat001', [(30.0, 2, 3.0), (40.0, 2, 4.0)]) == 2
+    assert time_range(run_db, 'pvdat001') == (10.0, 40.0)
+    with pytest.raises(ValueError):
+        run_db.copy_rows('pvdat001', [(50.0, 2)])
+
+def test_copy_buffer():
+    rows = [(1.5, 2, 'a,b', None), (2.5, 3, b'Idle', b'\x01\xff')]
+    text = copy_buffer(rows, [False, False, False, True]).getvalue()
+    assert text.splitlines() == ['1.5,2,"a,b",\\N', '2.5,3,Idle,\\x01ff']
+
+def test_run_parallel():
+    funcs = [lambda i=i: i*i for i in range(5)]
+    assert run_parallel(funcs, workers=3) == [0, 1, 4, 9, 16]
+    assert run_parallel(funcs, workers=1) == [0, 1, 4, 9, 16]
+
+    def fail():
+        raise RuntimeError('no table')
+    funcs = [lambda: 1, fail]
+    for workers in (1, 2):
+        with pytest.raises(QueryError) as err:
+            run_parallel(funcs, workers=workers, names=['a', 'b'])
+        assert list(err.value.errors) == ['b']
+        assert run_parallel(funcs, workers=workers, raise_errors=False,
+                            default=-1) == [1, -1]
+
+def test_run_parallel_timeout():
+    funcs = [lambda: 1, lambda: time.sleep(1.0)]
+    t0 = time.monotonic()
+    with pytest.raises(QueryError) as err:
+        run_parallel(funcs, workers=2, timeout=0.1, names=['fast', 'slow'])
+    assert list(err.value.errors) == ['slow']
+    assert time.monotonic() - t0 < 0.9
@@ -0,0 +1,41 @@
+import numpy as np
+from sqlalchemy import (create_engine, MetaData, Table, Column, Integer, Float,
+                        select)
+
+from pvarch.downsample import bucket_query, bucket_points, bucket_reduce
+
+def make_table(npts=100):
+    engine = create_engine('sqlite://')
+    metadata = MetaData()
+    dat = Table('pvdat001', metadata, Column('time', Float),
+                Column('pv_id', Integer), Column('value', Float))
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(dat.insert(), [{'time': float(i), 'pv_id': 1, 'value': 2.0*i}
+                                    for i in range(npts)])
+    return engine, dat
+
+def test_bucket_query():
+    engine, dat = make_table()
+    query = bucket_query(dat, 1, 0.0, 100.0, 10)
+    assert 'GROUP BY bucket ORDER BY bucket' in str(query)
+    with engine.connect() as conn:
+        rows = conn.execute(query).fetchall()
+    assert len(rows) == 10
+    assert sum(row[1] for row in rows) == 100
+    assert rows[0][2] == 0.0 and rows[-1][3] == 198.0
+    assert [row[5] for row in rows] == list(range(10))
+
+    times, values = bucket_points(tuple(zip(*rows)), method='minmax')
+    assert len(times) == 20
+    assert list(values[:4]) == [0.0, 18.0, 20.0, 38.0]
+
+def test_bucket_reduce_matches_query():
+    engine, dat = make_table()
+    with engine.connect() as conn:
+        rows = conn.execute(bucket_query(dat, 1, 0.0, 100.0, 10)).fetchall()
+        times, values = zip(*conn.execute(select(dat.c.time, dat.c.value)).fetchall())
+    for method in ('minmax', 'mean'):
+        qtimes, qvalues = bucket_points(tuple(zip(*rows)), method=method)
+        rtimes, rvalues = bucket_reduce(times, values, 0.0, 100.0, 10, method=method)
+        assert np.allclose(qtimes, rtimes) and np.allclose(qvalues, rvalues)
@@ -0,0 +1,43 @@
+import numpy as np
+from sqlalchemy import (create_engine, MetaData, Table, Column, Integer, Float,
+                        LargeBinary)
+
+from pvarch import database
+from pvarch.database import SimpleDB
+from pvarch.blocks import make_block
+from pvarch.export import iter_table_chunks
+
+def make_run(fname):
+    engine = create_engine(f'sqlite:///{fname}')
+    metadata = MetaData()
+    block = Table('pvblock', metadata, Column('id', Integer, primary_key=True),
+                  Column('pv_id', Integer), Column('time', Float),
+                  Column('t_end', Float), Column('count', Integer),
+                  Column('times', LargeBinary), Column('vals', LargeBinary))
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(block.insert(),
+                     [make_block(1, [(1.0, 1.5), (2.0, 2.5)]),
+                      make_block(2, [(1.0, 'Idle'), (3.0, 'Moving')]),
+                      make_block(3, [(2.0, 7.0)])])
+    engine.dispose()
+
+def test_block_chunks_by_kind(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SCHEMA_CACHE_DIR', str(tmp_path/'cache'))
+    fname = str(tmp_path/'run.db')
+    make_run(fname)
+    database.clear_engines()
+    db = SimpleDB(server='sqlite', dbname=fname, user='pvarch',
+                  pvarch_main='pvarch_main')
+
+    chunks = list(iter_table_chunks(db, 'pvblock', kind='float'))
+    assert len(chunks) == 1
+    pv_ids, times, values = chunks[0]
+    assert values.dtype == np.float64
+    assert list(pv_ids) == [1, 1, 3]
+    assert list(values) == [1.5, 2.5, 7.0]
+
+    pv_ids, times, values = list(iter_table_chunks(db, 'pvblock', kind='string'))[0]
+    assert list(pv_ids) == [2, 2]
+    assert list(values) == ['Idle', 'Moving']
+    database.clear_engines()
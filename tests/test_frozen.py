@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from pvarch.frozen import FrozenWriter, FrozenRun, frozen_folder, is_frozen
+from pvarch.util import Config
+
+def make_frozen_run(frozen_dir, dbname='pvdata_00001'):
+    writer = FrozenWriter(str(frozen_dir), dbname, 0.0, 1000.0)
+    times = np.arange(0.0, 100.0)
+    writer.add('A:x.VAL', 1, 'pvdat001', times, 2.0*times)
+    writer.add('B:y.VAL', 2, 'pvstr001', times[::10]+0.5,
+               np.array([str(i) for i in range(10)], dtype=object))
+    writer.close()
+    return dbname
+
+def test_frozen_run(tmp_path):
+    dbname = make_frozen_run(tmp_path)
+    assert is_frozen(str(tmp_path), dbname)
+    run = FrozenRun(frozen_folder(str(tmp_path), dbname))
+    assert run.has_pv('A:x.VAL') and not run.has_pv('C:z.VAL')
+    times, values, is_array = run.get_run_data('A:x.VAL', 10.0, 12.0)
+    assert list(times) == [10.0, 11.0, 12.0]
+    assert list(values) == [20.0, 22.0, 24.0] and not is_array
+    times, values, is_array = run.get_run_data('B:y.VAL', 0.0, 25.0)
+    assert list(values) == ['0', '1', '2']
+    assert run.extents()['B:y.VAL'] == (0.5, 90.5, 10)
+    assert run.get_snapshot(['A:x.VAL', 'B:y.VAL'], 45.0, 0.0) == {1: (45.0, 90.0),
+                                                                   2: (40.5, '4')}
+    assert run.get_run_data('C:z.VAL', 0.0, 100.0) is None
+
+def dropped_run_archiver(frozen_dir, dbname):
+    """archiver reading a frozen run whose database has been dropped"""
+    pytest.importorskip('epics')
+    from pvarch.archiver import Archiver
+    archiver = object.__new__(Archiver)
+    archiver.config = Config()
+    archiver.config.frozen_dir = str(frozen_dir)
+    archiver.dbname = 'pvdata_00002'
+    archiver.frozen = {}
+    archiver.pvinfo = {}
+    archiver.log = lambda *args, **kws: None
+    archiver.dbs_for_time = lambda t0, t1: [dbname]
+    def get_db(name):
+        raise ValueError(f"database {name} does not exist")
+    archiver.get_db = get_db
+    return archiver
+
+def test_value_at_time_frozen_run(tmp_path):
+    dbname = make_frozen_run(tmp_path)
+    archiver = dropped_run_archiver(tmp_path, dbname)
+    assert isinstance(archiver.get_run(dbname), FrozenRun)
+
+    assert archiver.get_value_at_time('A:x.VAL', 50.5) == (50.0, 100.0)
+    # values strictly before the time
+    assert archiver.get_value_at_time('A:x.VAL', 50.0) == (49.0, 98.0)
+    assert archiver.get_value_at_time('A:x.VAL', 0.0) == (None, None)
+    assert archiver.get_value_at_time('B:y.VAL', 45.0) == (40.5, '4')
+    assert archiver.get_value_at_time('C:z.VAL', 45.0) == (None, None)
@@ -0,0 +1,64 @@
+import numpy as np
+
+from pvarch.merge import (window_parts, finish_data, align_data, merge_two,
+                          merge_sorted, merge_chunks)
+
+def test_merge_two():
+    a = (np.array([1.0, 3.0, 3.0]), np.array([10.0, 30.0, 31.0]))
+    b = (np.array([0.0, 3.0, 4.0]), np.array([0.0, 32.0, 40.0]))
+    times, values = merge_two(a, b)
+    assert list(times) == [0.0, 1.0, 3.0, 3.0, 3.0, 4.0]
+    # for equal times, values from the first come first
+    assert list(values) == [0.0, 10.0, 30.0, 31.0, 32.0, 40.0]
+    times, values = merge_two(a, (np.array([2.0]), np.array(['x'], dtype=object)))
+    assert values.dtype == object and list(values) == [10.0, 'x', 30.0, 31.0]
+
+def test_merge_sorted():
+    rng = np.random.default_rng(2)
+    parts = []
+    for i in range(7):
+        times = np.sort(rng.random(20 + i))
+        parts.append((times, times*2))
+    parts.append((np.zeros(0), np.zeros(0)))
+    times, values = merge_sorted(parts)
+    assert np.array_equal(times, np.sort(np.concatenate([p[0] for p in parts])))
+    assert np.array_equal(values, times*2)
+    assert len(merge_sorted([])[0]) == 0
+
+def test_merge_chunks():
+    def chunks(times, size):
+        for i in range(0, len(times), size):
+            yield times[i:i+size], -times[i:i+size]
+    a, b = np.arange(0.0, 100.0, 2), np.arange(1.0, 100.0, 3)
+    out = list(merge_chunks([chunks(a, 7), chunks(b, 5), iter([])], chunk_size=10))
+    assert all(len(t) <= 10 for t, v in out)
+    times = np.concatenate([t for t, v in out])
+    assert np.array_equal(times, np.sort(np.concatenate((a, b))))
+    assert np.array_equal(np.concatenate([v for t, v in out]), -times)
+
+def test_window_parts():
+    times = np.arange(10.0)
+    parts = window_parts(times, times*10, 2.5, 5.0)
+    assert [list(t) for t, v in parts] == [[2.0], [3.0, 4.0, 5.0]]
+    parts = window_parts(times, times*10, 2.5, 5.0, early=False)
+    assert [list(t) for t, v in parts] == [[3.0, 4.0, 5.0]]
+    assert [list(t) for t, v in window_parts(times, times, -5, -1)] == [[]]
+
+def test_finish_data():
+    parts = [(np.array([1.0]), np.array(['2.5'], dtype=object)),
+             (np.array([0.0]), np.array([1.5]))]
+    times, values = finish_data(parts)
+    assert list(times) == [0.0, 1.0]
+    assert values.dtype == np.float64 and list(values) == [1.5, 2.5]
+    arrays = np.empty(2, dtype=object)
+    arrays[0], arrays[1] = np.arange(3.0), np.arange(2.0)
+    times, values = finish_data([(np.array([0.0, 1.0]), arrays)], is_array=True)
+    assert values.shape == (2, 3) and np.isnan(values[1, 2])
+
+def test_align_data():
+    data = {'a': (np.array([1.0, 3.0]), np.array([10.0, 30.0])),
+            'b': (np.array([2.0]), np.array(['x'], dtype=object))}
+    times, values = align_data(data)
+    assert list(times) == [1.0, 2.0, 3.0]
+    assert list(values['a']) == [10.0, 10.0, 30.0]
+    assert list(values['b']) == [None, 'x', 'x']
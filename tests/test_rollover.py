@@ -0,0 +1,38 @@
+from sqlalchemy import MetaData, Table, Column, Integer, Float, Text, LargeBinary
+
+from pvarch.database import (next_data_table, data_tablename, ARRAY_TABLE,
+                             N_DATA_TABLES, N_STRING_TABLES)
+
+def make_tables(typed=True):
+    metadata = MetaData()
+    def data_table(name, vtype):
+        return Table(name, metadata, Column('time', Float),
+                     Column('pv_id', Integer), Column('value', vtype))
+    tables = {}
+    for i in range(N_DATA_TABLES):
+        name = data_tablename(i+1, 'double')
+        tables[name] = data_table(name, Float(precision=53) if typed else Text)
+    if typed:
+        for i in range(N_STRING_TABLES):
+            name = data_tablename(i+1, 'string')
+            tables[name] = data_table(name, Text)
+        tables[ARRAY_TABLE] = data_table(ARRAY_TABLE, LargeBinary)
+    return tables
+
+def test_rollover_from_untyped_run():
+    old, new = make_tables(typed=False), make_tables()
+    # legacy text tables: string PVs move to string tables
+    table = next_data_table('S:status', 'string', 'pvdat007', old, new)
+    assert table.startswith('pvstr')
+    assert next_data_table('A:x.VAL', 'double', 'pvdat007', old, new).startswith('pvdat')
+
+def test_rollover_keeps_matching_table():
+    old, new = make_tables(), make_tables()
+    assert next_data_table('A:x.VAL', 'double', 'pvdat007', old, new) == 'pvdat007'
+    assert next_data_table('S:status', 'string', 'pvstr003', old, new) == 'pvstr003'
+    assert next_data_table('W:wave', 'array', ARRAY_TABLE, old, new) == ARRAY_TABLE
+
+def test_rollover_to_untyped_run():
+    old, new = make_tables(), make_tables(typed=False)
+    assert next_data_table('S:status', 'string', 'pvstr003', old, new).startswith('pvdat')
+    assert next_data_table('W:wave', 'array', ARRAY_TABLE, old, new).startswith('pvdat')
@@ -0,0 +1,48 @@
+import numpy as np
+
+from pvarch.database import rollup_tablename
+from pvarch.rollup import RollupAccumulator, rollup_rows, choose_resolution
+
+def test_rollup_rows():
+    times = np.array([0.0, 30.0, 59.0, 60.0, 61.0, 200.0])
+    values = np.array([1.0, 3.0, np.nan, 5.0, 7.0, 2.0])
+    rows = rollup_rows(9, times, values, 60)
+    assert [row['time'] for row in rows] == [0.0, 60.0, 180.0]
+    assert [row['count'] for row in rows] == [2, 2, 1]
+    first = rows[0]
+    assert (first['pv_id'], first['vmin'], first['vmax'], first['vmean']) == (9, 1.0, 3.0, 2.0)
+    assert (first['vfirst'], first['vlast']) == (1.0, 3.0)
+    assert rollup_rows(9, [1.0], [np.nan], 60) == []
+
+def test_accumulator_matches_rollup_rows():
+    rng = np.random.default_rng(3)
+    times = np.sort(rng.random(1000))*7200.0
+    values = rng.normal(size=1000)
+    acc = RollupAccumulator(resolutions=(60, 3600))
+    batches = {}
+    for t, v in zip(times, values):
+        for tname, rows in acc.add(5, t, v).items():
+            batches.setdefault(tname, []).extend(rows)
+    assert acc.add(5, 7300.0, np.nan) == {}
+    for tname, rows in acc.flush().items():
+        batches.setdefault(tname, []).extend(rows)
+    assert len(acc) == 0
+    for res in (60, 3600):
+        expected = rollup_rows(5, times, values, res)
+        rows = batches[rollup_tablename(res)]
+        assert len(rows) == len(expected)
+        for row, exp in zip(rows, expected):
+            assert row.keys() == exp.keys()
+            assert np.allclose([row[k] for k in exp], [exp[k] for k in exp])
+
+def test_accumulator_flush_before():
+    acc = RollupAccumulator(resolutions=(60,))
+    acc.add(1, 10.0, 1.0)
+    acc.add(2, 70.0, 1.0)
+    assert [row['pv_id'] for row in acc.flush(before=65.0)['pvroll60']] == [1]
+    assert len(acc) == 1
+
+def test_choose_resolution():
+    assert choose_resolution(0, 86400*30, 20) == 86400
+    assert choose_resolution(0, 86400, 20) == 3600
+    assert choose_resolution(0, 600, 20) is None
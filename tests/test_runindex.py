@@ -0,0 +1,23 @@
+from collections import namedtuple
+
+from pvarch.runindex import RunIndex
+
+Run = namedtuple('Run', ('db', 'start_time', 'stop_time'))
+
+def names(runs):
+    return [run.db for run in runs]
+
+def test_overlapping():
+    index = RunIndex([Run('r3', 200, 2e9), Run('r1', 0, 100), Run('r2', 100, 200)])
+    assert len(index) == 3
+    assert names(index.overlapping(50, 150)) == ['r1', 'r2']
+    assert names(index.overlapping(100, 200)) == ['r2']
+    assert names(index.overlapping(250, 260)) == ['r3']
+    assert names(index.overlapping(-10, 0)) == []
+    assert names(RunIndex([]).overlapping(0, 100)) == []
+
+def test_long_run_overlapping_later_runs():
+    # a run with a late stop time is found after shorter, later runs
+    index = RunIndex([Run('long', 0, 1000), Run('a', 10, 20), Run('b', 30, 40)])
+    assert names(index.overlapping(500, 600)) == ['long']
+    assert names(index.overlapping(15, 35)) == ['long', 'a', 'b']
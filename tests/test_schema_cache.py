@@ -0,0 +1,66 @@
+import os
+
+from sqlalchemy import (create_engine, text, MetaData, Table, Column,
+                        Integer, Float, String)
+from sqlalchemy.types import NullType
+
+from pvarch import database
+
+def make_db(fname):
+    engine = create_engine(f'sqlite:///{fname}')
+    metadata = MetaData()
+    Table('pv', metadata, Column('id', Integer, primary_key=True),
+          Column('name', String(128)), Column('data_table', String(16)))
+    dat = Table('pvdat001', metadata, Column('time', Float(precision=53)),
+                Column('pv_id', Integer), Column('value', Float(precision=53)))
+    metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(dat.insert(), [{'time': float(i), 'pv_id': 1, 'value': 2.0*i}
+                                    for i in range(100)])
+    engine.dispose()
+
+def load_tables(fname):
+    database.clear_engines()
+    engine = database.get_engine(f'sqlite:///{fname}')
+    return engine, database.get_tables(engine)
+
+def test_tables_from_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SCHEMA_CACHE_DIR', str(tmp_path/'cache'))
+    fname = str(tmp_path/'run.db')
+    make_db(fname)
+
+    # reflect tables, saving column definitions to the cache
+    engine, tables = load_tables(fname)
+    assert tables['pvdat001'] is not None
+    cachefile = tables.cachefile
+    assert os.path.exists(cachefile)
+
+    # make tables from the cache, without reflecting them
+    engine, tables = load_tables(fname)
+    assert tables.cachefile == cachefile
+    assert 'pvdat001' in tables.columns
+    def no_reflect(*args, **kws):
+        assert 'autoload_with' not in kws, 'reflected'
+        return Table(*args, **kws)
+    monkeypatch.setattr(database, 'Table', no_reflect)
+    dtable = tables['pvdat001']
+    for col in dtable.columns:
+        assert not isinstance(col.type, NullType)
+    with engine.connect() as conn:
+        assert conn.execute(dtable.select()).fetchone() == (0.0, 1, 0.0)
+    database.clear_engines()
+
+def test_cache_keyed_on_columns(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SCHEMA_CACHE_DIR', str(tmp_path/'cache'))
+    fname = str(tmp_path/'run.db')
+    make_db(fname)
+    engine, tables = load_tables(fname)
+    tables['pvdat001']
+    cachefile = tables.cachefile
+
+    with engine.begin() as conn:
+        conn.execute(text('alter table pvdat001 add column severity integer'))
+    engine, tables = load_tables(fname)
+    assert tables.cachefile != cachefile
+    assert 'severity' in tables['pvdat001'].columns
+    database.clear_engines()
@@ -0,0 +1,105 @@
+import pytest
+from sqlalchemy import (create_engine, MetaData, Table, Column, Integer, Float,
+                        Text, LargeBinary, select)
+
+from pvarch import database
+from pvarch.database import SimpleDB, count_rows
+from pvarch.blocks import make_block, decode_values
+from pvarch.spool import (Spool, HEADER, RECORD_V1, FLOAT, SPOOL_MAGIC_V1,
+                          VTYPE_FLOAT, VTYPE_BYTES)
+
+def make_run(fname):
+    engine = create_engine(f'sqlite:///{fname}')
+    metadata = MetaData()
+    Table('pvdat001', metadata, Column('time', Float),
+          Column('pv_id', Integer), Column('value', Float))
+    Table('pvstr001', metadata, Column('time', Float),
+          Column('pv_id', Integer), Column('value', Text))
+    Table('pvblock', metadata, Column('id', Integer, primary_key=True),
+          Column('pv_id', Integer), Column('time', Float),
+          Column('t_end', Float), Column('count', Integer),
+          Column('times', LargeBinary), Column('vals', LargeBinary))
+    metadata.create_all(engine)
+    engine.dispose()
+    return SimpleDB(server='sqlite', dbname=fname, user='pvarch',
+                    pvarch_main='pvarch_main')
+
+@pytest.fixture
+def runs(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SCHEMA_CACHE_DIR', str(tmp_path/'cache'))
+    database.clear_engines()
+    yield [make_run(str(tmp_path/f'run{i}.db')) for i in (1, 2)]
+    database.clear_engines()
+
+def rows(db, tname):
+    "rows of a data table, with text values that were written as bytes decoded"
+    tab = db.tables[tname]
+    query = select(tab.c.pv_id, tab.c.time, tab.c.value).order_by(tab.c.time)
+    return [(pv_id, ts, value.decode('utf-8') if isinstance(value, bytes) else value)
+            for pv_id, ts, value in db.execute(query).fetchall()]
+
+BATCH = {'pvdat001': [{'pv_id': 1, 'time': 1.0, 'value': 1.5},
+                      {'pv_id': 1, 'time': 2.0, 'value': None}],
+         'pvstr001': [{'pv_id': 2, 'time': 1.0, 'value': 'Idle'}],
+         'pvblock': [make_block(3, [(1.0, 'a'), (2.0, 'b')])]}
+
+def test_append_replay(tmp_path, runs):
+    db = runs[0]
+    spool = Spool(str(tmp_path/'spool.bin'))
+    assert spool.append(BATCH, db.dbname) == 4
+    assert spool.append({'pvdat001': []}, db.dbname) == 0
+    assert spool.pending() > 0
+    assert spool.replay(db, max_rows=2) == 4
+    assert spool.pending() == 0
+    assert rows(db, 'pvdat001') == [(1, 1.0, 1.5), (1, 2.0, None)]
+    assert rows(db, 'pvstr001') == [(2, 1.0, 'Idle')]
+    block = db.execute(db.tables['pvblock'].select()).fetchone()
+    assert (block.pv_id, block.t_end, block.count) == (3, 2.0, 2)
+    assert decode_values(block.vals) == ['a', 'b']
+    spool.close()
+
+def test_reopen(tmp_path, runs):
+    db = runs[0]
+    spool = Spool(str(tmp_path/'spool.bin'))
+    spool.append(BATCH, db.dbname)
+    pending = spool.pending()
+    spool.close()
+    spool = Spool(str(tmp_path/'spool.bin'))
+    assert spool.pending() == pending
+    assert spool.replay(db) == 4
+    spool.close()
+
+def test_replay_to_own_run(tmp_path, runs):
+    db1, db2 = runs
+    spool = Spool(str(tmp_path/'spool.bin'))
+    spool.append({'pvdat001': [{'pv_id': 1, 'time': 1.0, 'value': 1.0}]}, db2.dbname)
+    spool.append({'pvdat001': [{'pv_id': 1, 'time': 2.0, 'value': 2.0}]}, db1.dbname)
+    assert spool.replay(db1) == 2
+    assert rows(db1, 'pvdat001') == [(1, 2.0, 2.0)]
+    assert count_rows(SimpleDB(db2.dbname, **db1.connection_args), 'pvdat001') == 1
+    spool.close()
+
+def test_upgrade_v1(tmp_path, runs):
+    db = runs[0]
+    records = []
+    for tname, vtype, vbytes in ((b'pvdat001', VTYPE_FLOAT, FLOAT.pack(2.5)),
+                                 (b'pvstr001', VTYPE_BYTES, b'Moving')):
+        records.append(RECORD_V1.pack(7, 5.0, vtype, len(tname), len(vbytes))
+                       + tname + vbytes)
+    data = b''.join(records)
+    fname = str(tmp_path/'spool_v1.bin')
+    with open(fname, 'wb') as fh:
+        fh.write(HEADER.pack(SPOOL_MAGIC_V1, HEADER.size, HEADER.size + len(data)))
+        fh.write(data)
+
+    spool = Spool(fname)
+    assert spool.replay(db) == 2
+    assert rows(db, 'pvdat001') == [(7, 5.0, 2.5)]
+    assert rows(db, 'pvstr001') == [(7, 5.0, 'Moving')]
+    spool.close()
+
+def test_not_a_spool(tmp_path):
+    fname = tmp_path/'other.bin'
+    fname.write_bytes(b'x'*100)
+    with pytest.raises(ValueError):
+        Spool(str(fname))
@@ -0,0 +1,74 @@
+import pytest
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, Float
+
+from pvarch import database
+from pvarch.database import SimpleDB, count_rows
+from pvarch.spool import Spool
+from pvarch.writer import ArchiveWriter
+
+@pytest.fixture
+def run_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'SCHEMA_CACHE_DIR', str(tmp_path/'cache'))
+    database.clear_engines()
+    fname = str(tmp_path/'run.db')
+    engine = create_engine(f'sqlite:///{fname}')
+    metadata = MetaData()
+    Table('pvdat001', metadata, Column('time', Float),
+          Column('pv_id', Integer), Column('value', Float))
+    metadata.create_all(engine)
+    engine.dispose()
+    yield SimpleDB(server='sqlite', dbname=fname, user='pvarch',
+                   pvarch_main='pvarch_main')
+    database.clear_engines()
+
+def batch(t0, n=3, tname='pvdat001'):
+    return {tname: [{'pv_id': 1, 'time': t0+i, 'value': float(i)} for i in range(n)]}
+
+def test_writer(run_db):
+    writer = ArchiveWriter(run_db, nthreads=2, max_rows=4)
+    writer.start()
+    for i in range(10):
+        assert writer.put(batch(10.0*i))
+    assert writer.put({'pvdat001': []})
+    writer.stop()
+    stats = writer.stats()
+    assert stats['queued'] == stats['written'] == 30
+    assert stats['depth'] == stats['errors'] == stats['dropped'] == 0
+    assert count_rows(run_db, 'pvdat001') == 30
+
+def test_queue_policies(run_db):
+    with pytest.raises(ValueError):
+        ArchiveWriter(run_db, policy='ignore')
+    # writer threads are not started, so the queue fills up
+    writer = ArchiveWriter(run_db, maxsize=1, policy='drop_newest')
+    assert writer.put(batch(0.0))
+    assert not writer.put(batch(10.0, n=2))
+    assert writer.stats()['dropped'] == 2
+    assert writer.congested()
+
+    writer = ArchiveWriter(run_db, maxsize=1, policy='drop_oldest')
+    assert writer.put(batch(0.0))
+    assert writer.put(batch(10.0, n=2))
+    assert writer.stats()['dropped'] == 3
+    assert writer.queue.get_nowait()['pvdat001'][0]['time'] == 10.0
+
+def test_failed_batch(run_db):
+    writer = ArchiveWriter(run_db)
+    writer.start()
+    writer.put(batch(0.0, tname='pvdat999'))
+    writer.stop()
+    stats = writer.stats()
+    assert (stats['errors'], stats['written']) == (1, 0)
+
+def test_spool_writer(tmp_path, run_db):
+    spool = Spool(str(tmp_path/'spool.bin'))
+    writer = ArchiveWriter(run_db, nthreads=4, spool=spool)
+    assert len(writer.threads) == 1
+    writer.start()
+    for i in range(5):
+        writer.put(batch(10.0*i))
+    writer.stop()
+    assert writer.stats()['written'] == 15
+    assert spool.pending() == 0
+    assert count_rows(run_db, 'pvdat001') == 15
+    spool.close()